@@ -0,0 +1,514 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# The scripts of the three parts are imported from their folders, profiling.py is in this folder.
+ROOT = Path(__file__).resolve().parent
+for part in ("part-one", "part-two", "part-three"):
+    sys.path.append(str(ROOT / part))
+
+from profiling import peak_rss_mb
+from sentence_split import main as split_file, split_sentences
+from bigram import BigramModel, read_sentences
+from naive_bayes import NaiveBayes, return_files
+
+
+# This script benchmarks the sentence splitter, the bigram model and the Naive Bayes classifier on synthetic corpora
+# that are generated from a seed, so a run can be repeated exactly at any size. Each benchmark is run in a new process
+# so the peak memory measured is its own, and the results are written as JSON so a later run can be compared with them.
+
+# Abbreviations the sentence splitter must not split at, placed in the middle of sentences as the splitter does not
+# handle them at the end of one.
+TITLES = ("Mr.", "Mrs.", "Ms.", "Dr.", "Prof.", "St.", "Capt.", "Lt.")
+COMPANIES = ("Inc.", "Ltd.", "Co.", "Jr.", "Sr.")
+ACRONYMS = ("U.S.A.", "U.K.I.", "E.U.R.")
+WEBSITES = ("www.example.com", "news.example.org", "shop.example.co.uk", "data.example.io")
+
+# The punctuation that is split from the words of a review, as in review_polarity.
+REVIEW_PUNCTUATION = (",", ".", "(", ")", "!", "?", "'s", "\"")
+
+# The default sizes of the corpora, multiplied by --scale.
+SIZES = {"prose_sentences": 20000, "bigram_sentences": 50000, "vocabulary": 20000, "classes": 4,
+         "reviews_per_class": 250, "review_words": 300}
+
+# The most items to time one at a time for the latency percentiles.
+LATENCY_SAMPLES = 2000
+
+# Results are regressions if a throughput falls, or a latency or the memory rises, by more than this fraction.
+THRESHOLD = 0.1
+
+
+def make_vocabulary(size: int, rng):
+    """
+    This function makes a vocabulary of distinct random lowercase words, from 2 to 10 letters long.
+    :param size: The number of words
+    :param rng: The numpy random generator
+    :return: List of words
+    """
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = {}
+
+    while len(words) < size:
+        for length in rng.integers(2, 11, size=size - len(words)):
+            words["".join(letters[rng.integers(0, 26, size=length)])] = None
+
+    return list(words)
+
+
+def zipf_probabilities(size: int, exponent: float = 1.1):
+    """
+    This function gives the probability of each rank of a Zipfian distribution, where the probability of the word of
+    rank r is proportional to 1 / r^exponent, as the frequencies of words in text are.
+    :param size: The number of ranks
+    :param exponent: The exponent of the distribution
+    :return: Array of the probability of each rank
+    """
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_prose(path, sentences: int, vocabulary: list, seed: int = 0):
+    """
+    This function writes prose for the sentence splitter, with sentences ending in a period, question mark or
+    exclamation mark and many of the abbreviations, acronyms, web addresses, decimals and quotations that are not the
+    end of a sentence. There are a few sentences on each line and a blank line between paragraphs.
+    :param path: The file to write
+    :param sentences: The number of sentences
+    :param vocabulary: List of words, ordered from the most to the least frequent
+    :param seed: The seed for the random generator
+    :return: The number of sentences written
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(4, 25, size=sentences)
+    words = np.array(vocabulary, dtype=object)[rng.choice(len(vocabulary), size=int(lengths.sum()),
+                                                          p=zipf_probabilities(len(vocabulary)))]
+    positions = rng.integers(1, lengths)
+    extras = rng.random((sentences, 5))
+    ends = rng.choice([".", ".", ".", "?", "!"], size=sentences)
+
+    with open(path, "w", encoding="utf-8") as f:
+        start = 0
+        for i, length in enumerate(lengths):
+            sentence = list(words[start:start + length])
+            start += length
+            sentence[0] = sentence[0].capitalize()
+
+            # Each kind of text that is not the end of a sentence is put in the middle of some of the sentences.
+            middle = positions[i]
+            name = sentence[middle].capitalize()
+            if extras[i, 0] < 0.3:
+                sentence.insert(middle, f"{TITLES[i % len(TITLES)]} {name}")
+            if extras[i, 1] < 0.15:
+                sentence.insert(middle, f"{name} {COMPANIES[i % len(COMPANIES)]}")
+            if extras[i, 2] < 0.1:
+                sentence.insert(middle, f"the {ACRONYMS[i % len(ACRONYMS)]} and")
+            if extras[i, 3] < 0.1:
+                sentence.insert(middle, f"at {WEBSITES[i % len(WEBSITES)]} for {extras[i, 3] * 1000:.2f}")
+            if extras[i, 4] < 0.1:
+                sentence.insert(middle, f"\"{name}{'!' if extras[i, 4] < 0.05 else '?'}\"")
+
+            f.write(" ".join(sentence) + ends[i])
+            f.write("\n\n" if i % 20 == 19 else "\n" if i % 4 == 3 else " ")
+
+    return sentences
+
+
+def generate_bigram_corpus(path, sentences: int, vocabulary: list, seed: int = 0):
+    """
+    This function writes a corpus for the bigram model in the format of training.txt, a sentence on each line with
+    <s> and </s> around it. The words are drawn from a Zipfian distribution.
+    :param path: The file to write
+    :param sentences: The number of sentences
+    :param vocabulary: List of words, ordered from the most to the least frequent
+    :param seed: The seed for the random generator
+    :return: The number of sentences written
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(3, 30, size=sentences)
+    words = np.array(vocabulary, dtype=object)[rng.choice(len(vocabulary), size=int(lengths.sum()),
+                                                          p=zipf_probabilities(len(vocabulary)))]
+
+    with open(path, "w", encoding="utf-8") as f:
+        start = 0
+        for length in lengths:
+            f.write("<s> " + " ".join(words[start:start + length]) + " </s>\n")
+            start += length
+
+    return sentences
+
+
+def generate_reviews(directory, classes: int, reviews_per_class: int, review_words: int, vocabulary: list,
+                     seed: int = 0, split: int = 0):
+    """
+    This function writes a labelled review tree for the Naive Bayes classifier, with a subdirectory for each class and
+    a file for each review, in the format of review_polarity: lowercase words and punctuation separated by spaces. All
+    the classes share the Zipfian distribution of the vocabulary, but each class favours its own words, so the classes
+    can be told apart about as well as real reviews but not perfectly.
+    :param directory: The directory to write the classes to
+    :param classes: The number of classes
+    :param reviews_per_class: The number of reviews of each class
+    :param review_words: The mean number of words in a review
+    :param vocabulary: List of words, ordered from the most to the least frequent
+    :param seed: The seed for the random generator
+    :param split: The number of the split, the reviews of each split are different but the classes are the same
+    :return: The number of reviews written
+    """
+    rng = np.random.default_rng([seed, split])
+    vocabulary = np.array(vocabulary + list(REVIEW_PUNCTUATION), dtype=object)
+    base = zipf_probabilities(len(vocabulary))
+
+    for c in range(classes):
+        # Each class has a random tenth of the words made twice as likely, the same in every split.
+        probabilities = base.copy()
+        favoured = np.random.default_rng([seed, classes, c]).choice(len(vocabulary), size=len(vocabulary) // 10,
+                                                                     replace=False)
+        probabilities[favoured] *= 2
+        probabilities /= probabilities.sum()
+
+        class_directory = Path(directory) / f"class{c}"
+        class_directory.mkdir(parents=True, exist_ok=True)
+
+        lengths = rng.poisson(review_words, size=reviews_per_class) + 1
+        words = vocabulary[rng.choice(len(vocabulary), size=int(lengths.sum()), p=probabilities)]
+
+        start = 0
+        for i, length in enumerate(lengths):
+            (class_directory / f"review{i:06d}.txt").write_text(" ".join(words[start:start + length]) + "\n")
+            start += length
+
+    return classes * reviews_per_class
+
+
+def generate(directory, sizes: dict, seed: int = 0):
+    """
+    This function generates every corpus used by the benchmarks into a directory. The corpora are only generated again
+    if the directory does not already hold corpora of the same sizes and seed. A directory is only replaced if it holds
+    the corpus.json written here, any other directory must be empty or not exist.
+    :param directory: The directory to write the corpora to
+    :param sizes: Dictionary of the sizes of the corpora, see SIZES
+    :param seed: The seed for the random generator
+    :return: Dictionary of the paths of the corpora
+    """
+    directory = Path(directory).resolve()
+    paths = {"prose": directory / "prose.txt", "bigram_train": directory / "bigram_train.txt",
+             "bigram_test": directory / "bigram_test.txt", "reviews_train": directory / "reviews" / "training",
+             "reviews_test": directory / "reviews" / "test"}
+
+    config_path = directory / "corpus.json"
+    config = {"sizes": sizes, "seed": seed}
+    if config_path.exists() and json.loads(config_path.read_text()) == config:
+        return paths
+
+    # Only a directory marked by the corpus.json of an earlier run is removed. Any other directory is left alone, in
+    # case the path was given by mistake.
+    if config_path.exists():
+        shutil.rmtree(directory)
+    elif directory.exists() and any(directory.iterdir()):
+        raise FileExistsError(f"{directory} is not empty and does not hold corpora generated by benchmark.py")
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # The config is written first marked as incomplete, so a directory that was only partly generated is still known
+    # to be one of ours, and does not match any config when it is checked.
+    config_path.write_text(json.dumps({**config, "complete": False}))
+
+    vocabulary = make_vocabulary(sizes["vocabulary"], np.random.default_rng(seed))
+    generate_prose(paths["prose"], sizes["prose_sentences"], vocabulary, seed)
+    generate_bigram_corpus(paths["bigram_train"], sizes["bigram_sentences"], vocabulary, seed)
+
+    # The test sentences are drawn from the same distribution, a tenth as many as for training.
+    generate_bigram_corpus(paths["bigram_test"], max(sizes["bigram_sentences"] // 10, 1), vocabulary, seed + 1)
+
+    # The test reviews are a fifth as many as for training, with the same class distributions.
+    generate_reviews(paths["reviews_train"], sizes["classes"], sizes["reviews_per_class"], sizes["review_words"],
+                     vocabulary, seed)
+    generate_reviews(paths["reviews_test"], sizes["classes"], max(sizes["reviews_per_class"] // 5, 1),
+                     sizes["review_words"], vocabulary, seed, split=1)
+
+    # The complete config is written last, so corpora that were only partly generated are generated again.
+    config_path.write_text(json.dumps(config))
+    return paths
+
+
+def latencies(function, items):
+    """
+    This function times a function on each of a sample of items on its own.
+    :param function: The function to call with each item
+    :param items: List of items
+    :return: Dictionary of the 50th, 90th and 99th percentile of the times in milliseconds
+    """
+    step = max(len(items) // LATENCY_SAMPLES, 1)
+    times = []
+
+    for item in items[::step]:
+        start = time.perf_counter()
+        function(item)
+        times.append(time.perf_counter() - start)
+
+    p50, p90, p99 = np.percentile(np.array(times) * 1000, [50, 90, 99])
+    return {"p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99)}
+
+
+def bench_split_sentences(paths):
+    """
+    This function benchmarks split_sentences on the whole of the prose in memory, and times it on each paragraph.
+    :param paths: Dictionary of the paths of the corpora
+    :return: Dictionary of the results
+    """
+    text = paths["prose"].read_text(encoding="utf-8")
+
+    start = time.perf_counter()
+    sentences = split_sentences(text).count("\n") + 1
+    seconds = time.perf_counter() - start
+
+    return {"seconds": seconds, "sentences": sentences, "characters": len(text),
+            "sentences_per_second": sentences / seconds, "characters_per_second": len(text) / seconds,
+            **latencies(split_sentences, text.split("\n\n"))}
+
+
+def bench_split_file(paths):
+    """
+    This function benchmarks splitting the prose file into sentences as the script does, streaming it from and to disk.
+    :param paths: Dictionary of the paths of the corpora
+    :return: Dictionary of the results
+    """
+    size = os.path.getsize(paths["prose"])
+
+    start = time.perf_counter()
+    split_file(str(paths["prose"]))
+    seconds = time.perf_counter() - start
+
+    return {"seconds": seconds, "bytes": size, "bytes_per_second": size / seconds}
+
+
+def bench_bigram_train(paths):
+    """
+    This function benchmarks training a BigramModel on the bigram corpus, read from disk a batch at a time.
+    :param paths: Dictionary of the paths of the corpora
+    :return: Dictionary of the results
+    """
+    start = time.perf_counter()
+    model = BigramModel()
+    model.train(read_sentences(str(paths["bigram_train"])))
+    seconds = time.perf_counter() - start
+
+    sentences = sum(1 for _ in read_sentences(str(paths["bigram_train"])))
+    tokens = int(model.unigram_counts.sum())
+    return {"seconds": seconds, "sentences": sentences, "tokens": tokens, "bigrams": len(model.bigram_keys),
+            "sentences_per_second": sentences / seconds, "tokens_per_second": tokens / seconds}
+
+
+def bench_bigram_predict(paths):
+    """
+    This function benchmarks predict_sentence on every test sentence, and times it on each of a sample of them. A test
+    sentence with a bigram not seen in training raises a KeyError as in run, which is part of the time.
+    :param paths: Dictionary of the paths of the corpora
+    :return: Dictionary of the results
+    """
+    model = BigramModel()
+    model.train(read_sentences(str(paths["bigram_train"])))
+    sentences = list(read_sentences(str(paths["bigram_test"])))
+
+    def predict(sentence):
+        try:
+            return model.predict_sentence(sentence)
+        except KeyError:
+            return 0.0
+
+    start = time.perf_counter()
+    unseen = sum(predict(sentence) == 0.0 for sentence in sentences)
+    seconds = time.perf_counter() - start
+
+    return {"seconds": seconds, "sentences": len(sentences), "unseen_fraction": unseen / len(sentences),
+            "sentences_per_second": len(sentences) / seconds, **latencies(predict, sentences)}
+
+
+def bench_naive_bayes_train(paths):
+    """
+    This function benchmarks training a NaiveBayes model on the training reviews.
+    :param paths: Dictionary of the paths of the corpora
+    :return: Dictionary of the results
+    """
+    start = time.perf_counter()
+    training_data = return_files(paths["reviews_train"])
+    model = NaiveBayes(training_data.keys(), 0.9)
+    model.train(training_data)
+    seconds = time.perf_counter() - start
+
+    documents = sum(model.doc_count.values())
+    tokens = sum(model.total_words.values())
+    return {"seconds": seconds, "documents": documents, "tokens": tokens, "unique_words": len(model.unique),
+            "documents_per_second": documents / seconds, "tokens_per_second": tokens / seconds}
+
+
+def bench_naive_bayes_test(paths):
+    """
+    This function benchmarks NaiveBayes.test on the test reviews, without copying the files or writing the probability
+    tables so that the prediction is measured rather than the disk, and times predicting each of a sample of the reviews
+    on its own. The results folder is written to a temporary directory.
+    :param paths: Dictionary of the paths of the corpora
+    :return: Dictionary of the results
+    """
+    training_data = return_files(paths["reviews_train"])
+    model = NaiveBayes(training_data.keys(), 0.9)
+    model.train(training_data)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        output = io.StringIO()
+
+        start = time.perf_counter()
+        test_data = return_files(paths["reviews_test"])
+        with contextlib.redirect_stdout(output):
+            model.test(test_data, copy="none", manifest=True, tables="none")
+        seconds = time.perf_counter() - start
+
+    documents = sum(len(files) for files in test_data.values())
+    docs = [Path(file).read_text() for files in test_data.values() for file in files]
+
+    # The last line printed by test is the overall accuracy.
+    accuracy = float(output.getvalue().split()[-1])
+    return {"seconds": seconds, "documents": documents, "accuracy": accuracy,
+            "documents_per_second": documents / seconds, **latencies(lambda doc: model.predict_batch([doc]), docs)}
+
+
+BENCHMARKS = {
+    "sentence_split.split_sentences": bench_split_sentences,
+    "sentence_split.main": bench_split_file,
+    "bigram.train": bench_bigram_train,
+    "bigram.predict_sentence": bench_bigram_predict,
+    "naive_bayes.train": bench_naive_bayes_train,
+    "naive_bayes.test": bench_naive_bayes_test,
+}
+
+
+def run_benchmark(name, paths):
+    """
+    This function runs a benchmark and adds the peak memory of the process to its results. It is run in a new process
+    for each benchmark, so the peak memory is that of the benchmark alone.
+    :param name: The name of the benchmark
+    :param paths: Dictionary of the paths of the corpora
+    :return: Dictionary of the results
+    """
+    result = BENCHMARKS[name](paths)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run(directory, sizes: dict, seed: int = 0, repeat: int = 3, names=None):
+    """
+    This function generates the corpora and runs the benchmarks. Each benchmark is run repeat times, each in a new
+    process, and the run with the median time is kept, along with the time of every run.
+    :param directory: The directory to generate the corpora in
+    :param sizes: Dictionary of the sizes of the corpora, see SIZES
+    :param seed: The seed for the random generator
+    :param repeat: The number of times to run each benchmark
+    :param names: List of the benchmarks to run, or None to run them all
+    :return: Dictionary of the sizes, seed and environment of the run and the results of each benchmark
+    """
+    start = time.perf_counter()
+    paths = generate(directory, sizes, seed)
+    print(f"Generated the corpora in {time.perf_counter() - start:.2f}s")
+
+    results = {}
+    for name in names or BENCHMARKS:
+        runs = []
+        for _ in range(repeat):
+            with multiprocessing.Pool(1) as pool:
+                runs.append(pool.apply(run_benchmark, (name, paths)))
+
+        runs.sort(key=lambda result: result["seconds"])
+        results[name] = {**runs[len(runs) // 2], "all_seconds": [result["seconds"] for result in runs]}
+        print(f"{name}: " + ", ".join(f"{key} {value:.4g}" for key, value in results[name].items()
+                                      if key.endswith(("_per_second", "_ms", "peak_rss_mb"))))
+
+    return {"sizes": sizes, "seed": seed, "repeat": repeat, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                            "platform": platform.platform(), "cpus": os.cpu_count()},
+            "results": results}
+
+
+def compare(current: dict, baseline: dict, threshold: float = THRESHOLD):
+    """
+    This function compares the results of a run with the results of an earlier run, printing the change in each
+    throughput, latency and peak memory. A throughput that fell, or a latency or peak memory that rose, by more than the
+    threshold is a regression. Runs on corpora of different sizes or seeds can not be compared.
+    :param current: The results of this run
+    :param baseline: The results of the earlier run
+    :param threshold: The fraction a result can change by before it is a regression
+    :return: List of the regressions, each a string naming the benchmark and result
+    """
+    if (current["sizes"], current["seed"]) != (baseline["sizes"], baseline["seed"]):
+        raise ValueError("The runs were made on corpora of different sizes or seeds")
+
+    regressions = []
+    for name, result in current["results"].items():
+        for key, value in result.items():
+            old = baseline["results"].get(name, {}).get(key)
+            if not old or not isinstance(value, float) or not key.endswith(("_per_second", "_ms", "peak_rss_mb")):
+                continue
+
+            # Higher is better for a throughput, lower is better for a latency or the memory.
+            change = value / old - 1
+            worse = -change if key.endswith("_per_second") else change
+            flag = "REGRESSION" if worse > threshold else ""
+            if flag:
+                regressions.append(f"{name} {key}")
+
+            print(f"{name} {key}: {old:.4g} -> {value:.4g} ({change:+.1%}) {flag}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sentence splitter, bigram model and Naive Bayes "
+                                                 "classifier on seeded synthetic corpora.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the size of every corpus by this")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for generating the corpora")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to run each benchmark")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Only run these benchmarks")
+    parser.add_argument("--data", help="Directory to generate the corpora in and keep them for later runs, by default "
+                                       "a temporary directory")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of the results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Fraction a result can get worse by before it is a regression")
+    for size, default in SIZES.items():
+        parser.add_argument(f"--{size.replace('_', '-')}", type=int, help=f"Size of {size}, {default} by default")
+    args = parser.parse_args()
+
+    # The sizes given are used as they are, the others are the defaults times the scale. The number of classes and the
+    # length of the reviews do not grow with the scale.
+    sizes = {size: getattr(args, size) or (default if size in ("classes", "review_words")
+                                           else max(int(default * args.scale), 1))
+             for size, default in SIZES.items()}
+
+    output = Path(args.output).resolve()
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    if args.data:
+        try:
+            current = run(args.data, sizes, args.seed, args.repeat, args.only)
+        except FileExistsError as error:
+            parser.error(str(error))
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            current = run(Path(directory) / "corpora", sizes, args.seed, args.repeat, args.only)
+
+    output.write_text(json.dumps(current, indent=2) + "\n")
+    print(f"Wrote the results to {output}")
+
+    if baseline:
+        regressions = compare(current, baseline, args.threshold)
+        print(f"{len(regressions)} regressions" + (": " + ", ".join(regressions) if regressions else ""))
+        sys.exit(1 if regressions else 0)
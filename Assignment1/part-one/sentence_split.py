@@ -1,93 +1,363 @@
+import argparse
+import codecs
 import io
+import multiprocessing
+import os
 import re
 import sys
+from pathlib import Path
+
+# The profiling module is shared by the three parts of the assignment, it is in the folder above this one.
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from profiling import profiler
 
 
 # This script makes use of the io, re and sys libraries in Python. The io library is used to read in the file in
 # utf-8 format to correctly load characters. The re library is used to find the occurrences of periods,
 # quotation marks and exclamation marks that are not the end of a sentence. This allows for the text to then be split
-# into the constituent sentences. The sys module is used to read in command line arguments as an option of running
-# the script
+# into the constituent sentences. The argparse module is used to read in command line arguments as an option of
+# running the script, and multiprocessing to split many files or one large file across several processes.
+
+# These are a set of possible occurrences of a period in context that is likely not the end of a sentence. Prefixes
+# such as Dr. and suffixes such as Co. come before the period, the top level domains of web addresses come after it.
+PREFIXES = ("Mr", "St", "Mrs", "Ms", "Dr", "Prof", "Capt", "Cpt", "Lt", "Mt", "www")
+SUFFIXES = ("Inc", "Ltd", "Jr", "Sr", "Co")
+WEBSITES = ("ie", "com", "net", "org", "io", "gov", "me", "edu")
+
+# Unfortunately, this method will fail to split a sentence when one of these possibilties occurs as the end of a
+# sentence.
+# E.g. Last week he travelled to the U.S.A. He flew in to New York on a jet.
+
+# A period is the end of a sentence unless one of the checks around it says otherwise. These are all lookarounds, so
+# the pattern only ever consumes the period itself and every period is checked against the original text. The period
+# comes first so that the checks are only made at periods and not at every character of the text.
+PERIOD = (
+    r"\."
+    # Prefixes and suffixes, e.g. Dr. or Jr. Each needs its own lookbehind as they must be a fixed width.
+    + "".join(rf"(?<!{word}\.)" for word in PREFIXES + SUFFIXES)
+    # Acronyms of 3 letters, the trailing period of U.S.A. is part of the acronym. As every period is checked against
+    # the original text, a period that is already part of an abbreviation can also be counted here, so run together
+    # abbreviations such as Co.U.S. or Jr.e.g. are read as one acronym and not split after, where the old replacements
+    # split them. Text with a space after the abbreviations, as in input.txt, is split the same.
+    + r"(?<!\w\.\w\.\w\.)"
+    # Web addresses, e.g. .com or .co.uk, where .co.uk requires a different search than the generic.
+    + f"(?!{'|'.join(WEBSITES)})"
+    + r"(?!co\.uk)(?<!\.co\.(?=uk))"
+    # Periods between two letters or numbers, e.g. abbreviations or 525.45
+    + r"(?<!\w\.(?=\w))"
+)
+
+# This takes into account that the . ? or ! that happen at the end of quotation marks are not the end of the sentence.
+SENTENCE_END = re.compile(f"(?:{PERIOD}|[?!])(?![\"|'])")
+
+
+# The number of characters of context either side of a period that are needed to decide if it is the end of a
+# sentence. The longest checks are the lookbehind for acronyms such as U.S.A. and the lookahead for .co.uk
+CONTEXT = 8
+
+# The number of characters read from the input file at a time when streaming it.
+CHUNK_SIZE = 1 << 20
+
+# The size in bytes of the shards that a large file is split into when splitting it across several processes.
+SHARD_SIZE = 64 << 20
+
 
-def main(filename):
+def main(filename, chunk_size=CHUNK_SIZE):
     """
     This function is the main body of the script. It opens the input file, finds where to split the text into sentences
-    and writes the output to output.txt.
+    and writes the output to the input filename with _split added. The input is read in chunks and each sentence is
+    written as soon as it is found, so the memory used does not grow with the size of the file.
+    :param filename: The file to be split into sentences
+    :param chunk_size: The number of characters to read from the file at a time
     """
-    # We need to first read in the data from our input file
-    with io.open(filename, mode="r", encoding="utf-8") as f:
-        data = f.read()
-
-    # Next we can call our function to find and replace the occurrences of periods, quotation and exclamation marks
-    # that are not the end of a sentence.
-    split_data = split_sentences(data)
-
     # Take the input filename, remove the .txt and add _split.txt. So the output file is the same name with _split
     output_filename = filename.rsplit(".", 1)[0] + "_split.txt"
-    with io.open(output_filename, mode="w", encoding="utf-8") as o:
-        o.write(split_data)
+
+    # We read in the data from our input file a chunk at a time and write the sentences to the output file as we go.
+    with profiler.stage("sentence_split.main") as stage, io.open(filename, mode="r", encoding="utf-8") as f, \
+            io.open(output_filename, mode="w", encoding="utf-8") as o:
+
+        # Next we can call our function to find the occurrences of periods, quotation and exclamation marks that are
+        # the end of a sentence and split the text there.
+        chunks = profiler.iterate("sentence_split.read", iter(lambda: f.read(chunk_size), ""), "chunks")
+        sentences = stream_sentences(chunks)
+        stage.add(sentences=write_sentences(sentences, o), bytes=os.path.getsize(filename))
+
+
+def write_sentences(sentences, o):
+    """
+    This function writes the sentences to the output file with each sentence on a new line, the same as the output of
+    split_sentences.
+    :param sentences: Iterable of sentences
+    :param o: The file to write to
+    :return: The number of sentences written
+    """
+    # There is no newline before the first sentence or after the last one.
+    separator = ""
+    count = 0
+
+    for sentence in sentences:
+        o.write(separator + sentence)
+        separator = "\n"
+        count += 1
+
+    return count
 
 
 def split_sentences(text):
     """
-    This function takes the text and finds the use of . ? and ! and replaces them with a placeholder, <False>, <False_q>
-    and <False_e>. The text can then be split and these false occurrences replaced, this processed text is then
-    returned.
+    This function takes the text and splits it into sentences, placing each sentence on a new line. The boundaries are
+    found in a single pass over the text by the SENTENCE_END pattern, see iter_sentences.
     :param text: The body of text to be split into sentences
     :return: the body of text with each sentence on a new line
     """
 
-    # These are a set of possible occurrences of a period in context that is likely not the end of a sentence
-    prefixes = "(Mr|St|Mrs|Ms|Dr|Prof|Capt|Cpt|Lt|Mt|www)[.]"
-    suffixes = "(Inc|Ltd|Jr|Sr|Co)[.]"
-    websites = "[.](ie|com|net|org|io|gov|me|edu)"
+    with profiler.stage("sentence_split.split_sentences") as stage:
+        sentences = list(iter_sentences(text))
+        stage.add(sentences=len(sentences), characters=len(text))
+
+    # Return the sentences joined with newlines so that the sentences are each on a separate line.
+    return "\n".join(sentences)
+
+
+def iter_sentences(text):
+    """
+    This generator takes the text and yields the sentences in it one at a time. Each match of SENTENCE_END is the end of
+    a sentence, so the sentence is the text between the end of the previous match and the end of this one. Any text
+    after the last sentence end is dropped as it is not a complete sentence.
+    :param text: The body of text to be split into sentences
+    :return: generator of the sentences, stripped of surrounding whitespace
+    """
+
+    # The start of the current sentence, this is the end of the previous sentence.
+    start = 0
+
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+
+        # Newline characters are joined as spaces as the sentence may have been split over multiple lines.
+        yield text[start:end].replace("\n", " ").strip()
+        start = end
+
+
+def stream_sentences(chunks, context=""):
+    """
+    This generator takes the text as an iterable of chunks and yields the sentences in it one at a time, giving the same
+    sentences as iter_sentences on the joined text. Only the unfinished sentence and the last few characters before it
+    are kept between chunks, so a sentence or an abbreviation such as Dr. or .co.uk can be split across chunks.
+    :param chunks: Iterable of strings that make up the text
+    :param context: Text that comes before the first chunk, only used to check the sentence ends near the start
+    :return: generator of the sentences, stripped of surrounding whitespace
+    """
+
+    # The text kept between chunks, the start of the current sentence in it and the position to search from.
+    buffer = context
+    start = search = len(context)
+
+    for chunk in chunks:
+        buffer += chunk
+
+        # A sentence end can only be decided once the characters after it have been read. Any ends found past this limit
+        # are left for the next chunk.
+        limit = len(buffer) - CONTEXT
+
+        for match in SENTENCE_END.finditer(buffer, search):
+            end = match.end()
+            if end > limit:
+                break
+
+            yield buffer[start:end].replace("\n", " ").strip()
+            start = end
+
+        # Everything before the limit has been searched. Drop the finished sentences, keeping enough characters before
+        # the current sentence for the lookbehind checks.
+        search = max(start, limit)
+        keep = max(start - CONTEXT, 0)
+        buffer = buffer[keep:]
+        start -= keep
+        search -= keep
+
+    # There are no more characters to come, so the rest of the sentence ends can be decided.
+    for match in SENTENCE_END.finditer(buffer, search):
+        end = match.end()
+        yield buffer[start:end].replace("\n", " ").strip()
+        start = end
+
+
+def split_files(paths, jobs=None, shard_size=SHARD_SIZE):
+    """
+    This function splits many files into sentences using a pool of processes, writing the output for each file the same
+    as main does. Directories are searched for .txt files. Files larger than the shard size are split into shards at
+    sentence ends so that one large file can also be spread across the processes. The shards are written out in order,
+    so the output is the same as running main on each file.
+    :param paths: List of files and directories to split
+    :param jobs: The number of processes to use, defaults to the number of cores
+    :param shard_size: The size in bytes of the shards large files are split into
+    :return: List of the output filenames
+    """
+    # Get the shards for every file, each shard is a filename and the start and end byte offsets.
+    filenames = list(find_files(paths))
+    shards = [(filename, start, end) for filename in filenames for start, end in find_shards(filename, shard_size)]
+
+    output_filenames = []
+    output = None
 
-    # Unfortunately, this method will fail to split a sentence when one of these possibilties occurs as the end of a
-    # sentence.
-    # E.g. Last week he travelled to the U.S. He flew in to New York on a jet.
+    with profiler.stage("sentence_split.split_files") as stage, multiprocessing.Pool(jobs) as pool:
+        stage.add(files=len(filenames), shards=len(shards))
 
-    # Remove newline characters and join all the text together if it is disjoint.
-    text = re.sub("\n", " ", text)
+        # The shards are returned in the order they were given, so each file's shards come one after another.
+        for (filename, start, end), split_data in zip(shards, pool.imap(split_shard, shards)):
 
-    # replace the times when a period is not the end with a placeholder "<false>"
-    # Here we replace for prefixes such as Dr., suffixes such as Co. and web addresses
-    text = re.sub(prefixes, "\\1<False>", text)
-    text = re.sub(suffixes, "\\1<False>", text)
-    text = re.sub(websites, "<False>\\1", text)
-    text = re.sub("\.co\.uk", "<False>co<False>uk", text)  # .co.uk requires a different search than the generic
+            # When the first shard of a file arrives we can open the output file for it.
+            if start == 0:
+                if output:
+                    output.close()
+                output_filenames.append(filename.rsplit(".", 1)[0] + "_split.txt")
+                output = io.open(output_filenames[-1], mode="w", encoding="utf-8")
+                separator = ""
 
-    # Now we can catch periods and abbreviations, this covers 2 and 3 letter long acronyms.
-    text = re.sub("(\w)\.(\w)", "\\1<False>\\2", text)
-    text = re.sub("(\w)[.](\w)[.](\w)[.]?", "\\1<False>\\2<False>\\3<False>", text)
-    text = re.sub("(\w)[.](\w)[.]?", "\\1<False>\\2<False>", text)
+            # Shards are joined with newlines the same as the sentences within a shard.
+            if split_data:
+                output.write(separator + split_data)
+                separator = "\n"
 
-    # This takes into account that the . ? or ! that happen at the end of quotation marks.
-    text = re.sub("\.([\"|\'])", "<False>\\1", text)
-    text = re.sub("\?([\"|\'])", "<False_q>\\1", text)
-    text = re.sub("!([\"|\'])", "<False_e>\\1", text)
+    if output:
+        output.close()
 
-    # Let us say all remaining occurrences are true occurrences.
-    text = re.sub("\.", ".<Split>", text)
-    text = re.sub("\?", "?<Split>", text)
-    text = re.sub("!", "!<Split>", text)
+    return output_filenames
 
-    # Replace the false occruences with the original character again as we know where to split the text,
-    text = re.sub("<False>", ".", text)
-    text = re.sub("<False_q>", "?", text)
-    text = re.sub("<False_e>", "!", text)
 
-    # Split the text at the split points, drop the last split as it is empty and strip each element of the list.
-    text = text.split("<Split>")[:-1]
-    striped = [sent.strip() for sent in text]
+def find_files(paths):
+    """
+    This generator yields the files to be split. Files are used as given, directories are searched for .txt files that
+    are not the output of a previous split.
+    :param paths: List of files and directories
+    :return: generator of filenames
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for file in sorted(Path(path).rglob("*.txt")):
+                if not file.name.endswith("_split.txt"):
+                    yield str(file)
+        else:
+            yield path
 
-    # Return the text joined with newlines so that the sentences are each on a separate line.
-    return "\n".join(striped)
+
+def find_shards(filename, shard_size=SHARD_SIZE):
+    """
+    This function finds the byte offsets that split a file into shards of roughly the shard size. Each shard ends at the
+    end of a sentence, so that each shard can be split into sentences on its own.
+    :param filename: The file to be split into shards
+    :param shard_size: The size in bytes of the shards
+    :return: List of the start and end byte offsets of each shard
+    """
+    size = os.path.getsize(filename)
+    offsets = [0]
+
+    with open(filename, "rb") as f:
+        while offsets[-1] + shard_size < size:
+            end = find_sentence_end(f, offsets[-1] + shard_size)
+
+            # If there are no more sentence ends the rest of the file is one shard.
+            if end is None:
+                break
+            offsets.append(end)
+
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def find_sentence_end(f, position, window=4096):
+    """
+    This function finds the byte offset just after the first sentence end at or after a position in a binary file. The
+    text either side of the sentence end is read so that it is found the same as if the whole file had been read.
+    :param f: The file opened in binary mode
+    :param position: The byte offset to start searching from
+    :param window: The number of bytes to read, this is doubled until a sentence end is found
+    :return: The byte offset after the sentence end, or None if there is none
+    """
+    while True:
+        f.seek(position)
+        data = f.read(window)
+
+        # Skip over the rest of any character that the position is in the middle of.
+        skip = 0
+        while skip < len(data) and 0x80 <= data[skip] < 0xC0:
+            skip += 1
+
+        # The decoder holds back any character cut off at the end of the data.
+        text = codecs.getincrementaldecoder("utf-8")().decode(data[skip:])
+
+        # Sentence ends need the characters of context either side of them.
+        for match in SENTENCE_END.finditer(text, CONTEXT):
+            if match.end() + CONTEXT > len(text):
+                break
+            return position + skip + len(text[:match.end()].encode("utf-8"))
+
+        # If we have read to the end of the file there is no sentence end, otherwise read more.
+        if len(data) < window:
+            return None
+        window *= 2
+
+
+def split_shard(shard):
+    """
+    This function splits a shard of a file into sentences. It is run in the worker processes by split_files.
+    :param shard: The filename and the start and end byte offsets of the shard
+    :return: The sentences in the shard, each on a new line
+    """
+    filename, start, end = shard
+
+    with open(filename, "rb") as f:
+
+        # Read the characters before the shard, these are needed to check the sentence ends at the start of the shard.
+        f.seek(max(start - 4 * CONTEXT, 0))
+        context = f.read(start - f.tell()).decode("utf-8", errors="ignore")
+        context = context.replace("\r\n", "\n").replace("\r", "\n")[-CONTEXT:]
+
+        # Decode the shard a chunk at a time, translating newlines the same as reading a file in text mode.
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+        chunks = (decoder.decode(data) for data in iter_range(f, start, end))
+
+        # Split the shard into sentences, writing them to a string the same as main writes them to the output file.
+        output = io.StringIO()
+        write_sentences(stream_sentences(chunks, context), output)
+
+    return output.getvalue()
+
+
+def iter_range(f, start, end, chunk_size=CHUNK_SIZE):
+    """
+    This generator reads the bytes between two offsets of a binary file a chunk at a time.
+    :param f: The file opened in binary mode
+    :param start: The byte offset to start reading from
+    :param end: The byte offset to stop reading at
+    :param chunk_size: The number of bytes to read at a time
+    :return: generator of the chunks of bytes
+    """
+    f.seek(start)
+    while start < end:
+        data = f.read(min(chunk_size, end - start))
+        if not data:
+            break
+        start += len(data)
+        yield data
 
 
 if __name__ == "__main__":
-    filename = "input.txt"  # Filename goes here
+    parser = argparse.ArgumentParser(description="Split text files into sentences, writing each sentence on a new line.")
+    parser.add_argument("paths", nargs="*", default=["input.txt"], help="Files or directories of .txt files to split")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes to split the files with")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE,
+                        help="Size in bytes of the shards large files are split into across processes")
+    parser.add_argument("--profile", help="Write the time, items and memory of each stage to this JSON file, or run "
+                                          "cProfile and write its statistics if it ends in .prof")
+    args = parser.parse_args()
 
-    if len(sys.argv) > 1:
-        filename = sys.argv[1]
+    with profiler.session(args.profile):
 
-    main(filename)
+        # A single file can be split as before, otherwise the files are split across a pool of processes.
+        if args.jobs == 1 and len(args.paths) == 1 and not os.path.isdir(args.paths[0]):
+            main(args.paths[0])
+        else:
+            split_files(args.paths, args.jobs, args.shard_size)
@@ -0,0 +1,209 @@
+import argparse
+import collections
+import json
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+
+# The first bytes of an archive file, and the layout of its header: the magic bytes, the number of documents and the
+# byte offset of the index.
+MAGIC = b"REVIEWS1"
+HEADER = "<8sQQ"
+
+
+def scan_directory(directory):
+    """
+    This function lists the files of a corpus directory with os.scandir, taking the subdirectories as the class labels.
+    :param directory: The directory that contains a subdirectory for each class
+    :return: Dictionary with the subdirectory names as keys and lists of file paths as values
+    """
+    data = {}
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # Files next to the subdirectories are not part of any class.
+            if not entry.is_dir():
+                continue
+
+            with os.scandir(entry.path) as files:
+                data[entry.name] = [Path(file.path) for file in files if file.is_file()]
+
+    return data
+
+
+def read_file(path):
+    """
+    This function reads the text of a file.
+    :param path: The path of the file
+    :return: The text
+    """
+    with open(path) as f:
+        return f.read()
+
+
+def read_files(files, workers=8, read_ahead=64):
+    """
+    This generator reads files in a pool of threads, reading up to read_ahead files ahead of the one being used, so the
+    time spent waiting for the disk is overlapped with the time spent using the text. The records are in the same order
+    as the files.
+    :param files: Iterable of the label and path of each file
+    :param workers: The number of threads reading files
+    :param read_ahead: The most files to read ahead
+    :return: generator of the label, file name and text of each file
+    """
+    files = iter(files)
+    pending = collections.deque()
+
+    with ThreadPoolExecutor(workers) as executor:
+
+        # Start reading the first files, then start reading another each time one is used.
+        for label, path in islice(files, read_ahead):
+            pending.append((label, path, executor.submit(read_file, path)))
+
+        while pending:
+            label, path, future = pending.popleft()
+
+            for next_label, next_path in islice(files, 1):
+                pending.append((next_label, next_path, executor.submit(read_file, next_path)))
+
+            yield label, Path(path).name, future.result()
+
+
+def read_corpus(path, workers=8, read_ahead=64):
+    """
+    This generator reads a corpus from a directory with a subdirectory for each class, or from an archive made by
+    pack_corpus.
+    :param path: The directory or archive
+    :param workers: The number of threads reading files from a directory
+    :param read_ahead: The most files to read ahead from a directory
+    :return: generator of the label, file name and text of each document
+    """
+    if os.path.isfile(path):
+        with CorpusArchive(path) as archive:
+            yield from archive
+    else:
+        files = [(label, file) for label, label_files in scan_directory(path).items() for file in label_files]
+        yield from read_files(files, workers, read_ahead)
+
+
+def read_documents(path, text_field="text", label_field="label"):
+    """
+    This generator streams the documents of a .txt file, with a document on each line, or a .jsonl file, with a JSON
+    record for each document, one line at a time.
+    :param path: The .txt or .jsonl file
+    :param text_field: The field of the text in a JSON record
+    :param label_field: The field of the label in a JSON record, records without it have no label
+    :return: generator of the label or None, the name and the text of each document, the name being the line number
+    unless a JSON record has an id
+    """
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            line = line.rstrip("\n")
+
+            if path.endswith(".jsonl"):
+                # Blank lines between records are skipped.
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield record.get(label_field) if label_field else None, str(record.get("id", i)), record[text_field]
+            else:
+                yield None, str(i), line
+
+
+def pack_corpus(directory, path, workers=8, read_ahead=64):
+    """
+    This function packs a corpus directory into one archive file, so it can be read sequentially or through mmap
+    instead of opening every file. The archive has a header, then the UTF-8 text of every document one after another,
+    then an index in JSON of the label, name, offset and length of each document.
+    :param directory: The directory with a subdirectory for each class
+    :param path: The archive file to write
+    :param workers: The number of threads reading files
+    :param read_ahead: The most files to read ahead
+    :return: The number of documents packed
+    """
+    index = []
+
+    with open(path, "wb") as f:
+        # Leave space for the header, which is written once the offset of the index is known.
+        f.write(bytes(struct.calcsize(HEADER)))
+
+        for label, name, text in read_corpus(directory, workers, read_ahead):
+            data = text.encode("utf-8")
+            index.append((label, name, f.tell(), len(data)))
+            f.write(data)
+
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode("utf-8"))
+
+        f.seek(0)
+        f.write(struct.pack(HEADER, MAGIC, len(index), index_offset))
+
+    return len(index)
+
+
+class CorpusArchive:
+    """
+    The CorpusArchive class reads an archive made by pack_corpus through mmap. Iterating over it gives the label, name
+    and text of each document in the order they were packed, which reads the file sequentially.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The archive file
+        """
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, index_offset = struct.unpack_from(HEADER, self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a corpus archive")
+
+        # The label, name, offset and length of each document.
+        self.index = json.loads(self.data[index_offset:].decode("utf-8"))
+
+    def labels(self):
+        """
+        This function returns the labels of the documents in the archive, in the order they first occur.
+        :return: The labels as dictionary keys, which can be used as the classes of a NaiveBayes model
+        """
+        return dict.fromkeys(label for label, _, _, _ in self.index).keys()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        for label, name, offset, length in self.index:
+            yield label, name, self.data[offset:offset + length].decode("utf-8")
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read a corpus directory or archive, or pack a directory into an archive.")
+    parser.add_argument("source", help="Directory with a subdirectory for each class, or an archive")
+    parser.add_argument("--pack", metavar="ARCHIVE", help="Pack the directory into this archive file")
+    parser.add_argument("--workers", type=int, default=8, help="Number of threads reading files")
+    parser.add_argument("--read-ahead", type=int, default=64, help="Most files to read ahead")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.pack:
+        count = pack_corpus(args.source, args.pack, args.workers, args.read_ahead)
+    else:
+        # Read every document to measure how long reading the corpus takes.
+        count = sum(1 for _ in read_corpus(args.source, args.workers, args.read_ahead))
+    elapsed = time.perf_counter() - start
+
+    print(f"{count} documents in {elapsed:.2f}s, {count / elapsed:.0f} documents per second")
@@ -0,0 +1,212 @@
+import argparse
+import string
+import time
+
+import numpy as np
+
+from corpus import read_corpus
+from naive_bayes import hash_words, tokenize
+
+
+class CrossValidator:
+    """
+    The CrossValidator class runs k-fold cross validation of the NaiveBayes classifier for many values of alpha without
+    training a model for each. The corpus is tokenized and counted once, and the word counts of each class in each fold
+    are kept. The counts do not depend on alpha, and the training counts for a fold are the total counts minus the
+    counts of the fold, so every alpha and fold is scored from these counts with numpy. The predictions are the same as
+    training a NaiveBayes model on the other folds and predicting the held out fold.
+    """
+
+    def __init__(self, records, folds: int = 10, seed: int = 0, buckets: int = None):
+        """
+        :param records: Iterable of the class, name and contents of each document
+        :param folds: The number of folds
+        :param seed: The seed for assigning the documents to folds
+        :param buckets: The number of buckets to hash the words into, as NaiveBayes does with buckets, or None
+        """
+        self.folds = folds
+        self.index = {}
+        self.classes = {}
+
+        # The class of each document, and the row, column and count of every word count of every document.
+        labels = []
+        rows = []
+        columns = []
+
+        for row, (cls, _, doc) in enumerate(records):
+            labels.append(self.classes.setdefault(cls, len(self.classes)))
+
+            # Split the document and ignore punctuation as during training.
+            doc_columns = [self.index.setdefault(word, len(self.index)) for word in tokenize(doc)
+                           if word not in string.punctuation]
+            columns += doc_columns
+            rows += [row] * len(doc_columns)
+
+        self.labels = np.array(labels, dtype=np.int64)
+        columns = np.array(columns, dtype=np.int64)
+
+        # With hashing each word is counted in its bucket, and the buckets take the place of the words.
+        self.size = buckets or len(self.index)
+        if buckets:
+            columns = hash_words(list(self.index), buckets)[columns]
+
+        keys, counts = np.unique(np.array(rows, dtype=np.int64) << 32 | columns, return_counts=True)
+        self.rows, self.columns, self.counts = keys >> 32, keys & 0xFFFFFFFF, counts
+
+        # Split the documents of each class evenly between the folds, in a random order.
+        rng = np.random.default_rng(seed)
+        self.fold_of = np.zeros(len(self.labels), dtype=np.int64)
+        for i in range(len(self.classes)):
+            docs = rng.permutation(np.flatnonzero(self.labels == i))
+            self.fold_of[docs] = np.arange(len(docs)) % folds
+
+        # The word counts of each class in each fold, and the number of documents of each class in each fold.
+        size = (folds, len(self.classes), self.size)
+        entry_fold = self.fold_of[self.rows]
+        self.fold_counts = np.bincount(np.ravel_multi_index((entry_fold, self.labels[self.rows], self.columns), size),
+                                       weights=self.counts, minlength=np.prod(size)).astype(np.int64).reshape(size)
+        self.fold_docs = np.bincount(self.fold_of * len(self.classes) + self.labels,
+                                     minlength=folds * len(self.classes)).reshape(folds, len(self.classes))
+
+        # The word counts sorted by fold, with the start of each fold, so the entries of the held out fold can be taken.
+        order = np.argsort(entry_fold, kind="stable")
+        self.rows, self.columns, self.counts = self.rows[order], self.columns[order], self.counts[order]
+        self.fold_starts = np.searchsorted(entry_fold[order], np.arange(folds + 1))
+
+    def fold_scores(self, fold: int, alphas):
+        """
+        This function computes the log probability of each class for each document in a fold, for a model trained on
+        the other folds with each alpha.
+        :param fold: The held out fold
+        :param alphas: Array of alpha values
+        :return: The documents in the fold and an array of the log probabilities for each alpha, document and class
+        """
+        alphas = np.asarray(alphas, dtype=np.float64)
+
+        # The training counts are the total minus the counts of the held out fold.
+        train_counts = self.fold_counts.sum(axis=0) - self.fold_counts[fold]
+        train_docs = self.fold_docs.sum(axis=0) - self.fold_docs[fold]
+
+        # The unique words are those seen in the training folds, words only in the held out fold are ignored.
+        in_vocabulary = train_counts.any(axis=0)
+        total_unique_words = int(in_vocabulary.sum())
+
+        with np.errstate(divide="ignore"):
+            log_priors = np.log(train_docs / train_docs.sum())
+
+        # The word counts of the documents in the fold, for the words in the vocabulary.
+        start, end = self.fold_starts[fold], self.fold_starts[fold + 1]
+        rows, columns, counts = self.rows[start:end], self.columns[start:end], self.counts[start:end]
+        keep = in_vocabulary[columns]
+        rows, columns, counts = rows[keep], columns[keep], counts[keep]
+
+        docs = np.flatnonzero(self.fold_of == fold)
+        doc_rows = np.searchsorted(docs, rows)
+
+        # log P(word | class) = log(count + alpha) - log(total words + alpha * unique words), for each alpha and class.
+        log_numerators = np.log(train_counts[None, :, columns] + alphas[:, None, None])
+        log_denominators = np.log(train_counts.sum(axis=1)[None, :] + alphas[:, None] * total_unique_words)
+        lengths = np.bincount(doc_rows, weights=counts, minlength=len(docs))
+
+        scores = log_priors - lengths[None, :, None] * log_denominators[:, None, :]
+        for a in range(len(alphas)):
+            for c in range(len(self.classes)):
+                scores[a, :, c] += np.bincount(doc_rows, weights=counts * log_numerators[a, c], minlength=len(docs))
+
+        return docs, scores
+
+    def evaluate(self, alphas):
+        """
+        This function computes the accuracy of every alpha on every fold.
+        :param alphas: List of alpha values
+        :return: Array of the accuracy for each alpha and fold
+        """
+        accuracy = np.zeros((len(alphas), self.folds))
+
+        for fold in range(self.folds):
+            docs, scores = self.fold_scores(fold, alphas)
+
+            # The class with the highest probability is predicted, the first class in the case of a tie.
+            accuracy[:, fold] = (scores.argmax(axis=2) == self.labels[docs]).mean(axis=1)
+
+        return accuracy
+
+
+def bucket_curve(path, buckets, alpha=0.9, folds=10, seed=0):
+    """
+    This function compares the cross validated accuracy of counting every word exactly with hashing the words into each
+    number of buckets, and the memory used by the counts of each.
+    :param path: The corpus directory or archive
+    :param buckets: List of the numbers of buckets
+    :param alpha: The value of alpha
+    :param folds: The number of folds
+    :param seed: The seed for assigning the documents to folds
+    :return: List of dictionaries with the number of buckets, the memory of the counts and the mean accuracy
+    """
+    records = list(read_corpus(path))
+    results = []
+
+    for size in [None] + list(buckets):
+        validator = CrossValidator(records, folds, seed, size)
+        accuracy = validator.evaluate([alpha])[0]
+
+        # Exact counts need at least a 64-bit count for each nonzero word and class, more with the dictionaries of the
+        # words, hashed counts an array of 64-bit counts for each class.
+        exact = size is None
+        nonzero = int((validator.fold_counts.sum(axis=0) > 0).sum())
+        memory = nonzero * 8 if exact else len(validator.classes) * size * 8
+
+        results.append({"buckets": size, "memory_bytes": memory, "mean_accuracy": float(accuracy.mean()),
+                        "min_accuracy": float(accuracy.min()), "max_accuracy": float(accuracy.max())})
+        print(f"{'exact' if exact else f'{size} buckets'}: mean accuracy {accuracy.mean():.4f} "
+              f"(folds {accuracy.min():.3f} to {accuracy.max():.3f}), counts {memory / 1e6:.2f}MB")
+
+    return results
+
+
+def sweep(path, alphas, folds=10, seed=0):
+    """
+    This function runs cross validation on a corpus for every alpha, and prints the accuracy of each fold and the mean
+    accuracy for each alpha.
+    :param path: The corpus directory or archive
+    :param alphas: List of alpha values
+    :param folds: The number of folds
+    :param seed: The seed for assigning the documents to folds
+    :return: Dictionary of the accuracy of each alpha on each fold, the mean accuracy of each alpha and the best alpha
+    """
+    start = time.perf_counter()
+    validator = CrossValidator(read_corpus(path), folds, seed)
+    counted = time.perf_counter()
+    accuracy = validator.evaluate(alphas)
+    finished = time.perf_counter()
+
+    mean = accuracy.mean(axis=1)
+    for alpha, fold_accuracy, mean_accuracy in zip(alphas, accuracy, mean):
+        print(f"alpha {alpha:g}: mean accuracy {mean_accuracy:.4f}, folds "
+              + " ".join(f"{value:.3f}" for value in fold_accuracy))
+
+    best = alphas[int(mean.argmax())]
+    print(f"The best alpha is {best:g} with a mean accuracy of {mean.max():.4f}")
+    print(f"Counting took {counted - start:.2f}s and scoring {len(alphas)} alphas x {folds} folds took "
+          f"{finished - counted:.2f}s")
+
+    return {"alphas": list(alphas), "accuracy": accuracy.tolist(), "mean": mean.tolist(), "best_alpha": best}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross validate the Naive Bayes classifier for a range of alphas.")
+    parser.add_argument("corpus", nargs="?", default="review_polarity/txt_sentoken",
+                        help="Corpus directory with a subdirectory for each class, or an archive made by corpus.py")
+    parser.add_argument("--folds", type=int, default=10, help="Number of folds")
+    parser.add_argument("--alphas", type=float, nargs="+",
+                        default=[round(alpha, 2) for alpha in np.linspace(0.1, 2.0, 20)], help="Values of alpha")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for assigning the documents to folds")
+    parser.add_argument("--buckets", type=int, nargs="+",
+                        help="Compare the accuracy of hashing the words into these numbers of buckets with exact counts, "
+                             "at the alpha given, or 0.9, instead of sweeping the alphas")
+    args = parser.parse_args()
+
+    if args.buckets:
+        bucket_curve(args.corpus, args.buckets, args.alphas[0] if len(args.alphas) == 1 else 0.9, args.folds, args.seed)
+    else:
+        sweep(args.corpus, args.alphas, args.folds, args.seed)
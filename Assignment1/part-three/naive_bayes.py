@@ -1,13 +1,46 @@
+import argparse
 import json
 import math
-import sys
-import io
+import multiprocessing
+import os
+import time
+import zlib
+from itertools import islice
 from pathlib import Path
 import string
 import shutil
+import struct
+import sys
+
+import numpy as np
+
+# The profiling module is shared by the three parts of the assignment, it is in the folder above this one.
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from profiling import profiler
+
+from corpus import CorpusArchive, read_documents, read_files, scan_directory
+from token_cache import TokenCache
+
+
+# The first bytes of a saved model file, and the layout of its header: the magic bytes, alpha, the number of classes,
+# unique words and nonzero word counts, the size of the text with the names of the classes and the words, and the number
+# of hash buckets, 0 if the words are not hashed.
+MAGIC = b"NBAYES02"
+HEADER = "<8sdQQQQQ"
+
+# The version of document_words, cached words from other versions are split again.
+TOKENIZER_VERSION = 1
+
+# The number of words for each class written to top_words.json by --tables top.
+TOP_WORDS = 100
+
+# The most log counts put in the dense table used to score a batch of documents, 4M or 32MB.
+TABLE_CELLS = 1 << 22
 
 
-def main(training_dir, test_path):
+def main(training_dir, test_path, jobs=1, output=None, text_field="text", label_field="label", copy="copy",
+         manifest=False, tables="json", model_file=None, save_file=None, alpha=0.9, cache_dir=None, buckets=None,
+         explain=0):
     """
     This is the main function that runs when the script is run. It reads in the data and splits it into train and test.
     The NaiveBayes class is initialized and passed the classes and alpha value.
@@ -15,33 +48,81 @@ def main(training_dir, test_path):
     Finally, the model is passed the test data and then prints the accuracy and outputs the data into the results
     folder. The folder contains a correct and incorrect sub-folder for classifications that are correct and incorrect,
     allowing for analysis.
+    :param training_dir: The training directory, with a subdirectory for each class
+    :param test_path: The test directory or a .txt file of reviews
+    :param jobs: The number of processes to train with
+    :param output: The JSONL file to write the predictions for a .txt or .jsonl test file to
+    :param text_field: The field of the review in a .jsonl test file
+    :param label_field: The field of the class in a .jsonl test file, if it has one
+    :param copy: How to put the test files in the results or prediction folders, "copy", "hardlink" or "none"
+    :param manifest: Whether to stream the prediction of each test file to a manifest.jsonl file
+    :param tables: How to write the probability tables, "json", "binary", "top" or "none"
+    :param model_file: A model saved by NaiveBayes.save to load instead of training
+    :param save_file: The file to save the trained model to
+    :param alpha: The value of alpha for smoothing, which can be chosen with model_selection.py
+    :param cache_dir: The directory of a TokenCache to get the words of the training and test files from
+    :param buckets: The number of buckets to hash the words into, or None to count every word exactly
+    :param explain: The number of words for and against the prediction of each test file to write to explanations.jsonl,
+    or 0 to not explain them
     """
+    cache = TokenCache(cache_dir, document_words, TOKENIZER_VERSION) if cache_dir else None
 
-    # Compile a dictionary with the training data, the keys are the class names and the elements in the list are files.
-    training_data = return_files(training_dir)
-
-    # We need to check if the test_path is a .txt file and if so pull out the reviews that we want.
-    if test_path[-4:] == ".txt":
-        test_dir = create_folder(test_path)
+    # A saved model can be loaded rather than trained again.
+    if model_file:
+        with profiler.stage("naive_bayes.load"):
+            model = NaiveBayes.load(model_file)
 
-    # If it isn't, we can treat it as normal.
     else:
-        test_dir = test_path
-
-    # Compile a dictionary with the test data, the keys are either the subfolder names, which may be class names,
-    # or just a list of files under the key "files".
-    testing_data = return_files(test_dir)
-
-    # Initialize the NaiveBayes class with the class list and an alpha value of 0.9 for smoothing.
-    model = NaiveBayes(training_data.keys(), 0.9)
-
-    # Train the model by passing the training dictionary, this computes the probabilities from the counts of words and
-    # documents.
-    model.train(training_data)
-
+        # The training data can be an archive made by corpus.py, which is read in one pass.
+        archive = CorpusArchive(training_dir) if os.path.isfile(training_dir) else None
+
+        # Compile a dictionary with the training data, the keys are the class names and the elements in the list are
+        # files.
+        training_data = None if archive else return_files(training_dir)
+
+        # Initialize the NaiveBayes class with the class list and an alpha value for smoothing, 0.9 by default.
+        model = NaiveBayes(archive.labels() if archive else training_data.keys(), alpha, buckets)
+
+        # Train the model by passing the training dictionary, this computes the probabilities from the counts of words
+        # and documents.
+        with profiler.stage("naive_bayes.train"):
+            if archive:
+                with archive:
+                    model.train_records(archive)
+            elif cache:
+                model.train_ids(cache.read((cls, file) for cls in model.classes for file in training_data[cls]),
+                                cache.words)
+            else:
+                model.train(training_data, jobs)
+
+    if save_file:
+        with profiler.stage("naive_bayes.save"):
+            model.save(save_file)
+
+    # A .txt file with a review on each line or a .jsonl file with a review in each record is streamed through the
+    # model, writing a line of JSON with the prediction for each review.
+    if test_path.endswith((".txt", ".jsonl")):
+        output_file = Path(output) if output else Path.cwd() / "prediction" / "predictions.jsonl"
+        output_file.parent.mkdir(exist_ok=True, parents=True)
+
+        with profiler.stage("naive_bayes.test"), open(output_file, "w") as o:
+            correct, totals = model.predict_stream(read_documents(test_path, text_field, label_field), o)
+
+        # If the reviews had classes we can print the accuracy.
+        for line in accuracy_report(correct, totals):
+            print(line)
+
+    # Otherwise compile a dictionary with the test data, the keys are either the subfolder names, which may be class
+    # names, or just a list of files under the key "files".
     # Pass the test dictionary to the model. If the keys match the classes we return the accuracy and results
     # folder, otherwise return the predictions in the predictions' folder.
-    model.test(testing_data)
+    else:
+        with profiler.stage("naive_bayes.test"):
+            model.test(return_files(test_path), copy, manifest, tables, cache=cache, explain=explain)
+
+    # Keep the words of the files that were added to the cache for later runs.
+    if cache:
+        cache.close()
 
 
 class NaiveBayes:
@@ -52,11 +133,12 @@ class NaiveBayes:
     otherwise prediction is carried out.
     """
 
-    def __init__(self, classes: list, alpha: float = None):
+    def __init__(self, classes: list, alpha: float = None, buckets: int = None):
         """
         This init method creates the class variables for tracking the counts, unique words, probabilities and smoothing.
         :param classes: List of classes to be used
         :param alpha: Value of alpha for smoothing
+        :param buckets: The number of buckets to hash the words into, or None to count every word exactly
         """
         # List of classes for this classification task
         self.classes = classes
@@ -73,46 +155,217 @@ class NaiveBayes:
         if alpha:
             self.alpha = alpha
 
-        # Total words for each class, probabilities of classes and words in each class.
+        # Total words for each class, probabilities of classes and the probabilities of each class for each prediction.
         self.total_words = {}
         self.class_probabilities = {}
-        self.probabilities = {}
-        self.log_probabilities = {}
         self.class_probabilities_for_prediction = {}
 
-        # For every class, add a dictionary in the counts and probabilities. Initialize the doc count for a class at 0.
+        # The column of each word, in the order the words were first seen.
+        self.index = {}
+
+        # The probability of a word given a class is not stored, it is computed when needed from the count and the
+        # denominator of the class, (count + alpha) / (total words + alpha * unique words). For prediction each class
+        # keeps the sorted columns of the words it has a count for and the log of (count + alpha) / alpha for each of
+        # them. A word with a count of 0 adds nothing to this, so only the nonzero counts are stored. The log of the
+        # denominator and the log prior of each class are kept in arrays. These are updated by compute_probabilities.
+        self.columns = {}
+        self.log_counts = {}
+        self.log_denominators = np.zeros(len(self.classes))
+        self.log_priors = np.zeros(len(self.classes))
+
+        # The words whose counts in each class have changed since the probabilities were last computed.
+        self.changed = {}
+
+        # The nonzero counts of each class of a model loaded by load, in the order of its columns, left in the memory
+        # mapped file. Prediction only needs the columns and log counts, so the counts by word and the unique words are
+        # only built from these by load_counts when they are needed, and this is then None.
+        self.mapped_counts = None
+
+        # With hashing, each word is counted in the bucket given by its hash rather than by itself, so the counts of each
+        # class are an array with a count for each bucket, and the memory used is set by the number of buckets rather
+        # than the number of unique words. The unique words, the counts by word and the index are left empty, and the
+        # buckets with a count in any class take the place of the unique words.
+        self.buckets = buckets
+        self.bucket_counts = np.zeros((len(self.classes), buckets or 0), dtype=np.int64)
+        self.seen = np.zeros(buckets or 0, dtype=bool)
+
+        # The index of the log probabilities and log-likelihood ratios of the words used for analysis, built by
+        # analysis_index when first needed and again after the counts change.
+        self.analysis = None
+
+        # The log counts of all the classes sorted by column, used to score a batch of documents in one pass, built by
+        # scoring_index when first needed and again after the counts change.
+        self.scoring = None
+
+        # For every class, add a dictionary in the counts and empty arrays for prediction. Initialize the doc count and
+        # word count for a class at 0.
         for cls in self.classes:
             self.counts[cls] = {}
-            self.probabilities[cls] = {}
-            self.log_probabilities[cls] = {}
+            self.columns[cls] = np.zeros(0, dtype=np.int64)
+            self.log_counts[cls] = np.zeros(0)
+            self.changed[cls] = set()
             self.doc_count[cls] = 0
+            self.total_words[cls] = 0
 
-    def train(self, file_dict: dict):
+    def train(self, file_dict: dict, jobs: int = 1):
         """
         This method takes a file dictionary and loops through the classes and files, getting the counts of words and
-        documents. The probabilities can then be computed.
+        documents. The probabilities can then be computed. With more than one job the files are split into shards that
+        are counted by a pool of processes, and the counts of the shards are merged in order, which gives the same model
+        as counting them all in this process.
         :param file_dict: Dictionary with keys as classes and file paths as values
+        :param jobs: The number of processes to use
         """
 
-        # For each class
-        for cls in self.classes:
-            # Get the reviews for that class
-            files = file_dict[cls]
+        # Every file paired with its class, in the order they are processed in one process.
+        files = [(cls, file) for cls in self.classes for file in file_dict[cls]]
+
+        if jobs > 1:
+            # Use a few shards per process so that the processes are kept busy if some shards are slower than others.
+            shard_size = max(math.ceil(len(files) / (4 * jobs)), 1)
+            shards = [(list(self.classes), self.alpha, self.buckets, files[i:i + shard_size])
+                      for i in range(0, len(files), shard_size)]
 
-            # Open each file and pass the cls and data to the process_document method to get the counts.
-            for file in files:
-                with open(file) as f:
-                    data = f.read()
+            with multiprocessing.Pool(jobs) as pool:
+
+                # Merge the counts in the order of the shards so the words are in the same order as in one process.
+                # The stages run in the processes are not measured, the time waiting for them is part of the read stage.
+                for shard_model in profiler.iterate("naive_bayes.read", pool.imap(train_shard, shards), "shards"):
+                    with profiler.stage("naive_bayes.merge") as stage:
+                        self.merge(shard_model)
+                        stage.add(documents=sum(shard_model.doc_count.values()))
+
+            # Once all the documents are processed we can compute all the probabilities.
+            self.compute_probabilities()
+
+        else:
+            # Read the files ahead in a pool of threads and count the words and documents of each as it is read.
+            self.train_records(read_files(files))
+
+    def train_records(self, records):
+        """
+        This method trains the model on a stream of documents, getting the counts of words and documents and then
+        computing the probabilities.
+        :param records: Iterable of the class, name and contents of each document
+        """
+
+        # Pass the cls and data of each document to the process_document method to get the counts. The time spent
+        # waiting for each document to be read is measured on its own.
+        with profiler.stage("naive_bayes.count") as stage:
+            for cls, name, data in profiler.iterate("naive_bayes.read", records, "documents"):
                 self.process_document(cls, data)
+                stage.add(documents=1, characters=len(data))
+
+        # Once all the documents are processed we can compute all the probabilities.
+        self.compute_probabilities()
+
+    def merge(self, other):
+        """
+        This method adds the counts of another model with the same classes to this model, as if this model had also
+        processed the documents of the other model. The words of the other model are added in the order they were first
+        seen, so merging models of consecutive parts of the training data gives the same model as processing all of it.
+        The probabilities need to be computed again afterwards.
+        :param other: The NaiveBayes model to add the counts of
+        :return: This model
+        """
+        # The counts by word of loaded models are needed to add them.
+        self.load_counts()
+        other.load_counts()
+
+        # With hashing the counts of the buckets are added.
+        if self.buckets:
+            self.bucket_counts += other.bucket_counts
+
+        # Add the new words to the unique words and give them columns.
+        for word in other.index:
+            if word not in self.index:
+                self.unique.add(word)
+                self.index[word] = len(self.index)
+
+        # For every class add the document count, word counts and total words, and mark the words as changed.
+        for cls in self.classes:
+            self.doc_count[cls] += other.doc_count[cls]
+            self.total_words[cls] += other.total_words[cls]
+
+            counts = self.counts[cls]
+            for word, count in other.counts[cls].items():
+                counts[word] = counts.get(word, 0) + count
+
+            self.changed[cls].update(other.counts[cls])
+
+        return self
+
+    def train_ids(self, records, words):
+        """
+        This method trains the model on a stream of documents that have already been split into words and converted to
+        ids, such as those from a TokenCache. The ids of each class are counted at once with numpy, and the words are
+        added in the order they first occur, which gives the same model as training on the documents.
+        :param records: Iterable of the class, name and array of word ids of each document
+        :param words: List of the word of each id
+        """
+        self.load_counts()
+        ids = {cls: [] for cls in self.classes}
+
+        for cls, name, doc_ids in profiler.iterate("naive_bayes.read", records, "documents"):
+            self.doc_count[cls] += 1
+            ids[cls].append(np.asarray(doc_ids, dtype=np.int64))
+
+        with profiler.stage("naive_bayes.count") as stage:
+            for c, cls in enumerate(self.classes):
+                # Count every id of this class, in the order of the first occurrence of each.
+                unique_ids, first, counts = np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + ids[cls]),
+                                                      return_index=True, return_counts=True)
+                order = np.argsort(first)
+                self.total_words[cls] += int(counts.sum())
+                stage.add(documents=len(ids[cls]), tokens=counts.sum())
+
+                # With hashing the counts are added to the buckets of the words.
+                if self.buckets:
+                    np.add.at(self.bucket_counts[c], hash_words([words[i] for i in unique_ids.tolist()], self.buckets),
+                              counts)
+                    continue
+
+                for i, count in zip(unique_ids[order].tolist(), counts[order].tolist()):
+                    word = words[i]
+
+                    # Add the word to the unique words, and add its count for this class.
+                    self.unique.add(word)
+                    if word not in self.index:
+                        self.index[word] = len(self.index)
+                    self.counts[cls][word] = self.counts[cls].get(word, 0) + count
+                    self.changed[cls].add(word)
 
         # Once all the documents are processed we can compute all the probabilities.
         self.compute_probabilities()
 
-    def test(self, file_dict: dict):
+    def partial_fit(self, cls: str, docs: list):
+        """
+        This method adds new labelled documents of a class to a model that has already been trained, without training it
+        again from the start. Only the counts of the words in the new documents, and the denominators and priors of the
+        classes, are updated.
+        :param cls: The class the documents belong to.
+        :param docs: List of the contents of the documents.
+        """
+        for doc in docs:
+            self.process_document(cls, doc)
+
+        self.compute_probabilities()
+
+    def test(self, file_dict: dict, copy: str = "copy", manifest: bool = False, tables: str = "json",
+             batch_size: int = 1000, cache: TokenCache = None, explain: int = 0):
         """
         This method takes a dictionary of files, if the keys match the class list we can perform evaluation. Otherwise,
         we just perform prediction.
         :param file_dict: A dictionary with class labels as keys and file paths as values.
+        :param copy: How to put each file in the folder for its result, "copy", "hardlink" or "none" to leave them out.
+        :param manifest: Whether to stream the prediction for each file to manifest.jsonl as it is made, rather than
+        keeping them all to write to prediction_probabilities.json at the end.
+        :param tables: How to write the class and word probabilities, "json", "binary" to save the model to model.nb,
+        "top" to write the words that are the most evidence for each class to top_words.json, or "none".
+        :param batch_size: The number of files to predict at once.
+        :param cache: A TokenCache to get the words of the files from, rather than reading and splitting them.
+        :param explain: The number of words for and against the prediction of each file to write to explanations.jsonl
+        with its probabilities, rather than keeping them for prediction_probabilities.json, or 0 to not explain them.
         """
 
         # Can we perform evaluation on this test data?
@@ -135,47 +388,90 @@ class NaiveBayes:
         else:
             output_path = Path.cwd() / "prediction"
 
-        # For every key and set of files in the file dictionary
-        for k, files in file_dict.items():
-
-            # For each file
-            for file in files:
-
-                # Open the file and read the data
-                with open(file) as f:
-                    data = f.read()
+        output_path.mkdir(exist_ok=True, parents=True)
 
-                # Our predicted class is returned from the predict_class function
-                predicted, probabilities = self.predict_class(data)
+        # The manifest has a line of JSON for each file, written as soon as the file is predicted.
+        manifest_file = open(output_path / "manifest.jsonl", "w") if manifest else None
 
-                # Add the probabilities form each class to a dictionary under the filename, so we can compare them
-                # during analysis.
-                self.class_probabilities_for_prediction[file.name] = probabilities
+        # The explanations have a line of JSON for each file, with the words that drove its prediction.
+        explanations_file = open(output_path / "explanations.jsonl", "w") if explain else None
 
-                # If we are evaluating, see if the class label matches the predicted. (k is the ground truth key).
-                if evaluation:
-
-                    # If they match, increment the correct value
-                    if k == predicted:
-                        correct[k] += 1
+        # For every key and set of files in the file dictionary
+        for k, files in file_dict.items():
 
-                        # This file will be output to the correct folder with the class a sub-folder.
-                        file_output_path = output_path / "correct" / k
+            # Read the files ahead in a pool of threads, or get their words from the cache, predicting the classes of a
+            # batch of files at a time.
+            records = cache.read((k, file) for file in files) if cache else read_files((k, file) for file in files)
+            records = profiler.iterate("naive_bayes.read", records, "documents")
+
+            for start in range(0, len(files), batch_size):
+                batch = files[start:start + batch_size]
+                data = [data for _, _, data in islice(records, len(batch))]
+
+                with profiler.stage("naive_bayes.predict") as stage:
+                    vectors = self.vectorize_ids(data, cache.words) if cache else self.vectorize(data)
+                    predictions, scores = self.score(*vectors, len(data))
+                    stage.add(documents=len(batch))
+
+                # Explain the predictions of the whole batch at once, from the same word counts.
+                if explanations_file:
+                    with profiler.stage("naive_bayes.explain") as stage:
+                        explanations = self.explain(*vectors, scores, explain)
+                        for file, explanation, file_scores in zip(batch, explanations, scores.tolist()):
+                            line = {"name": file.name, **explanation,
+                                    "probabilities": dict(zip(self.classes, file_scores))}
+                            if evaluation:
+                                line["label"] = k
+                            explanations_file.write(json.dumps(line) + "\n")
+                        stage.add(documents=len(batch))
+
+                # For each file
+                for file, predicted, file_scores in zip(batch, predictions, scores.tolist()):
+                    probabilities = dict(zip(self.classes, file_scores))
+
+                    # Write the probabilities from each class for this file to the manifest, or add them to a dictionary
+                    # under the filename, so we can compare them during analysis.
+                    if manifest_file:
+                        line = {"name": file.name, "predicted": predicted, "probabilities": probabilities}
+                        if evaluation:
+                            line["label"] = k
+                        manifest_file.write(json.dumps(line) + "\n")
+                    elif not explanations_file:
+                        self.class_probabilities_for_prediction[file.name] = probabilities
+
+                    # If we are evaluating, see if the class label matches the predicted. (k is the ground truth key).
+                    if evaluation:
+
+                        # If they match, increment the correct value
+                        if k == predicted:
+                            correct[k] += 1
+
+                            # This file will be output to the correct folder with the class a sub-folder.
+                            file_output_path = output_path / "correct" / k
+
+                        else:
+                            # If it is incorrect, it will go to the incorrect folder.
+                            file_output_path = output_path / "incorrect" / k
 
                     else:
-                        # If it is incorrect, it will go to the incorrect folder.
-                        file_output_path = output_path / "incorrect" / k
+                        # If we are not evaluating, put the file into the prediction folder under the class it was
+                        # predicted as.
+                        file_output_path = output_path / predicted
 
-                else:
-                    # If we are not evaluating, put the file into the prediction folder under the class it was predicted
-                    # as.
-                    file_output_path = output_path / predicted
+                    # Copy or link the file from the path given to this output path.
+                    if copy != "none":
+                        with profiler.stage("naive_bayes.copy") as stage:
+                            copy_file(file, file_output_path, copy == "hardlink")
+                            stage.add(files=1)
 
-                # Make sure that the directory the file will be written to exist, and the parents of the directory.
-                file_output_path.mkdir(exist_ok=True, parents=True)
+                # Make the lines of this batch visible to anything reading the manifest.
+                if manifest_file:
+                    manifest_file.flush()
 
-                # Copy the file from the path given to this output path.
-                shutil.copyfile(file, file_output_path / file.name)
+        if manifest_file:
+            manifest_file.close()
+        if explanations_file:
+            explanations_file.close()
 
         # If we are evaluating
         if evaluation:
@@ -183,45 +479,189 @@ class NaiveBayes:
             # Write the results to our file.
             with open(output_path / "results.txt", "w") as r:
 
-                # If we have more than one key we can find the accuracy for each group
-                if len(file_dict.keys()) > 1:
+                # For each line of the accuracy of the classes and the overall accuracy
+                for line in accuracy_report(correct, {k: len(v) for k, v in file_dict.items()}):
+
+                    # Print the string to stdout
+                    print(line)
+
+                    # Write the string to our results file.
+                    r.write(line + "\n")
+
+        with profiler.stage("naive_bayes.tables"):
+            if tables == "json":
+                # Write the class probabilities to a json file for use during analysis.
+                with open(output_path / "class_probabilities.json", "w") as c:
+                    json.dump(self.class_probabilities, c)
+
+                # Write the word probabilities for each class to a json for use during analysis.
+                with open(output_path / "probabilities.json", "w") as p:
+                    json.dump({cls: self.word_probabilities(cls) for cls in self.classes}, p)
 
-                    # For each item in the dictionary
-                    for k, v in file_dict.items():
-                        # The accuracy of the item with key k is the correct for that key / number of files in that
-                        # item.
-                        cls_accuracy = f"The accuracy for {k} is {correct[k] / len(v)}"
+            elif tables == "binary":
+                self.save(output_path / "model.nb")
 
-                        # Print the string to stdout
-                        print(cls_accuracy)
+            elif tables == "top":
+                # Write the class probabilities and the words that are the most evidence for each class, with their
+                # log-likelihood ratios, rather than the probability of every word.
+                with open(output_path / "class_probabilities.json", "w") as c:
+                    json.dump(self.class_probabilities, c)
 
-                        # Write the string to our results file.
-                        r.write(cls_accuracy + "\n")
+                with open(output_path / "top_words.json", "w") as t:
+                    json.dump({cls: self.top_words(cls, TOP_WORDS) for cls in self.classes}, t)
 
-                # Get the total number of files and the total correct to find the total accuracy.
-                total_files = sum([len(v) for k, v in file_dict.items()])
-                total_correct = sum(correct.values())
+        # Write probabilities for each individual prediction to a json for use during analysis.
+        if not manifest_file and not explanations_file:
+            with open(output_path / "prediction_probabilities.json", "w") as pp:
+                json.dump(self.class_probabilities_for_prediction, pp)
 
-                # Compute the overall accuracy
-                accuracy = f"The overall accuracy is {total_correct / total_files}"
+    def save(self, path):
+        """
+        This method saves the model to a binary file that can be loaded with NaiveBayes.load. The file has a header with
+        alpha and the sizes of the tables, then as 64-bit integers the document count and total words of each class, the
+        offset of the first nonzero word count of each class, and the column and count of every nonzero word count,
+        sorted by column within each class. Lastly the names of the classes and the words, in the order of their
+        columns, as a JSON list in UTF-8, as words can contain new lines. With hashing the columns are the buckets and
+        there are no words. The probabilities are computed from these when loaded.
+        :param path: The file to save the model to
+        """
+        self.load_counts()
+        classes = list(self.classes)
+        text = json.dumps(classes + list(self.index)).encode("utf-8")
+
+        # The nonzero counts of each class, sorted by column as they are kept for prediction.
+        columns = []
+        counts = []
+        for i, cls in enumerate(classes):
+            if self.buckets:
+                class_columns = np.flatnonzero(self.bucket_counts[i])
+                columns.append(class_columns)
+                counts.append(self.bucket_counts[i, class_columns])
+                continue
 
-                # Print the accuracy to stdout
-                print(accuracy)
+            class_columns = np.array([self.index[word] for word in self.counts[cls]], dtype=np.int64)
+            class_counts = np.array(list(self.counts[cls].values()), dtype=np.int64)
+            order = np.argsort(class_columns)
+            columns.append(class_columns[order])
+            counts.append(class_counts[order])
+
+        offsets = np.cumsum([0] + [len(class_columns) for class_columns in columns])
+
+        with open(path, "wb") as f:
+            f.write(struct.pack(HEADER, MAGIC, self.alpha, len(classes), len(self.index), offsets[-1], len(text),
+                                self.buckets or 0))
+            f.write(np.array([self.doc_count[cls] for cls in classes], dtype="<i8").tobytes())
+            f.write(np.array([self.total_words[cls] for cls in classes], dtype="<i8").tobytes())
+            f.write(offsets.astype("<i8").tobytes())
+            f.write(np.concatenate(columns).astype("<i8").tobytes())
+            f.write(np.concatenate(counts).astype("<i8").tobytes())
+            f.write(text)
+
+    @classmethod
+    def load(cls, path, mmap: bool = True):
+        """
+        This method loads a model saved by NaiveBayes.save. When memory mapped the columns of the nonzero counts are read
+        from the file as they are used rather than copied into memory, so a model can be loaded and used for prediction
+        straight away. The model can be trained further with partial_fit.
+        :param path: The file to load the model from
+        :param mmap: Whether to memory map the file or read it into memory
+        :return: The loaded NaiveBayes model
+        """
+        data = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+
+        # Read the header, checking that this is a model file.
+        magic, alpha, class_size, vocab_size, nonzero_size, text_size, buckets = struct.unpack_from(HEADER, data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a saved NaiveBayes model")
+
+        # The arrays follow the header one after another, we take a view of each part of the file.
+        offset = struct.calcsize(HEADER)
+        arrays = []
+        for size in (class_size, class_size, class_size + 1, nonzero_size, nonzero_size):
+            arrays.append(data[offset:offset + 8 * size].view("<i8"))
+            offset += 8 * size
+        doc_counts, total_words, offsets, columns, counts = arrays
+
+        # The names of the classes come first in the text, then the words.
+        names = json.loads(bytes(data[offset:offset + text_size]).decode("utf-8"))
+        classes, words = names[:class_size], names[class_size:vocab_size + class_size]
+
+        # The classes are kept as dictionary keys, as they are after training, so they can be compared with the keys of
+        # a dictionary of test files. The unique words are the words of the index until load_counts builds the set.
+        model = cls(dict.fromkeys(classes).keys(), alpha, buckets or None)
+        model.index = dict(zip(words, range(vocab_size)))
+        model.unique = model.index.keys()
+        model.mapped_counts = None if buckets else {}
+
+        for i, class_name in enumerate(classes):
+            start, end = offsets[i], offsets[i + 1]
+            model.doc_count[class_name] = int(doc_counts[i])
+            model.total_words[class_name] = int(total_words[i])
+
+            # With hashing the counts are put back in the array of the counts of the buckets of the class.
+            if buckets:
+                model.bucket_counts[i, columns[start:end]] = counts[start:end]
+                continue
 
-                # Write the accuracy to our results file.
-                r.write(accuracy + "\n")
+            # The counts by word, for computing the probabilities of single words and further training, are built from
+            # these when first needed.
+            model.mapped_counts[class_name] = counts[start:end]
+            model.columns[class_name] = columns[start:end]
+            model.log_counts[class_name] = np.log1p(counts[start:end] / alpha)
 
-        # Write the class probabilities to a json file for use during analysis.
-        with open(output_path / "class_probabilities.json", "w") as c:
-            json.dump(self.class_probabilities, c)
+        # Compute the priors and denominators, no words have changed so the log counts are kept, or with hashing they
+        # are computed from the counts of the buckets.
+        model.compute_probabilities()
+        return model
 
-        # Write the word probabilities for each class to a json for use during analysis.
-        with open(output_path / "probabilities.json", "w") as p:
-            json.dump(self.probabilities, p)
+    def load_counts(self):
+        """
+        This method builds the counts by word of each class and the set of unique words of a model loaded by load, the
+        first time they are needed, to train it further, save it or compute the probabilities of single words. Until
+        then the counts stay in the memory mapped file.
+        """
+        if self.mapped_counts is None:
+            return
 
-        # Write probabilities for each individual prediction to a json for use during analysis.
-        with open(output_path / "prediction_probabilities.json", "w") as pp:
-            json.dump(self.class_probabilities_for_prediction, pp)
+        words = list(self.index)
+        for cls, counts in self.mapped_counts.items():
+            self.counts[cls] = dict(zip([words[column] for column in self.columns[cls].tolist()], counts.tolist()))
+
+        self.unique = set(self.index)
+        self.mapped_counts = None
+
+    def predict_stream(self, records, output, batch_size: int = 1000):
+        """
+        This method predicts the classes of a stream of documents in batches, writing a line of JSON with the name,
+        predicted class and class probabilities of each document to the output as it goes, so only one batch is held in
+        memory at a time. Documents that have a class are counted for the accuracy.
+        :param records: Iterable of the class or None, the name and the contents of each document
+        :param output: The file to write the lines of JSON to
+        :param batch_size: The number of documents to predict at once
+        :return: Dictionaries of the number of correct predictions and the number of documents for each class
+        """
+        records = iter(records)
+        correct = {}
+        totals = {}
+
+        # Take the next batch of documents until there are none left.
+        while batch := list(islice(records, batch_size)):
+            with profiler.stage("naive_bayes.predict") as stage:
+                predictions, scores = self.predict_batch([data for _, _, data in batch])
+                stage.add(documents=len(batch))
+
+            for (cls, name, _), predicted, doc_scores in zip(batch, predictions, scores.tolist()):
+                line = {"name": name, "predicted": predicted, "probabilities": dict(zip(self.classes, doc_scores))}
+
+                # If the document has a class, see if the prediction matches it.
+                if cls is not None:
+                    line["label"] = cls
+                    totals[cls] = totals.get(cls, 0) + 1
+                    correct[cls] = correct.get(cls, 0) + (cls == predicted)
+
+                output.write(json.dumps(line) + "\n")
+
+        return correct, totals
 
     def increment_count(self, cls: str, word: str):
         """
@@ -238,6 +678,10 @@ class NaiveBayes:
         else:
             self.counts[cls][word] = 1
 
+        # Increase the total words for this class and remember that the probability of this word has changed.
+        self.total_words[cls] += 1
+        self.changed[cls].add(word)
+
     def process_document(self, cls: str, doc: str):
         """
         This function takes a document and the class and counts the words, tracks the unique words and increase the
@@ -245,12 +689,20 @@ class NaiveBayes:
         :param cls: The class the document belongs to.
         :param doc: The contents of the document.
         """
+        self.load_counts()
 
         # Increase the document count by 1 for the current class.
         self.doc_count[cls] += 1
 
+        # With hashing, add the words without punctuation to the counts of their buckets.
+        if self.buckets:
+            words = document_words(doc)
+            np.add.at(self.bucket_counts[list(self.classes).index(cls)], hash_words(words, self.buckets), 1)
+            self.total_words[cls] += len(words)
+            return
+
         # Split the doc on whitespace and strip and set the values to lower case.
-        words = [w.strip().lower() for w in doc.split(" ")]
+        words = tokenize(doc)
 
         # For each word
         for word in words:
@@ -263,107 +715,500 @@ class NaiveBayes:
             self.unique.add(word)
             self.increment_count(cls, word)
 
+            # Give the word a column if it is new.
+            if word not in self.index:
+                self.index[word] = len(self.index)
+
     def compute_probabilities(self):
         """
-        This function computes the class probabilities and the probabilities for each word for that class. This makes
-        use of the counts from processing the documents.
+        This function computes the class probabilities and the denominators of the word probabilities for each class,
+        and updates the log counts of the words whose counts have changed. This makes use of the counts from processing
+        the documents, and only takes time for the classes and changed words rather than every word in every class.
+        """
+
+        with profiler.stage("naive_bayes.compute_probabilities"):
+            # The counts have changed, so the analysis and scoring indexes are built again when they are next needed.
+            self.analysis = None
+            self.scoring = None
+
+            # With hashing, the log counts are computed again from the counts of the buckets, and the buckets with a
+            # count in any class are the unique words.
+            if self.buckets:
+                self.seen = self.bucket_counts.any(axis=0)
+                for i, cls in enumerate(self.classes):
+                    self.columns[cls] = np.flatnonzero(self.bucket_counts[i])
+                    self.log_counts[cls] = np.log1p(self.bucket_counts[i, self.columns[cls]] / self.alpha)
+
+            # Get the total number of unique words and documents.
+            total_unique_words = int(self.seen.sum()) if self.buckets else len(self.unique)
+            total_docs = sum(self.doc_count.values())
+
+            # For every class
+            for i, cls in enumerate(self.classes):
+
+                # Calculate the class probability, and its log. A class with no documents can never be predicted.
+                self.class_probabilities[cls] = self.doc_count[cls] / total_docs
+                self.log_priors[i] = math.log(self.class_probabilities[cls]) if self.doc_count[cls] else -math.inf
+
+                # The denominator of the probability of a word given this class, which changes with the number of unique
+                # words even if no words were added to this class.
+                self.log_denominators[i] = math.log(self.total_words[cls] + (self.alpha * total_unique_words))
+
+                # If no counts have changed in this class, the log counts are still correct.
+                if not self.changed[cls]:
+                    continue
+
+                # Compute the log counts of the changed words and replace their old entries, keeping the columns sorted.
+                words = list(self.changed[cls])
+                columns = np.array([self.index[word] for word in words], dtype=np.int64)
+                log_counts = np.log1p(np.array([self.counts[cls][word] for word in words]) / self.alpha)
+
+                keep = ~np.isin(self.columns[cls], columns)
+                columns = np.concatenate([self.columns[cls][keep], columns])
+                log_counts = np.concatenate([self.log_counts[cls][keep], log_counts])
+
+                order = np.argsort(columns)
+                self.columns[cls] = columns[order]
+                self.log_counts[cls] = log_counts[order]
+                self.changed[cls] = set()
+
+    def probability(self, cls: str, word: str):
+        """
+        This function computes the probability of a word given a class, using the counts and considering the alpha.
+        :param cls: The class
+        :param word: The word
+        :return: The probability
         """
+        self.load_counts()
+        if self.buckets:
+            # With hashing the count is the count of the bucket of the word.
+            word_count = self.bucket_counts[list(self.classes).index(cls), hash_words([word], self.buckets)[0]]
+            total_unique_words = int(self.seen.sum())
+        else:
+            word_count = self.counts[cls].get(word, 0)
+            total_unique_words = len(self.unique)
 
-        # Get the total number of unique words.
-        total_unique_words = len(self.unique)
+        return (word_count + self.alpha) / (self.total_words[cls] + (self.alpha * total_unique_words))
 
-        # For every class
-        for cls in self.classes:
+    def log_probability(self, cls: str, word: str):
+        """
+        This function computes the log of the probability of a word given a class.
+        :param cls: The class
+        :param word: The word
+        :return: The log probability
+        """
+        return math.log(self.probability(cls, word))
 
-            # The total words in this class
-            self.total_words[cls] = sum(self.counts[cls].values())
+    def word_probabilities(self, cls: str):
+        """
+        This function computes the probability of every unique word given a class, for writing out during testing. With
+        hashing the words are not kept, so there are none.
+        :param cls: The class
+        :return: Dictionary of the probability of each word
+        """
+        return {word: self.probability(cls, word) for word in self.unique}
 
-            # Calculate the class probability.
-            self.class_probabilities[cls] = self.doc_count[cls] / sum(self.doc_count.values())
+    def predict_class(self, doc: str):
+        """
+        This function takes a document and predicts a sentiment class.
+        :param doc: The document for a prediction to be made on.
+        :return: class of prediction.
+        """
+        # Predict the class of a batch of just this document.
+        predicted, scores = self.predict_batch([doc])
 
-            # For every word in the unique set of words.
-            for word in self.unique:
+        # Return the class with the higher probability and the dictionary with probabilities for both classes.
+        return predicted[0], dict(zip(self.classes, scores[0].tolist()))
 
-                # If we have the word in the counts for this class, use the count to determine the probability.
-                if word in self.counts[cls].keys():
-                    word_count = self.counts[cls][word]
+    def vectorize(self, docs):
+        """
+        This function tokenizes a batch of documents and counts the words of each document that are in the vocabulary,
+        giving a sparse matrix with a row for each document and a column for each word.
+        :param docs: List of documents
+        :return: Arrays of the row, column and count of every nonzero entry
+        """
+        index = self.index
+        rows = []
+        columns = []
+
+        # With hashing, the columns are the buckets of the words, keeping the buckets that have been seen before.
+        if self.buckets:
+            for row, doc in enumerate(docs):
+                doc_columns = hash_words(document_words(doc), self.buckets)
+                doc_columns = doc_columns[self.seen[doc_columns]].tolist()
+                columns += doc_columns
+                rows += [row] * len(doc_columns)
+
+        # Split each document as during training, keeping the columns of the words that we have seen before.
+        else:
+            for row, doc in enumerate(docs):
+                doc_columns = [index[word] for word in tokenize(doc) if word in index]
+                columns += doc_columns
+                rows += [row] * len(doc_columns)
+
+        # Count the repeats of each word in each document.
+        size = max(self.buckets or len(index), 1)
+        keys, counts = np.unique(np.array(rows, dtype=np.int64) * size + np.array(columns, dtype=np.int64),
+                                 return_counts=True)
+        return keys // size, keys % size, counts
+
+    def predict_batch(self, docs):
+        """
+        This function predicts the class of a batch of documents at once. The documents are converted to sparse count
+        vectors, and the log probability of each class for each document is the log prior of the class plus the sum of
+        the log probabilities of the words in the document.
+        :param docs: List of documents
+        :return: List of the predicted class of each document and an array of the log probability of each class for
+        each document
+        """
+        return self.score(*self.vectorize(docs), len(docs))
 
-                # Otherwise, we have no count of this word for this class.
-                else:
-                    word_count = 0
+    def predict_ids(self, docs, words):
+        """
+        This function predicts the class of a batch of documents that have already been split into words and converted
+        to ids, such as those from a TokenCache, in the same way as predict_batch.
+        :param docs: List of arrays of the word ids of each document
+        :param words: List of the word of each id
+        :return: List of the predicted class of each document and an array of the log probability of each class for
+        each document
+        """
+        return self.score(*self.vectorize_ids(docs, words), len(docs))
 
-                # Determine the probability of this word given this class using the counts and considering the alpha.
-                self.probabilities[cls][word] = (word_count + self.alpha) / (self.total_words[cls] + (self.alpha * total_unique_words))
+    def vectorize_ids(self, docs, words):
+        """
+        This function counts the words of a batch of documents that have already been converted to ids, in the same way
+        as vectorize.
+        :param docs: List of arrays of the word ids of each document
+        :param words: List of the word of each id
+        :return: Arrays of the row, column and count of every nonzero entry
+        """
+        ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [np.asarray(doc, dtype=np.int64) for doc in docs])
+        rows = np.repeat(np.arange(len(docs)), [len(doc) for doc in docs])
+
+        # Find the column of each id in the batch, -1 for words that we have not seen before, which are dropped.
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        if self.buckets:
+            columns = hash_words([words[i] for i in unique_ids.tolist()], self.buckets)
+            columns[~self.seen[columns]] = -1
+        else:
+            columns = np.array([self.index.get(words[i], -1) for i in unique_ids.tolist()], dtype=np.int64)
+        columns = columns[inverse]
+        known = columns >= 0
 
-                # The log of this is taken, so we can sum the probabilities to find the total for a class.
-                self.log_probabilities[cls][word] = math.log(self.probabilities[cls][word])
+        # Count the repeats of each word in each document.
+        size = max(self.buckets or len(self.index), 1)
+        keys, counts = np.unique(rows[known] * size + columns[known], return_counts=True)
+        return keys // size, keys % size, counts
 
-    def predict_class(self, doc: str):
+    def score(self, rows, columns, counts, size):
         """
-        This function takes a document and predicts a sentiment class.
-        :param doc: The document for a prediction to be made on.
-        :return: class of prediction.
+        This function computes the log probability of each class for a batch of documents stored as a sparse matrix of
+        word counts, and predicts the class of each document.
+        :param rows: Array of the document of each nonzero count
+        :param columns: Array of the word column of each nonzero count
+        :param counts: Array of the counts
+        :param size: The number of documents
+        :return: List of the predicted class of each document and an array of the log probability of each class for
+        each document
+        """
+        # Every word adds at least the log probability of a word with a count of 0, log(alpha / denominator).
+        lengths = np.bincount(rows, weights=counts, minlength=size)
+        scores = self.log_priors + lengths[:, None] * (math.log(self.alpha) - self.log_denominators)
+
+        # The words that have counts in a class add the log of (count + alpha) / alpha more each time they occur. The
+        # log counts of only the words in the batch are put in a dense table with a row for each class, a block of
+        # classes at a time so the table stays small, and each row is multiplied by the counts and summed for each
+        # document.
+        starts, classes, log_counts = self.scoring_index()
+        batch_columns, local_columns = np.unique(columns, return_inverse=True)
+
+        # The entries of the words in the batch, sorted by class.
+        repeats = starts[batch_columns + 1] - starts[batch_columns]
+        offsets = starts[batch_columns] - (np.cumsum(repeats) - repeats)
+        positions = np.arange(repeats.sum()) + np.repeat(offsets, repeats)
+        entry_columns = np.repeat(np.arange(len(batch_columns)), repeats)
+        order = np.argsort(classes[positions], kind="stable")
+        positions, entry_columns = positions[order], entry_columns[order]
+        entry_classes = classes[positions]
+
+        block = max(TABLE_CELLS // max(len(batch_columns), 1), 1)
+        for first in range(0, len(self.classes), block):
+            last = min(first + block, len(self.classes))
+            start, end = np.searchsorted(entry_classes, [first, last])
+            table = np.zeros((last - first, len(batch_columns)))
+            table[entry_classes[start:end] - first, entry_columns[start:end]] = log_counts[positions[start:end]]
+
+            for i in range(first, last):
+                scores[:, i] += np.bincount(rows, weights=counts * table[i - first, local_columns], minlength=size)
+
+        # Return the class with the highest probability for each document, the first class in the case of a tie.
+        classes = list(self.classes)
+        return [classes[i] for i in scores.argmax(axis=1)], scores
+
+    def scoring_index(self):
         """
-        # A dictionary for capturing the probabilities of both classes.
-        probabilities = {}
+        This function builds the index used to score documents, once for the trained counts. It puts the log counts of
+        all the classes together sorted by column, so the entries of a column are next to each other, which means a
+        batch is scored with one lookup for each of its words rather than one for each word and class.
+        :return: Arrays of the start of the entries of each column, with one more for the end, and the class and log
+        count of each entry
+        """
+        if self.scoring is not None:
+            return self.scoring
 
-        # For each class.
-        for cls in self.classes:
+        columns = np.concatenate([np.zeros(0, dtype=np.int64)] + [self.columns[cls] for cls in self.classes])
+        classes = np.repeat(np.arange(len(self.classes), dtype=np.int32),
+                            [len(self.columns[cls]) for cls in self.classes])
+        log_counts = np.concatenate([np.zeros(0)] + [self.log_counts[cls] for cls in self.classes])
+
+        # The entries of each class are sorted by column, so a stable sort keeps the classes of a column in order.
+        order = np.argsort(columns, kind="stable")
+        size = max(self.buckets or len(self.index), 1)
+        starts = np.concatenate([[0], np.cumsum(np.bincount(columns, minlength=size))])
+
+        self.scoring = (starts, classes[order], log_counts[order])
+        return self.scoring
+
+    def analysis_index(self):
+        """
+        This function builds the index used to analyse the model, once for the trained counts. It keeps the log
+        probability of every word given every class, as a table with a row for each word, and the log-likelihood ratio
+        of each word for each class, the log of its probability given the class over its probability given the other
+        classes counted together, with the words of each class sorted by it. A word with a high ratio is evidence for
+        the class and a word with a low ratio is evidence against it.
+        :return: Dictionary of the words, the log probability table, the ratios and the sorted columns for each class
+        """
+        if self.analysis is not None:
+            return self.analysis
+        self.load_counts()
+
+        # With hashing the words are not kept, so they cannot be listed.
+        if self.buckets:
+            raise ValueError("The words are not kept with hashing, so they cannot be analysed")
+        if len(self.classes) < 2:
+            raise ValueError("Analysing the words needs at least two classes")
+
+        # The count of every word in every class, with a row for each class and a column for each word.
+        words = list(self.index)
+        counts = np.zeros((len(self.classes), len(words)))
+        for i, cls in enumerate(self.classes):
+            counts[i, [self.index[word] for word in self.counts[cls]]] = list(self.counts[cls].values())
+
+        # The log probability of each word given each class, the same as the terms added up by score.
+        log_probabilities = np.log(counts + self.alpha) - self.log_denominators[:, None]
+
+        # The log probability of each word given any other class, from the counts of the other classes together.
+        totals = np.array([self.total_words[cls] for cls in self.classes], dtype=np.float64)
+        log_rest = (np.log(counts.sum(axis=0) - counts + self.alpha)
+                    - np.log(totals.sum() - totals + self.alpha * len(self.unique))[:, None])
+
+        ratios = log_probabilities - log_rest
+        self.analysis = {"words": words, "table": np.ascontiguousarray(log_probabilities.T), "ratios": ratios,
+                         "order": np.argsort(-ratios, axis=1, kind="stable")}
+        return self.analysis
+
+    def top_words(self, cls: str, k: int = 20):
+        """
+        This function lists the words that are the most evidence for a class, from the index built by analysis_index.
+        :param cls: The class
+        :param k: The number of words
+        :return: List of the k words with the highest log-likelihood ratio for the class, with their ratios
+        """
+        analysis = self.analysis_index()
+        i = list(self.classes).index(cls)
+        return [(analysis["words"][column], float(analysis["ratios"][i, column]))
+                for column in analysis["order"][i, :k].tolist()]
+
+    def explain(self, rows, columns, counts, scores, k: int = 10):
+        """
+        This function explains the predictions of a batch of documents stored as a sparse matrix of word counts, with
+        the scores from score. Each word adds its count times the difference of its log probabilities given the
+        predicted class and the class with the next highest score, so these contributions and the difference of the log
+        priors add up to the margin between the two scores. The words that added the most for and against the predicted
+        class are found for every document at once.
+        :param rows: Array of the document of each nonzero count
+        :param columns: Array of the word column of each nonzero count
+        :param counts: Array of the counts
+        :param scores: Array of the log probability of each class for each document, from score
+        :param k: The number of words for and against the predicted class to give for each document
+        :return: List of a dictionary for each document with the predicted class, the runner up, the margin between
+        them, the part of the margin from the priors and the words for and against the prediction, each with its count
+        and contribution
+        """
+        analysis = self.analysis_index()
+        words = analysis["words"]
+        classes = list(self.classes)
+
+        # The predicted class of each document, the first in the case of a tie as in score, and the runner up.
+        ranking = np.argsort(-scores, axis=1, kind="stable")
+        best, runner_up = ranking[:, 0], ranking[:, 1]
+
+        contributions = counts * (analysis["table"][columns, best[rows]] - analysis["table"][columns, runner_up[rows]])
+        priors = self.log_priors[best] - self.log_priors[runner_up]
+        margins = priors + np.bincount(rows, weights=contributions, minlength=len(scores))
+
+        def top(keep, key):
+            # The k entries with the highest key in each document, sorted by document then key, and the slice of them
+            # for each document.
+            entries = np.flatnonzero(keep)
+            entries = entries[np.lexsort((-key[entries], rows[entries]))]
+            entry_rows = rows[entries]
+            rank = np.arange(len(entries)) - np.searchsorted(entry_rows, entry_rows)
+            entries = entries[rank < k]
+            bounds = np.searchsorted(rows[entries], np.arange(len(scores) + 1))
+            return entries, bounds
+
+        for_entries, for_bounds = top(contributions > 0, contributions)
+        against_entries, against_bounds = top(contributions < 0, -contributions)
+
+        def listed(entries):
+            return [[words[column], count, contribution] for column, count, contribution in
+                    zip(columns[entries].tolist(), counts[entries].tolist(), contributions[entries].tolist())]
+
+        return [{"predicted": classes[best[i]], "runner_up": classes[runner_up[i]], "margin": float(margins[i]),
+                 "prior": float(priors[i]), "for": listed(for_entries[for_bounds[i]:for_bounds[i + 1]]),
+                 "against": listed(against_entries[against_bounds[i]:against_bounds[i + 1]])}
+                for i in range(len(scores))]
+
+    def explain_batch(self, docs, k: int = 10):
+        """
+        This function predicts the classes of a batch of documents and explains each prediction with explain.
+        :param docs: List of documents
+        :param k: The number of words for and against the predicted class to give for each document
+        :return: List of the explanation of each document
+        """
+        rows, columns, counts = self.vectorize(docs)
+        _, scores = self.score(rows, columns, counts, len(docs))
+        return self.explain(rows, columns, counts, scores, k)
+
+
+def tokenize(doc: str):
+    """
+    This function splits a document into words, on the whitespace and strip the word and put it in lowercase.
+    :param doc: The document to split
+    :return: List of words
+    """
+    return [w.strip().lower() for w in doc.split(" ")]
+
+
+def document_words(doc: str):
+    """
+    This function splits a document into the words that are counted during training, leaving out punctuation. Cached
+    words are keyed by TOKENIZER_VERSION, which must be increased whenever this changes.
+    :param doc: The document to split
+    :return: List of words
+    """
+    return [word for word in tokenize(doc) if word not in string.punctuation]
 
-            # Set up a list for storing the probabilities.
-            probabilities[cls] = []
 
-            # Split the document as before during training, on the whitespace and strip the word and put it in
-            # lowercase.
-            words = [w.strip().lower() for w in doc.split(" ")]
+def hash_words(words, buckets: int):
+    """
+    This function hashes words to buckets, with the CRC32 of the UTF-8 of each word. Unlike hash() this is the same in
+    every process and run, so hashed counts can be merged and saved.
+    :param words: List of words
+    :param buckets: The number of buckets
+    :return: Array of the bucket of each word
+    """
+    return np.array([zlib.crc32(word.encode("utf-8")) for word in words], dtype=np.int64) % buckets
 
-            # For each word
-            for word in words:
 
-                # If we have seen the word before, we will add the probability to the list for this class.
-                if word in self.unique:
-                    probabilities[cls].append(self.log_probabilities[cls][word])
+def train_shard(shard):
+    """
+    This function counts the words and documents of a shard of the training files. It is run in the worker processes by
+    NaiveBayes.train.
+    :param shard: The classes, the alpha value, the number of hash buckets and the list of class and file pairs in the
+    shard
+    :return: The NaiveBayes model with the counts of the shard
+    """
+    classes, alpha, buckets, files = shard
+    model = NaiveBayes(classes, alpha, buckets)
 
-            # The probability of this class given the content is the sum of the log probabilities.
-            cls_prob = sum(probabilities[cls])
+    for cls, file in files:
+        with open(file) as f:
+            model.process_document(cls, f.read())
 
-            # Now, we need to consider the prior, which we need to convert to a log and add to the probability.
-            cls_prob += math.log(self.class_probabilities[cls])
+    return model
 
-            probabilities[cls] = cls_prob
 
-        # Return the class with the higher probability and the dictionary with probabilities for both classes.
-        return max(probabilities, key=probabilities.get), probabilities
+def benchmark_training(training_dir, jobs):
+    """
+    This function trains a model on the training directory in one process and with a pool of processes, checks that the
+    two models are the same and reports the speedup.
+    :param training_dir: The training directory, with a subdirectory for each class
+    :param jobs: The number of processes to use
+    :return: Dictionary of the time taken by each and the speedup
+    """
+    training_data = return_files(training_dir)
+    timings = {}
+    models = {}
+
+    for n in (1, jobs):
+        start = time.perf_counter()
+        models[n] = NaiveBayes(training_data.keys(), 0.9)
+        models[n].train(training_data, n)
+        timings[n] = time.perf_counter() - start
+
+    serial, parallel = models[1], models[jobs]
+    if serial.counts != parallel.counts or serial.doc_count != parallel.doc_count or serial.index != parallel.index:
+        raise AssertionError("The models trained serially and in parallel are different")
+
+    result = {"serial_seconds": timings[1], "parallel_seconds": timings[jobs], "jobs": jobs,
+              "speedup": timings[1] / timings[jobs]}
+    print(f"Serial training took {timings[1]:.2f}s, training with {jobs} jobs took {timings[jobs]:.2f}s, a speedup of "
+          f"{result['speedup']:.2f}x")
+    return result
+
+
+def copy_file(file: Path, directory: Path, hardlink: bool = False):
+    """
+    This function puts a file into a directory, making the directory and its parents if they don't exist. The file is
+    copied, or hard linked where the file system supports it, which takes no time or space for the contents.
+    :param file: The file to copy
+    :param directory: The directory to put it in
+    :param hardlink: Whether to hard link the file rather than copy it
+    """
 
+    # Make sure that the directory the file will be written to exist, and the parents of the directory.
+    directory.mkdir(exist_ok=True, parents=True)
+    target = directory / file.name
 
-def create_folder(text_file):
+    if hardlink:
+        # Replace a file left by a previous run, as a link cannot be made over it.
+        target.unlink(missing_ok=True)
+        try:
+            os.link(file, target)
+            return
+        except OSError:
+            # Links are not supported here, for example across file systems, so copy the file instead.
+            pass
+
+    shutil.copyfile(file, target)
+
+
+def accuracy_report(correct: dict, totals: dict):
     """
-    This function takes a text file with a new review on each line and converts it to a folder with a subfolder called
-    data that has the reviews in separate text files. This allows for the .txt file format to be changed to the format
-    currently accepted by the model.
-    :param text_file: The name of the text file in the current working directory
-    :return: The folder created
+    This function computes the accuracy of each class, if there is more than one, and the overall accuracy.
+    :param correct: Dictionary of the number of correct predictions for each class
+    :param totals: Dictionary of the number of documents of each class
+    :return: List of the lines reporting the accuracy, empty if there were no documents
     """
+    lines = []
 
-    # Create a path for the text file and the output folder.
-    text_path = Path.cwd() / text_file
-    output_folder = text_path.parent / text_path.name[:-4] / "data"
+    # If there are no documents with classes there is nothing to report.
+    if not totals:
+        return lines
 
-    # Make a directory for the files to be written to.
-    output_folder.mkdir(parents=True, exist_ok=True)
+    # If we have more than one key we can find the accuracy for each group
+    if len(totals) > 1:
 
-    # Open the text file and read the data, splitting on new lines.
-    # This will result in a list of reviews.
-    with io.open(text_path, mode="r", encoding="utf-8") as t:
-        data = t.read().split("\n")
+        # The accuracy of the item with key k is the correct for that key / number of files in that item.
+        for k, total in totals.items():
+            lines.append(f"The accuracy for {k} is {correct.get(k, 0) / total}")
 
-    # Iterate through the reviews and write them to a file in the new folder.
-    for i in range(len(data)):
-        with open((output_folder / f"{i}.txt"), "w") as tmp:
-            tmp.write(data[i])
+    # Get the total number of files and the total correct to find the overall accuracy.
+    lines.append(f"The overall accuracy is {sum(correct.values()) / sum(totals.values())}")
 
-    # Return the path to the new folder, which is the parent of the data folder.
-    return output_folder.parent
+    return lines
 
 
 def return_files(dir: Path):
@@ -374,30 +1219,72 @@ def return_files(dir: Path):
     :return: data
     """
 
-    # Dictionary to store the data
-    data = {}
-
-    # For every subdirectory
-    for cls in Path(dir).iterdir():
-        cls_files = []
-
-        # Add every file in the subdirectory to a list.
-        for file in cls.iterdir():
-            cls_files.append(file)
-
-        # Insert this list into the dictionary under the subdirectory name.
-        data[cls.name] = cls_files
+    # List the files of every subdirectory with os.scandir, which avoids a stat call for every file.
+    with profiler.stage("naive_bayes.scan") as stage:
+        data = scan_directory(dir)
+        stage.add(files=sum(len(files) for files in data.values()))
 
     return data
 
 
 if __name__ == "__main__":
-    training_dir = "training"
-    test_dir = "test_with_gt" # This can be changed to the test directory for prediction only or a txt file to pass
-    # reviews to be classified.
-
-    if len(sys.argv) > 1: # If we have arguments, we can assign them.
-        training_dir = sys.argv[1]
-        test_dir = sys.argv[2]
-
-    main(training_dir, test_dir)
+    parser = argparse.ArgumentParser(description="Train a Naive Bayes sentiment classifier and test or predict with it.")
+    parser.add_argument("training_dir", nargs="?",
+                        help="Training directory with a subdirectory for each class, defaults to training. With --model "
+                             "only the test path is given")
+    # This can be changed to the test directory for prediction only or a txt file to pass reviews to be classified.
+    parser.add_argument("test_dir", nargs="?",
+                        help="Test directory, a .txt file with a review on each line or a .jsonl file, defaults to "
+                             "test_with_gt")
+    parser.add_argument("--model", help="Load a model saved with --save instead of training")
+    parser.add_argument("--save", help="Save the trained model to this file")
+    parser.add_argument("--alpha", type=float, default=0.9, help="Value of alpha for smoothing")
+    parser.add_argument("--buckets", type=int,
+                        help="Hash the words into this many buckets, so the memory used does not grow with the words")
+    parser.add_argument("--cache", help="Directory of a cache of the words of the training and test files")
+    parser.add_argument("--output", help="JSONL file for the predictions of a .txt or .jsonl test file")
+    parser.add_argument("--text-field", default="text", help="Field of the review in a .jsonl test file")
+    parser.add_argument("--label-field", default="label", help="Field of the class in a .jsonl test file")
+    parser.add_argument("--copy", default="copy", choices=["copy", "hardlink", "none"],
+                        help="How to put the test files in the results or prediction folders")
+    parser.add_argument("--manifest", action="store_true",
+                        help="Stream the prediction of each test file to manifest.jsonl instead of a JSON dictionary")
+    parser.add_argument("--tables", default="json", choices=["json", "binary", "top", "none"],
+                        help="How to write the class and word probability tables, binary saves the model and top "
+                             "writes the words that are the most evidence for each class")
+    parser.add_argument("--explain", type=int, default=0,
+                        help="Write this many words for and against the prediction of each test file to "
+                             "explanations.jsonl")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes to train with")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare training in one process with training with --jobs processes instead of testing")
+    parser.add_argument("--profile", help="Write the time, items and memory of each stage to this JSON file, or run "
+                                          "cProfile and write its statistics if it ends in .prof")
+    args = parser.parse_args()
+
+    # The words are not kept with hashing, so they cannot be listed or used to explain the predictions.
+    if args.buckets and (args.tables == "top" or args.explain):
+        parser.error("--tables top and --explain need the words, so cannot be used with --buckets")
+
+    # With a saved model there is no training directory, so a single path is the test path.
+    if args.model:
+        if args.training_dir and args.test_dir:
+            parser.error("--model is given instead of a training directory, so only the test path can be given")
+        training_dir, test_dir = None, args.training_dir or "test_with_gt"
+    else:
+        training_dir, test_dir = args.training_dir or "training", args.test_dir or "test_with_gt"
+
+    # Only training from the files of a directory is split between processes, not loading a model or training from a
+    # cache or an archive.
+    if args.jobs > 1 and not args.benchmark:
+        if args.model:
+            parser.error("--jobs cannot be used with --model, as the model is loaded rather than trained")
+        if args.cache or os.path.isfile(training_dir):
+            parser.error("--jobs cannot be used with --cache or a training archive, which are read in one process")
+
+    with profiler.session(args.profile):
+        if args.benchmark:
+            benchmark_training(training_dir, args.jobs if args.jobs > 1 else os.cpu_count())
+        else:
+            main(training_dir, test_dir, args.jobs, args.output, args.text_field, args.label_field, args.copy,
+                 args.manifest, args.tables, args.model, args.save, args.alpha, args.cache, args.buckets, args.explain)
@@ -0,0 +1,133 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from corpus import read_file
+
+
+class TokenCache:
+    """
+    The TokenCache class keeps the words of documents on disk, so files that are read again in later runs do not need to
+    be split again. Each document is stored as an array of word ids in one flat file, tokens.bin, and index.json holds
+    the offset and length of the ids of each file, keyed by its path. A file is split again if its size or modification
+    time has changed, or if it was split by a different version of the tokenizer. The words of the ids are in
+    vocab.jsonl, a JSON string on each line in the order of their ids, which is only ever added to.
+    """
+
+    def __init__(self, directory, tokenizer, version: int):
+        """
+        :param directory: The directory to keep the cache in, it is created if it does not exist
+        :param tokenizer: The function that splits a document into a list of words
+        :param version: The version of the tokenizer
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.tokenizer = tokenizer
+        self.version = version
+
+        # The words of the ids, and the id of each word.
+        vocab_path = self.directory / "vocab.jsonl"
+        with open(vocab_path, "a+", encoding="utf-8") as f:
+            f.seek(0)
+            self.words = [json.loads(line) for line in f]
+        self.vocab = dict(zip(self.words, range(len(self.words))))
+        self.saved_words = len(self.words)
+
+        # The size, modification time, tokenizer version, offset and length of the ids of each file.
+        index_path = self.directory / "index.json"
+        self.entries = json.loads(index_path.read_text()) if index_path.exists() else {}
+
+        # The ids of all the files, memory mapped, and a file to add the ids of new files to.
+        self.tokens_path = self.directory / "tokens.bin"
+        self.tokens = open(self.tokens_path, "ab")
+        self.size = self.tokens.tell() // 4
+        self.mapped = np.memmap(self.tokens_path, dtype="<i4", mode="r") if self.size else np.zeros(0, dtype="<i4")
+
+        # The number of files found in the cache and split again.
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """
+        This function gets the word ids of a file, from the cache if the file has not changed, otherwise by reading and
+        splitting it and adding it to the cache.
+        :param path: The path of the file
+        :return: Array of the word ids
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.entries.get(key)
+
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns \
+                and entry["version"] == self.version:
+            self.hits += 1
+            offset, length = entry["offset"], entry["length"]
+
+            # Ids added in this run are past the end of the memory map, so they are read from the file.
+            if offset + length <= len(self.mapped):
+                return self.mapped[offset:offset + length]
+            self.tokens.flush()
+            return np.fromfile(self.tokens_path, dtype="<i4", count=length, offset=4 * offset)
+
+        self.misses += 1
+        ids = self.encode(self.tokenizer(read_file(path)))
+
+        # Add the ids to the end of the file, the ids of an older version of the file are left unused.
+        self.tokens.write(ids.astype("<i4").tobytes())
+        self.entries[key] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "version": self.version,
+                             "offset": self.size, "length": len(ids)}
+        self.size += len(ids)
+
+        return ids
+
+    def encode(self, words):
+        """
+        This function converts words to ids, giving new words the next ids.
+        :param words: List of words
+        :return: Array of the ids
+        """
+        vocab = self.vocab
+        for word in words:
+            if word not in vocab:
+                vocab[word] = len(self.words)
+                self.words.append(word)
+
+        return np.array([vocab[word] for word in words], dtype=np.int32)
+
+    def read(self, files):
+        """
+        This generator gets the word ids of files from the cache.
+        :param files: Iterable of the label and path of each file
+        :return: generator of the label, file name and array of word ids of each file
+        """
+        for label, path in files:
+            yield label, Path(path).name, self.get(path)
+
+    def save(self):
+        """
+        This function writes the new words and the index, so the files added in this run are found in later runs. The
+        ids are written before the index, so an index that has been written always refers to ids in the file.
+        """
+        self.tokens.flush()
+
+        with open(self.directory / "vocab.jsonl", "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(word) + "\n" for word in self.words[self.saved_words:]))
+        self.saved_words = len(self.words)
+
+        # Write the index to a new file and then replace the old one, so it is never left half written.
+        index_path = self.directory / "index.json"
+        temporary_path = self.directory / "index.json.tmp"
+        temporary_path.write_text(json.dumps(self.entries))
+        os.replace(temporary_path, index_path)
+
+    def close(self):
+        self.save()
+        self.tokens.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
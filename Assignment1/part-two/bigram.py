@@ -1,78 +1,287 @@
+import argparse
 import math
+import multiprocessing
+import os
+import struct
 import sys
+from itertools import islice, repeat
+from pathlib import Path
 
+import numpy as np
 
-def run(train_file, test_file):
+# The profiling module is shared by the three parts of the assignment, it is in the folder above this one.
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from profiling import profiler
+
+# The start of a saved model file, and the format of the header. The header holds the number of words, the number of
+# bigrams and the size of the vocabulary text in bytes.
+MAGIC = b"BIGRAM01"
+HEADER = "<8sQQQ"
+
+
+def run(train_file, test_file, model_file=None, save_file=None, jobs=1):
     """
     This function is the main function of the script. It reads in the train and test data. Initializes the BigramModel
     class and calls its train method, computing the counts for the training corpus. The test data is then passed one
     sentence at a time to the BigramModel's predict_sentence method to compute the probability for the given sentence.
-    :return:
+    If a saved model file is given it is loaded instead of training, and the trained model can be saved for later runs.
+    The training data can also be counted across several processes.
+    :param train_file: The training corpus, one sentence per line
+    :param test_file: The test sentences, one sentence per line
+    :param model_file: A model saved by BigramModel.save to load instead of training
+    :param save_file: The file to save the trained model to
+    :param jobs: The number of processes to train with
     """
-    # Read in the data and create a list with each training sentence as an element
-    with open(train_file) as train:
-        train_data = train.read().split("\n")
+    if model_file:
+        # Load the counts from the saved model, the count arrays are memory mapped rather than read in.
+        with profiler.stage("bigram.load"):
+            model = BigramModel.load(model_file)
+    elif jobs > 1:
+        # Count the training data in shards across a pool of processes, merging the counts from each shard.
+        model = train_parallel(train_file, jobs)
+    else:
+        # Initialize the BigramModel class which tracks the counts of words and bigrams
+        model = BigramModel()
 
-    # Initialize the BigramModel class which tracks the counts of words and bigrams
-    model = BigramModel()
+        # Pass the train data to the model to fill the count arrays, reading the file one sentence at a time
+        model.train(read_sentences(train_file))
 
-    # Pass the train data to the model to fill the counts dictionary
-    model.train(train_data)
+    if save_file:
+        with profiler.stage("bigram.save"):
+            model.save(save_file)
 
     # Read in the test data and split it the same way as the train data, on newlines
     with open(test_file) as test:
         test_data = test.read().split("\n")
 
     # For each test sentence, compute and print the probability to stdout
-    for sentence in test_data:
-        print(f"The probability for {sentence} is {model.predict_sentence(sentence)}")
+    with profiler.stage("bigram.predict") as stage:
+        for sentence in test_data:
+
+            # There is no smoothing, so a sentence with a bigram that is not in the training data has a probability
+            # of 0.
+            try:
+                probability = model.predict_sentence(sentence)
+            except KeyError:
+                probability = 0.0
+
+            print(f"The probability for {sentence} is {probability}")
+
+        stage.add(sentences=len(test_data))
 
 
 class BigramModel:
     """
     The BigramModel class stores the counts for a given corpus of text. These can then be used to compute the
-    probability of a new sentence.
+    probability of a new sentence. Each word is given an integer id, the unigram counts are stored in an array indexed
+    by the id and the bigram counts in a sorted array of bigram keys, where each key packs the ids of the two words into
+    one integer.
     """
 
     def __init__(self):
-        # Dictionary for storing the counts of both uni and bigrams
-        self.counts = {}
+        # Dictionary mapping each word to its id, and the list of words in the order of their ids
+        self.vocab = {}
+        self.words = []
+
+        # The count of each word, indexed by the word id
+        self.unigram_counts = np.zeros(0, dtype=np.int64)
+
+        # The sorted keys of the bigrams and the count for each key
+        self.bigram_keys = np.zeros(0, dtype=np.int64)
+        self.bigram_counts = np.zeros(0, dtype=np.int64)
+
+    def encode(self, words):
+        """
+        This function converts a list of words to their ids, if a word is not already in the vocabulary it is added.
+        :param words: The words to convert
+        :return: Array of word ids
+        """
+        vocab = self.vocab
+
+        # Add the new words in the order they first occur, the id of a new word is the size of the vocabulary before it
+        # is added. Each distinct word only needs to be checked once.
+        for word in dict.fromkeys(words):
+            if word not in vocab:
+                vocab[word] = len(vocab)
+                self.words.append(word)
+
+        return np.fromiter(map(vocab.__getitem__, words), dtype=np.int64, count=len(words))
+
+    def lookup(self, words):
+        """
+        This function converts a list of words to their ids without adding to the vocabulary. Words not in the
+        vocabulary are given the id -1.
+        :param words: The words to convert
+        :return: list of word ids
+        """
+        get = self.vocab.get
+        return [get(word, -1) for word in words]
+
+    def train(self, corpus, batch_size=100000):
+        """
+        This function fills the count arrays using the given corpus. The corpus is counted in batches of sentences so
+        that only one batch is held in memory as ids at a time.
+        :param corpus: The text to be added to the counts, an iterable of sentences
+        :param batch_size: The number of sentences to count at a time
+        """
+        corpus = iter(corpus)
+        batches = iter(lambda: list(islice(corpus, batch_size)), [])
+
+        # For each batch of sentences in the corpus, the time spent reading the batches is measured on its own.
+        with profiler.stage("bigram.train"):
+            for batch in profiler.iterate("bigram.read", batches, "batches"):
+                self.update(batch)
+
+    def update(self, sentences):
+        """
+        This function adds the counts of the words and bigrams in a batch of sentences.
+        :param sentences: List of sentences
+        """
+        words = []
+        lengths = []
+
+        # Split each sentence into individual words, keeping track of the number of words in each sentence.
+        for sentence in sentences:
+            split = sentence.split()
+            words += split
+            lengths.append(len(split))
+
+        self.update_words(words, lengths)
+
+    def update_words(self, words, lengths):
+        """
+        This function adds the counts of the words and bigrams in a batch of sentences that have already been split into
+        words, such as the batches of the streaming pipeline in pipeline.py.
+        :param words: List of the words of all the sentences, one sentence after another
+        :param lengths: List of the number of words in each sentence
+        """
+        # There is nothing to count if the sentences are all empty.
+        if not words:
+            return
+
+        with profiler.stage("bigram.count") as stage:
+            self.count_ids(self.encode(words), np.repeat(np.arange(len(lengths)), lengths))
+            stage.add(sentences=len(lengths), tokens=len(words))
+
+    def count_ids(self, ids, sentence_of):
+        """
+        This function adds the counts of the words and bigrams in a batch of sentences that have been converted to ids.
+        :param ids: Array of the ids of the words of all the sentences
+        :param sentence_of: Array of the index of the sentence each word is in
+        """
+        # Count the occurrence of each word
+        counts = np.bincount(ids, minlength=len(self.words))
+        counts[:len(self.unigram_counts)] += self.unigram_counts
+        self.unigram_counts = counts
+
+        # Count the occurrence of each bigram, each word is paired with the next word if it is in the same sentence.
+        is_bigram = sentence_of[:-1] == sentence_of[1:]
+        keys = pack(ids[:-1], ids[1:])[is_bigram]
+
+        keys, counts = np.unique(keys, return_counts=True)
+        self.add_bigrams(keys, counts)
+
+    def add_bigrams(self, keys, counts):
+        """
+        This function adds counts for bigram keys to the bigram count arrays.
+        :param keys: Array of bigram keys
+        :param counts: Array of the count for each key
+        """
+        self.bigram_keys, self.bigram_counts = merge_counts(
+            np.concatenate([self.bigram_keys, keys]),
+            np.concatenate([self.bigram_counts, counts])
+        )
+
+    def merge(self, other):
+        """
+        This function adds the counts of another model to this model, as if this model had also been trained on the
+        corpus of the other model. The words of the other model are added to the vocabulary in the order of their ids,
+        so merging models trained on consecutive parts of a corpus gives the same model as training on the whole corpus.
+        :param other: The BigramModel to add the counts of
+        :return: This model
+        """
+        # Find the id in this model of each word of the other model, adding any new words.
+        ids = self.encode(other.words)
+
+        # Add the unigram counts at the ids of the words in this model.
+        counts = np.zeros(len(self.words), dtype=np.int64)
+        counts[:len(self.unigram_counts)] = self.unigram_counts
+        counts[ids] += other.unigram_counts
+        self.unigram_counts = counts
 
-    def increment_dict(self, word):
+        # Convert the bigram keys to the ids of this model and add the counts.
+        first, second = unpack(other.bigram_keys)
+        self.add_bigrams(pack(ids[first], ids[second]), other.bigram_counts)
+
+        return self
+
+    def bigram_count(self, keys):
         """
-        This function increments the counts dictionary for the given word/bigram, if a word/bigram is not already
-        in the dictionary it is added.
-        :param word: The word whose count we would like to increase
+        This function looks up the counts of bigram keys, bigrams not in the training corpus have a count of 0.
+        :param keys: Array of bigram keys
+        :return: Array of counts
         """
+        # Each distinct key is looked up once, in sorted order as searching for sorted keys is much faster.
+        keys, inverse = np.unique(np.asarray(keys, dtype=np.int64), return_inverse=True)
+        counts = np.zeros(keys.shape, dtype=np.int64)
 
-        # Check if the word is in the dictionary keys
-        if word in self.counts.keys():
+        # Find where each key would be in the sorted keys, and check if it is there.
+        index = np.searchsorted(self.bigram_keys, keys)
+        found = index < len(self.bigram_keys)
+        found[found] = self.bigram_keys[index[found]] == keys[found]
 
-            # If it is we increase the count
-            self.counts[word] += 1
-        else:
+        counts[found] = self.bigram_counts[index[found]]
+        return counts[inverse.reshape(-1)]
 
-            # If it isn't, we add it to the dictionary.
-            self.counts[word] = 1
+    def save(self, path):
+        """
+        This function saves the model to a binary file that can be loaded with BigramModel.load. The file has a header
+        with the sizes of the tables, then the unigram counts, the bigram keys and bigram counts as 64-bit integers and
+        lastly the vocabulary as UTF-8 text with a word on each line, in the order of the word ids.
+        :param path: The file to save the model to
+        """
+        vocabulary = "\n".join(self.words).encode("utf-8")
 
-    def train(self, corpus):
+        with open(path, "wb") as f:
+            f.write(struct.pack(HEADER, MAGIC, len(self.words), len(self.bigram_keys), len(vocabulary)))
+            f.write(self.unigram_counts.astype("<i8").tobytes())
+            f.write(self.bigram_keys.astype("<i8").tobytes())
+            f.write(self.bigram_counts.astype("<i8").tobytes())
+            f.write(vocabulary)
+
+    @classmethod
+    def load(cls, path, mmap=True):
         """
-        This function fills the counts dictionary using the given corpus.
-        :param corpus: The text to be added to the counts dictionary
+        This function loads a model saved by BigramModel.save. When memory mapped the count arrays are read from the
+        file as they are used rather than copied into memory, so loading is fast and processes that load the same file
+        share its pages through the page cache. Memory mapped arrays are read only, training the model further creates
+        new arrays.
+        :param path: The file to load the model from
+        :param mmap: Whether to memory map the count arrays or read them into memory
+        :return: The loaded BigramModel
         """
-        # For each sentence in the corpus
-        for sentence in corpus:
+        data = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+
+        # Read the header, checking that this is a model file.
+        magic, vocab_size, bigram_size, vocabulary_size = struct.unpack_from(HEADER, data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a saved BigramModel")
 
-            # Split the sentence into individual words
-            words = sentence.split()
+        # The arrays follow the header one after another, we take a view of each part of the file.
+        model = cls()
+        offset = struct.calcsize(HEADER)
+        arrays = []
+        for size in (vocab_size, bigram_size, bigram_size):
+            arrays.append(data[offset:offset + 8 * size].view("<i8"))
+            offset += 8 * size
+        model.unigram_counts, model.bigram_keys, model.bigram_counts = arrays
 
-            # Count the occurrence of each word
-            for word in words:
-                self.increment_dict(word)
+        # The vocabulary is rebuilt from the list of words, the id of each word is its position in the list.
+        if vocab_size:
+            model.words = bytes(data[offset:offset + vocabulary_size]).decode("utf-8").split("\n")
+            model.vocab = dict(zip(model.words, range(vocab_size)))
 
-            # Count the occurrence of each bigram, moving a sliding window along one place each time.
-            for i in range(len(words) - 1):
-                self.increment_dict(" ".join(words[i:i + 2]))
+        return model
 
     def predict_sentence(self, sentence):
         """
@@ -84,15 +293,24 @@ class BigramModel:
         # List to store the probabilities of all bigrams in the sentence
         probabilities = []
 
-        # Split the sentence into the constituent words
+        # Split the sentence into the constituent words, and look up their ids
         words = sentence.split()
+        ids = self.lookup(words)
+
+        # Look up the count of every bigram in the sentence at once
+        bigram_counts = self.bigram_count(pack(np.array(ids[:-1], dtype=np.int64), np.array(ids[1:], dtype=np.int64)))
 
         # For every bigram (we include the start and end tag of the sentence as this is additional information)
         # If we wished to drop this we could remove it from the training data and test data and treat the first word as
         # just P(w1)
         for i in range(len(words) - 1):
-            count_of_bigram = self.counts[" ".join(words[i:i + 2])]
-            count_of_prior = self.counts[words[i]]
+            count_of_bigram = int(bigram_counts[i])
+
+            # Only bigrams that appear in the training data can be given a probability as there is no smoothing.
+            if not count_of_bigram:
+                raise KeyError(" ".join(words[i:i + 2]))
+
+            count_of_prior = int(self.unigram_counts[ids[i]])
 
             # Add the probability of this bigram to the list we have
             probabilities.append(count_of_bigram / count_of_prior)
@@ -105,8 +323,8 @@ class BigramModel:
 
         # for i in range(len(words) - 1):
         #
-        #     count_of_bigram = self.counts[" ".join(words[i:i + 2])]
-        #     count_of_prior = self.counts[words[i]]
+        #     count_of_bigram = int(bigram_counts[i])
+        #     count_of_prior = int(self.unigram_counts[ids[i]])
         #
         #     # Add the probability of this bigram to the list we have
         #     probabilities.append(math.log(count_of_bigram / count_of_prior))
@@ -116,14 +334,239 @@ class BigramModel:
 
         return probability
 
+    def score_batch(self, sentences, smoothing="add-k", k=1.0, backoff=0.4):
+        """
+        This function computes the log probability and perplexity of a batch of sentences at once. The bigrams of all the
+        sentences are looked up together and the log probabilities are summed for each sentence, so long sentences do
+        not underflow to 0 as the product of the probabilities does.
+        Bigrams that are not in the training corpus are handled by the smoothing:
+            None: The bigram has a probability of 0, giving a log probability of -inf.
+            "add-k": k is added to every bigram count, P(w2|w1) = (C(w1, w2) + k) / (C(w1) + kV).
+            "backoff": Unseen bigrams back off to the add-k unigram probability of w2 times the backoff factor.
+        :param sentences: List of sentences to score
+        :param smoothing: The smoothing for unseen bigrams, one of None, "add-k" or "backoff"
+        :param k: The count added to each bigram for add-k, or to each word for the backoff unigram probability
+        :param backoff: The factor the unigram probability is multiplied by when backing off
+        :return: Arrays of the log probability and the perplexity of each sentence
+        """
+        words = []
+        lengths = []
+
+        # Split each sentence into individual words, keeping track of the number of words in each sentence.
+        for sentence in sentences:
+            split = sentence.split()
+            words += split
+            lengths.append(len(split))
+
+        log_probability, _ = self.score_words(words, lengths, smoothing, k, backoff)
+        lengths = np.array(lengths, dtype=np.int64)
+
+        # The perplexity is the inverse probability normalised by the number of bigrams in the sentence.
+        with np.errstate(over="ignore"):
+            perplexity = np.exp(-log_probability / np.maximum(lengths - 1, 1))
+
+        return log_probability, perplexity
+
+    def score_words(self, words, lengths, smoothing="add-k", k=1.0, backoff=0.4):
+        """
+        This function computes the log probability of each of a batch of sentences that have already been split into
+        words, see score_batch.
+        :param words: List of the words of all the sentences, one sentence after another
+        :param lengths: List of the number of words in each sentence
+        :param smoothing: The smoothing for unseen bigrams, one of None, "add-k" or "backoff"
+        :param k: The count added to each bigram for add-k, or to each word for the backoff unigram probability
+        :param backoff: The factor the unigram probability is multiplied by when backing off
+        :return: Array of the log probability of each sentence, and array of the id of each word, -1 for words not in
+        the vocabulary
+        """
+        if smoothing not in (None, "add-k", "backoff"):
+            raise ValueError(f"Unknown smoothing {smoothing}, expected None, 'add-k' or 'backoff'")
+
+        # Look up the word ids, words not in the vocabulary have the id -1.
+        ids = np.fromiter(map(self.vocab.get, words, repeat(-1, len(words))), dtype=np.int64, count=len(words))
+        lengths = np.array(lengths, dtype=np.int64)
+
+        # Each word is paired with the next word unless it ends the sentence, and we keep the sentence of each bigram.
+        is_bigram = np.ones(len(ids), dtype=bool)
+        is_bigram[np.cumsum(lengths)[lengths > 0] - 1] = False
+        is_bigram = is_bigram[:-1]
+        sentence_of = np.repeat(np.arange(len(lengths)), lengths)[:-1][is_bigram]
+        first = ids[:-1][is_bigram]
+        second = ids[1:][is_bigram]
+
+        # Look up the counts of the bigrams and the first words, unknown words have a count of 0. Only the known ids are
+        # used as indexes, so a model with no words gives every sentence the score of unknown words.
+        known = (first >= 0) & (second >= 0)
+        count_of_bigram = np.zeros(len(first), dtype=np.int64)
+        count_of_bigram[known] = self.bigram_count(pack(first[known], second[known]))
+        count_of_prior = np.zeros(len(first), dtype=np.int64)
+        count_of_prior[first >= 0] = self.unigram_counts[first[first >= 0]]
+
+        # The vocabulary size includes one more for words that are not in the vocabulary.
+        vocab_size = len(self.words) + 1
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if smoothing == "add-k":
+                log_probabilities = np.log((count_of_bigram + k) / (count_of_prior + k * vocab_size))
+            else:
+                log_probabilities = np.log(count_of_bigram / count_of_prior)
+
+                # Bigrams that have not been seen have a probability of 0, even if the first word has not been seen.
+                unseen = count_of_bigram == 0
+                log_probabilities[unseen] = -np.inf
+
+                if smoothing == "backoff":
+                    count_of_word = np.zeros(len(second), dtype=np.int64)
+                    count_of_word[second >= 0] = self.unigram_counts[second[second >= 0]]
+                    count_of_word = count_of_word[unseen]
+                    log_probabilities[unseen] = np.log(backoff * (count_of_word + k) /
+                                                       (self.unigram_counts.sum() + k * vocab_size))
+
+        # Sum the log probabilities of the bigrams in each sentence.
+        log_probability = np.bincount(sentence_of, weights=log_probabilities, minlength=len(lengths))
+
+        return log_probability, ids
+
+
+def pack(first, second):
+    """
+    This function packs the ids of the two words of each bigram into one integer key, the first word in the upper 32
+    bits and the second in the lower 32 bits. Sorting the keys sorts the bigrams by the first word then the second.
+    :param first: Array of the ids of the first words
+    :param second: Array of the ids of the second words
+    :return: Array of bigram keys
+    """
+    return (first << 32) | second
+
+
+def unpack(keys):
+    """
+    This function splits bigram keys back into the ids of the two words.
+    :param keys: Array of bigram keys
+    :return: Arrays of the ids of the first and second words
+    """
+    return keys >> 32, keys & 0xFFFFFFFF
+
+
+def merge_counts(keys, counts):
+    """
+    This function combines the counts of repeated keys, returning the keys sorted with one count for each key.
+    :param keys: Array of keys, which may be repeated
+    :param counts: Array of the count for each key
+    :return: Arrays of the sorted unique keys and their counts
+    """
+    if not len(keys):
+        return keys, counts
+
+    # A stable sort is used as it merges runs of keys that are already sorted in linear time.
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    counts = counts[order]
+
+    # The position where each key first appears, the counts from there to the next key are summed.
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+def train_parallel(path, jobs=None, shard_size=None):
+    """
+    This function trains a BigramModel on a file using a pool of processes. The file is split into shards of whole lines,
+    each process counts the sentences in a shard and the models for the shards are merged in order. This gives the same
+    model as training on the whole file in one process.
+    :param path: The training corpus, one sentence per line
+    :param jobs: The number of processes to use, defaults to the number of cores
+    :param shard_size: The size in bytes of the shards, defaults to a quarter of the file size divided by the jobs
+    :return: The trained BigramModel
+    """
+    jobs = jobs or os.cpu_count()
+    size = os.path.getsize(path)
+
+    # Use a few shards per process so that the processes are kept busy if some shards are slower than others.
+    shard_size = shard_size or max(size // (4 * jobs), 1 << 20)
+    shards = [(path, start, end) for start, end in find_line_shards(path, shard_size)]
+
+    model = BigramModel()
+    with multiprocessing.Pool(jobs) as pool:
+
+        # Merge the models in the order of the shards so the vocabulary is in the same order as training in one process.
+        # The stages run in the processes are not measured, the time waiting for them is part of the read stage.
+        for shard_model in profiler.iterate("bigram.read", pool.imap(train_shard, shards), "shards"):
+            with profiler.stage("bigram.merge") as stage:
+                model.merge(shard_model)
+                stage.add(bigrams=len(shard_model.bigram_keys))
+
+    return model
+
+
+def train_shard(shard):
+    """
+    This function trains a BigramModel on a shard of a file. It is run in the worker processes by train_parallel.
+    :param shard: The filename and the start and end byte offsets of the shard
+    :return: The BigramModel for the shard
+    """
+    model = BigramModel()
+    model.train(read_sentences(*shard))
+    return model
+
+
+def find_line_shards(path, shard_size, start=0):
+    """
+    This function finds the byte offsets that split a file into shards of roughly the shard size, each shard ending at
+    the end of a line.
+    :param path: The file to split into shards
+    :param shard_size: The size in bytes of the shards
+    :param start: The byte offset to start the first shard at, this should be the start of a line
+    :return: List of the start and end byte offsets of each shard
+    """
+    size = os.path.getsize(path)
+    offsets = [start]
+
+    with open(path, "rb") as f:
+        while offsets[-1] + shard_size < size:
+
+            # Move to the end of the line the shard size falls in.
+            f.seek(offsets[-1] + shard_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            offsets.append(f.tell())
+
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def read_sentences(path, start=0, end=None):
+    """
+    This generator reads the sentences from a file with a sentence on each line, one line at a time. Newlines are read
+    the same as reading the file in text mode, so the sentences are the same as splitting the whole file on newlines.
+    :param path: The file to read
+    :param start: The byte offset to start reading from, this should be the start of a line
+    :param end: The byte offset to stop reading at, this should be the end of a line
+    :return: generator of sentences
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+
+            # Carriage returns also end a line when reading in text mode.
+            yield from line.decode("utf-8").rstrip("\r\n").replace("\r\n", "\n").replace("\r", "\n").split("\n")
+
 
 if __name__ == "__main__":
     # Run the script. Reads in training data, trains the model (gets counts). Reads the test data and computes the probs
-    train_file = "training.txt"
-    test_file = "test.txt"
-
-    if len(sys.argv) > 1:
-        train_file = sys.argv[1]
-        test_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Compute the probability of each test sentence with a bigram model.")
+    parser.add_argument("train_file", nargs="?", default="training.txt", help="Training corpus, one sentence per line")
+    parser.add_argument("test_file", nargs="?", default="test.txt", help="Test sentences, one sentence per line")
+    parser.add_argument("--model", help="Load a model saved with --save instead of training")
+    parser.add_argument("--save", help="Save the trained model to this file")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes to train with")
+    parser.add_argument("--profile", help="Write the time, items and memory of each stage to this JSON file, or run "
+                                          "cProfile and write its statistics if it ends in .prof")
+    args = parser.parse_args()
 
-    run(train_file, test_file)
+    with profiler.session(args.profile):
+        run(args.train_file, args.test_file, args.model, args.save, args.jobs)
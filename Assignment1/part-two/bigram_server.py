@@ -0,0 +1,269 @@
+import argparse
+import collections
+import io
+import json
+import os
+import queue
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from bigram import BigramModel, read_sentences
+
+
+# This script keeps a BigramModel loaded in a long running process and scores batches of sentences sent to it, either
+# over a Unix socket or through stdin and stdout. This saves starting Python and loading or training the model for every
+# scoring job.
+#
+# The protocol is the same for both: a request is a batch of sentences, one per line, ended by an empty line. The reply
+# is the log probability of each sentence, one per line in the same order, ended by an empty line. An empty request (an
+# empty line on its own) is replied to with a line of JSON with the requests per second and latency of the server.
+
+
+def main(args):
+    """
+    This function loads or trains the model and serves requests until the input ends or the process is stopped.
+    """
+    if args.model:
+        model = BigramModel.load(args.model)
+    else:
+        model = BigramModel()
+        model.train(read_sentences(args.train))
+
+    scorer = BatchScorer(model, args.smoothing)
+    scorer.start()
+
+    # Stop in the same way when terminated as when interrupted, so the socket is removed and the statistics reported.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        if args.socket:
+            serve_socket(scorer, args.socket)
+        else:
+            serve_pipe(scorer, sys.stdin, sys.stdout)
+    finally:
+        # Report the statistics for the whole run when the server stops.
+        print(json.dumps(scorer.stats()), file=sys.stderr)
+
+
+class BatchScorer:
+    """
+    The BatchScorer scores the requests for a BigramModel in a single thread. Requests that arrive while a batch is
+    being scored are queued and then scored together in one call to score_batch, so many small requests arriving at once
+    are scored as efficiently as one large request.
+    """
+
+    def __init__(self, model: BigramModel, smoothing: str = "add-k", max_batch: int = 100000):
+        """
+        :param model: The model to score the sentences with
+        :param smoothing: The smoothing passed to BigramModel.score_batch
+        :param max_batch: The most sentences to score in one batch
+        """
+        self.model = model
+        self.smoothing = smoothing
+        self.max_batch = max_batch
+
+        # Queue of requests waiting to be scored, each a list of sentences, a future for the result and the start time.
+        self.requests = queue.Queue()
+
+        # The number of requests and sentences scored, and the latency of the most recent requests in seconds.
+        self.request_count = 0
+        self.sentence_count = 0
+        self.latencies = collections.deque(maxlen=100000)
+        self.started = time.perf_counter()
+
+    def start(self):
+        """
+        This function starts the thread that scores the queued requests.
+        """
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, sentences):
+        """
+        This function queues a batch of sentences to be scored.
+        :param sentences: List of sentences
+        :return: Future for the list of log probabilities of the sentences
+        """
+        future = Future()
+        self.requests.put((sentences, future, time.perf_counter()))
+        return future
+
+    def run(self):
+        """
+        This function scores the queued requests until the process ends. It waits for a request and then takes all the
+        other requests that are waiting, up to the maximum batch size, and scores them together.
+        """
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0][0])
+
+            while size < self.max_batch:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+                size += len(batch[-1][0])
+
+            # Score all the sentences in the batch at once.
+            sentences = [sentence for request in batch for sentence in request[0]]
+            try:
+                log_probabilities, _ = self.model.score_batch(sentences, smoothing=self.smoothing)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            # Give each request its part of the results.
+            finished = time.perf_counter()
+            offset = 0
+            for request, future, arrived in batch:
+                future.set_result(log_probabilities[offset:offset + len(request)].tolist())
+                offset += len(request)
+                self.latencies.append(finished - arrived)
+
+            self.request_count += len(batch)
+            self.sentence_count += len(sentences)
+
+    def stats(self):
+        """
+        This function computes the throughput and latency of the server since it started.
+        :return: Dictionary of the statistics
+        """
+        elapsed = time.perf_counter() - self.started
+        latencies = np.array(self.latencies) * 1000
+
+        return {
+            "requests": self.request_count,
+            "sentences": self.sentence_count,
+            "requests_per_second": self.request_count / elapsed,
+            "sentences_per_second": self.sentence_count / elapsed,
+            "p50_latency_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_latency_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+
+def read_requests(lines):
+    """
+    This generator groups lines into requests, each request is the lines up to an empty line.
+    :param lines: Iterable of lines
+    :return: generator of lists of sentences
+    """
+    request = []
+
+    for line in lines:
+        line = line.rstrip("\n")
+
+        if line:
+            request.append(line)
+        else:
+            yield request
+            request = []
+
+    # A request that is not ended by an empty line is still scored.
+    if request:
+        yield request
+
+
+def write_reply(output, scorer, result):
+    """
+    This function writes the reply for a request, the log probabilities one per line or the statistics for an empty
+    request, followed by an empty line.
+    :param output: The file to write to
+    :param scorer: The BatchScorer, for the statistics
+    :param result: The list of log probabilities for the request, or None for an empty request
+    """
+    if result is None:
+        output.write(json.dumps(scorer.stats()) + "\n\n")
+    else:
+        output.write("".join(f"{log_probability}\n" for log_probability in result) + "\n")
+    output.flush()
+
+
+def serve_pipe(scorer, input, output):
+    """
+    This function serves requests read from an input stream and writes the replies to an output stream in order. The
+    requests are read and submitted in one thread while the replies are written in another, so requests that are sent
+    together are scored together.
+    :param scorer: The BatchScorer to score the requests
+    :param input: The stream to read requests from
+    :param output: The stream to write replies to
+    """
+    # Queue of the futures for the submitted requests, in the order they were read, followed by False when the input
+    # ends. If reading fails the exception is put on the queue before False, so it is raised here rather than the
+    # replies waiting forever.
+    pending = queue.Queue(maxsize=1000)
+
+    def read():
+        try:
+            for request in read_requests(input):
+                pending.put(scorer.submit(request) if request else None)
+        except Exception as e:
+            pending.put(e)
+        finally:
+            pending.put(False)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    while (future := pending.get()) is not False:
+        if isinstance(future, Exception):
+            raise future
+        write_reply(output, scorer, future.result() if future else None)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    The RequestHandler serves the requests sent over one connection to the Unix socket, replying to each in turn.
+    """
+
+    def handle(self):
+        input = io.TextIOWrapper(self.rfile, encoding="utf-8")
+        output = io.TextIOWrapper(self.wfile, encoding="utf-8")
+
+        for request in read_requests(input):
+            result = self.server.scorer.submit(request).result() if request else None
+            write_reply(output, self.server.scorer, result)
+
+
+def serve_socket(scorer, path):
+    """
+    This function serves requests over a Unix socket until the process is stopped. Each connection is handled in its own
+    thread, and requests from all the connections are scored together by the scorer.
+    :param scorer: The BatchScorer to score the requests
+    :param path: The path of the Unix socket
+    """
+    # Remove the socket left behind by a previous run, but nothing else, in case the path was given by mistake.
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise FileExistsError(f"{path} already exists and is not a socket")
+        os.remove(path)
+
+    with socketserver.ThreadingUnixStreamServer(path, RequestHandler) as server:
+        server.daemon_threads = True
+        server.scorer = scorer
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve log probabilities of sentences from a BigramModel.")
+    parser.add_argument("--model", help="Model saved with bigram.py --save, loaded instead of training")
+    parser.add_argument("--train", default="training.txt", help="Training corpus to train the model on")
+    parser.add_argument("--socket", help="Path of a Unix socket to listen on, otherwise stdin and stdout are used")
+    parser.add_argument("--smoothing", default="add-k", choices=["add-k", "backoff", "none"],
+                        help="Smoothing for bigrams not in the training corpus")
+    args = parser.parse_args()
+
+    if args.smoothing == "none":
+        args.smoothing = None
+
+    main(args)
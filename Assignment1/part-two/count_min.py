@@ -0,0 +1,402 @@
+import argparse
+import math
+import struct
+import sys
+
+import numpy as np
+
+from bigram import BigramModel, read_sentences, unpack
+
+# The start of a saved model file, and the format of the header. The header holds the number of words, the width and
+# depth of the sketch, the number of top k bigrams kept and k, whether the updates are conservative, the total of the
+# counts in the sketch and the size of the vocabulary text in bytes.
+MAGIC = b"APPROX01"
+HEADER = "<8sQQQQQQQQ"
+
+
+class CountMinSketch:
+    """
+    The CountMinSketch class counts keys approximately in a fixed amount of memory. Each key is hashed to one counter in
+    each row of a table and the estimate of its count is the smallest of its counters. The estimate is never less than
+    the true count, and with probability 1 - delta it is more by at most epsilon times the total of all the counts,
+    where epsilon = e / width and delta = e^-depth.
+    """
+
+    def __init__(self, width: int, depth: int, conservative: bool = True, seed: int = 0):
+        """
+        :param width: The number of counters in each row
+        :param depth: The number of rows, each with its own hash function
+        :param conservative: Whether to only increase the counters that are needed, which gives smaller errors
+        :param seed: The seed for the hash functions
+        """
+        self.width = width
+        self.depth = depth
+        self.conservative = conservative
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+        # The multiplier and increment of the hash function of each row, the multipliers are odd.
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.increments = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64)
+
+    @classmethod
+    def from_budget(cls, memory_budget: int, delta: float = 0.01, conservative: bool = True):
+        """
+        This function creates a sketch that fits in a memory budget. The depth is set by the probability of the error
+        bound failing, and the rest of the budget is used for the width.
+        :param memory_budget: The size of the table in bytes
+        :param delta: The probability that an estimate is more than the error bound
+        :param conservative: Whether to use conservative updates
+        :return: The CountMinSketch
+        """
+        depth = max(math.ceil(math.log(1 / delta)), 1)
+        width = max(memory_budget // (8 * depth), 1)
+        return cls(width, depth, conservative)
+
+    def hash(self, keys):
+        """
+        This function hashes keys to a column of each row of the table.
+        :param keys: Array of integer keys
+        :return: 2D array of the column for each row and key
+        """
+        keys = np.asarray(keys, dtype=np.int64).view(np.uint64)
+
+        # Multiply-shift hashing, the multiplication overflows on purpose and the high bits are used.
+        hashed = keys[None, :] * self.multipliers[:, None] + self.increments[:, None]
+        return ((hashed >> np.uint64(32)) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, keys, counts):
+        """
+        This function adds counts for keys to the sketch. The keys should be unique.
+        :param keys: Array of keys
+        :param counts: Array of the count for each key
+        """
+        columns = self.hash(keys)
+        self.total += int(counts.sum())
+
+        # A table memory mapped from a saved model is read only, it is copied the first time it is added to.
+        if not self.table.flags.writeable:
+            self.table = np.array(self.table)
+
+        if self.conservative:
+            # Only raise each counter as far as the new estimate of the key needs it to be.
+            targets = self.table[np.arange(self.depth)[:, None], columns].min(axis=0) + counts
+            for row in range(self.depth):
+                np.maximum.at(self.table[row], columns[row], targets)
+        else:
+            for row in range(self.depth):
+                np.add.at(self.table[row], columns[row], counts)
+
+    def query(self, keys):
+        """
+        This function estimates the counts of keys.
+        :param keys: Array of keys
+        :return: Array of the estimated counts
+        """
+        columns = self.hash(keys)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def error_bound(self):
+        """
+        This function computes the error bound of the estimates.
+        :return: Dictionary of epsilon, delta and the bound on the error of an estimate, epsilon times the total
+        """
+        epsilon = math.e / self.width
+        return {"epsilon": epsilon, "delta": math.exp(-self.depth), "error": epsilon * self.total}
+
+
+class ApproxBigramModel(BigramModel):
+    """
+    The ApproxBigramModel class is a BigramModel that counts the bigrams in a CountMinSketch, so the memory used for the
+    bigrams is fixed however large the corpus is. The unigrams are counted exactly, and the top k bigrams with the
+    largest counts are also kept exactly from the point they become one of the top k. The estimate of a bigram is never
+    more than the count of either of its words.
+    """
+
+    def __init__(self, memory_budget: int = 64 << 20, top_k: int = 10000, delta: float = 0.01,
+                 conservative: bool = True):
+        """
+        :param memory_budget: The size in bytes of the sketch
+        :param top_k: The number of bigrams with the largest counts to keep exactly
+        :param delta: The probability that an estimate is more than the error bound
+        :param conservative: Whether to use conservative updates in the sketch
+        """
+        super().__init__()
+        self.sketch = CountMinSketch.from_budget(memory_budget, delta, conservative)
+        self.top_k = top_k
+
+        # The sorted keys and counts of the top k bigrams
+        self.heavy_keys = np.zeros(0, dtype=np.int64)
+        self.heavy_counts = np.zeros(0, dtype=np.int64)
+
+    def add_bigrams(self, keys, counts):
+        """
+        This function adds counts for bigram keys to the sketch and the top k bigrams. Bigrams that are already in the
+        top k have their exact counts increased, the others are estimated from the sketch and join the top k if their
+        estimate is larger than the smallest count in it.
+        :param keys: Array of unique bigram keys
+        :param counts: Array of the count for each key
+        """
+        self.sketch.add(keys, counts)
+
+        # The counts of a loaded model may be memory mapped and read only, they are copied the first time they change.
+        if not self.heavy_counts.flags.writeable:
+            self.heavy_counts = np.array(self.heavy_counts)
+
+        # Increase the counts of the bigrams that are in the top k.
+        index = np.searchsorted(self.heavy_keys, keys)
+        is_heavy = index < len(self.heavy_keys)
+        is_heavy[is_heavy] = self.heavy_keys[index[is_heavy]] == keys[is_heavy]
+        self.heavy_counts[index[is_heavy]] += counts[is_heavy]
+
+        # Keep the k largest of the top k and the other bigrams in this batch.
+        keys = np.concatenate([self.heavy_keys, keys[~is_heavy]])
+        counts = np.concatenate([self.heavy_counts, self.sketch.query(keys[len(self.heavy_keys):])])
+        if len(keys) > self.top_k:
+            largest = np.argpartition(counts, -self.top_k)[-self.top_k:]
+            keys, counts = keys[largest], counts[largest]
+
+        order = np.argsort(keys)
+        self.heavy_keys, self.heavy_counts = keys[order], counts[order]
+
+    def bigram_count(self, keys):
+        """
+        This function estimates the counts of bigram keys, using the exact count for the top k bigrams.
+        :param keys: Array of bigram keys
+        :return: Array of counts
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        counts = self.sketch.query(keys)
+
+        # A bigram cannot occur more often than either of its words. Keys packed from a word not in the vocabulary, id
+        # -1, unpack to a negative first id or a second id past the vocabulary, and have a count of 0 as in BigramModel.
+        first, second = unpack(keys)
+        vocab_size = len(self.unigram_counts)
+        known = (first >= 0) & (first < vocab_size) & (second < vocab_size)
+        word_counts = np.zeros(len(keys), dtype=np.int64)
+        word_counts[known] = np.minimum(self.unigram_counts[first[known]], self.unigram_counts[second[known]])
+        counts = np.minimum(counts, word_counts)
+
+        index = np.searchsorted(self.heavy_keys, keys)
+        is_heavy = index < len(self.heavy_keys)
+        is_heavy[is_heavy] = self.heavy_keys[index[is_heavy]] == keys[is_heavy]
+        counts[is_heavy] = self.heavy_counts[index[is_heavy]]
+
+        return counts
+
+    def merge(self, other):
+        """
+        This function adds the counts of another ApproxBigramModel to this model. The bigrams are only kept in the
+        sketches, so the sketches must have the same size and hash functions, and each word must have the same id in
+        both models, as the bigram keys are hashed from the ids. This is the case for shards that were given the same
+        vocabulary with encode before training, and for any model merged into an empty one. The tables of the sketches
+        are added cell by cell, which with standard updates gives the same table as counting both corpora in one model.
+        The top k bigrams of both models are combined, each counted exactly where it is in the top k of a model and
+        estimated where it is not, and the k largest are kept.
+        :param other: The ApproxBigramModel to add the counts of
+        :return: This model
+        """
+        sketch, other_sketch = self.sketch, other.sketch
+        if ((sketch.width, sketch.depth) != (other_sketch.width, other_sketch.depth)
+                or not np.array_equal(sketch.multipliers, other_sketch.multipliers)
+                or not np.array_equal(sketch.increments, other_sketch.increments)):
+            raise ValueError("Only models whose sketches have the same size and hash functions can be merged")
+
+        # The words the models share must be the same words in the same order, and any more words of the other model
+        # must be new to this one, so they get the same ids here.
+        shared = min(len(self.words), len(other.words))
+        if self.words[:shared] != other.words[:shared] or not self.vocab.keys().isdisjoint(other.words[shared:]):
+            raise ValueError("Only models whose words have the same ids can be merged, as the sketch hashes the ids")
+
+        # The counts of the top k bigrams of both models are found before either sketch changes.
+        keys = np.union1d(self.heavy_keys, other.heavy_keys)
+        counts = self.bigram_count(keys) + other.bigram_count(keys)
+
+        # Add the unigram counts, the new words of the other model are added with the same ids.
+        self.encode(other.words)
+        unigram_counts = np.zeros(len(self.words), dtype=np.int64)
+        unigram_counts[:len(self.unigram_counts)] = self.unigram_counts
+        unigram_counts[:len(other.unigram_counts)] += other.unigram_counts
+        self.unigram_counts = unigram_counts
+
+        sketch.table = sketch.table + other_sketch.table
+        sketch.total += other_sketch.total
+
+        # Keep the k largest of the combined top k bigrams.
+        if len(keys) > self.top_k:
+            largest = np.sort(np.argpartition(counts, -self.top_k)[-self.top_k:])
+            keys, counts = keys[largest], counts[largest]
+        self.heavy_keys, self.heavy_counts = keys, counts
+
+        return self
+
+    def error_bound(self):
+        """
+        This function returns the error bound of the bigram counts that are estimated from the sketch.
+        :return: Dictionary of epsilon, delta and the bound on the error of an estimate
+        """
+        return self.sketch.error_bound()
+
+    def save(self, path):
+        """
+        This function saves the model to a binary file that can be loaded with ApproxBigramModel.load, in the same way
+        as BigramModel.save. The file has a header with the sizes, then the unigram counts, the multipliers and
+        increments of the hash functions, the table of the sketch, and the keys and counts of the top k bigrams as 64-bit integers,
+        and lastly the vocabulary as UTF-8 text with a word on each line, in the order of the word ids.
+        :param path: The file to save the model to
+        """
+        sketch = self.sketch
+        vocabulary = "\n".join(self.words).encode("utf-8")
+
+        with open(path, "wb") as f:
+            f.write(struct.pack(HEADER, MAGIC, len(self.words), sketch.width, sketch.depth, len(self.heavy_keys),
+                                self.top_k, sketch.conservative, sketch.total, len(vocabulary)))
+            f.write(self.unigram_counts.astype("<i8").tobytes())
+            f.write(sketch.multipliers.astype("<u8").tobytes())
+            f.write(sketch.increments.astype("<u8").tobytes())
+            f.write(sketch.table.astype("<i8").tobytes())
+            f.write(self.heavy_keys.astype("<i8").tobytes())
+            f.write(self.heavy_counts.astype("<i8").tobytes())
+            f.write(vocabulary)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        This function loads a model saved by ApproxBigramModel.save. When memory mapped the table of the sketch is read
+        from the file as it is used, and copied the first time the model is trained further.
+        :param path: The file to load the model from
+        :param mmap: Whether to memory map the arrays or read them into memory
+        :return: The loaded ApproxBigramModel
+        """
+        data = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+
+        # Read the header, checking that this is a model file.
+        magic, vocab_size, width, depth, heavy_size, top_k, conservative, total, vocabulary_size = struct.unpack_from(
+            HEADER, data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a saved ApproxBigramModel")
+
+        # The arrays follow the header one after another, we take a view of each part of the file.
+        offset = struct.calcsize(HEADER)
+        arrays = []
+        for size, dtype in ((vocab_size, "<i8"), (depth, "<u8"), (depth, "<u8"), (width * depth, "<i8"),
+                            (heavy_size, "<i8"), (heavy_size, "<i8")):
+            arrays.append(data[offset:offset + 8 * size].view(dtype))
+            offset += 8 * size
+
+        # The model is made with the smallest sketch of the right depth, whose arrays are then replaced.
+        model = cls(8 * depth, top_k, conservative=bool(conservative))
+        sketch = model.sketch
+        sketch.width, sketch.depth, sketch.total = width, depth, total
+        model.unigram_counts, sketch.multipliers, sketch.increments, table = arrays[:4]
+        model.heavy_keys, model.heavy_counts = arrays[4:]
+        sketch.table = table.reshape(depth, width)
+
+        # The vocabulary is rebuilt from the list of words, the id of each word is its position in the list.
+        if vocab_size:
+            model.words = bytes(data[offset:offset + vocabulary_size]).decode("utf-8").split("\n")
+            model.vocab = dict(zip(model.words, range(vocab_size)))
+
+        return model
+
+
+def accuracy_curve(path, budgets, top_k=10000):
+    """
+    This function trains an exact BigramModel and an ApproxBigramModel for each memory budget on a file, and compares
+    the estimated bigram counts with the exact counts for every bigram in the file.
+    :param path: The training corpus, one sentence per line
+    :param budgets: List of memory budgets in bytes
+    :param top_k: The number of bigrams to keep exactly
+    :return: List of dictionaries with the memory used and the errors for each budget
+    """
+    exact = BigramModel()
+    exact.train(read_sentences(path))
+    exact_bytes = exact.bigram_keys.nbytes + exact.bigram_counts.nbytes
+    print(f"Exact: {len(exact.bigram_keys)} bigrams in {exact_bytes / 1e6:.2f}MB")
+
+    results = []
+    for budget in budgets:
+        model = ApproxBigramModel(budget, top_k)
+        model.train(read_sentences(path))
+
+        # The words have the same ids in both models as they were added in the same order.
+        estimates = model.bigram_count(exact.bigram_keys)
+        errors = estimates - exact.bigram_counts
+
+        result = {
+            "memory_bytes": model.sketch.table.nbytes + model.heavy_keys.nbytes + model.heavy_counts.nbytes,
+            "width": model.sketch.width,
+            "depth": model.sketch.depth,
+            "error_bound": model.error_bound()["error"],
+            "mean_absolute_error": float(np.mean(np.abs(errors))),
+            "mean_relative_error": float(np.mean(errors / exact.bigram_counts)),
+            "max_error": int(errors.max()),
+            "exact_fraction": float(np.mean(errors == 0)),
+        }
+        results.append(result)
+        print(f"{result['memory_bytes'] / 1e6:.2f}MB: mean absolute error {result['mean_absolute_error']:.3f}, "
+              f"mean relative error {result['mean_relative_error']:.3f}, max error {result['max_error']}, "
+              f"{result['exact_fraction']:.1%} exact, error bound {result['error_bound']:.1f}")
+
+    return results
+
+
+def check_merge(path, memory_budget, top_k=10000, shards=2):
+    """
+    This function checks that merging ApproxBigramModels trained on shards of a file gives the same counts as training
+    one on the whole file. The models use standard updates, with which the merged sketch is exactly the sketch of the
+    whole file, and the shards are given the vocabulary of the whole file so the words have the same ids in every
+    model. The estimates of the merged model are also checked to never be less than the exact counts.
+    :param path: The training corpus, one sentence per line
+    :param memory_budget: The size in bytes of the sketches
+    :param top_k: The number of bigrams to keep exactly
+    :param shards: The number of shards to split the file into
+    :return: Whether the merged model matches
+    """
+    sentences = list(read_sentences(path))
+    exact = BigramModel()
+    exact.train(sentences)
+
+    whole = ApproxBigramModel(memory_budget, top_k, conservative=False)
+    whole.train(sentences)
+
+    merged = ApproxBigramModel(memory_budget, top_k, conservative=False)
+    size = -(-len(sentences) // shards)
+    for start in range(0, len(sentences), size):
+        shard = ApproxBigramModel(memory_budget, top_k, conservative=False)
+        shard.encode(exact.words)
+        shard.train(sentences[start:start + size])
+        merged.merge(shard)
+
+    estimates = merged.bigram_count(exact.bigram_keys)
+    checks = {
+        "vocabulary": merged.words == whole.words,
+        "unigram counts": np.array_equal(merged.unigram_counts, whole.unigram_counts),
+        "sketch": np.array_equal(merged.sketch.table, whole.sketch.table) and merged.sketch.total == whole.sketch.total,
+        "never too low": bool(np.all(estimates >= exact.bigram_counts)),
+    }
+    for name, passed in checks.items():
+        print(f"{name}: {'ok' if passed else 'FAILED'}")
+
+    whole_error = np.mean(np.abs(whole.bigram_count(exact.bigram_keys) - exact.bigram_counts))
+    print(f"Mean absolute error: {np.mean(np.abs(estimates - exact.bigram_counts)):.3f} merged from {shards} shards, "
+          f"{whole_error:.3f} trained on the whole file")
+
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the accuracy of approximate bigram counts against memory.")
+    parser.add_argument("train_file", nargs="?", default="training.txt", help="Training corpus, one sentence per line")
+    parser.add_argument("--budgets", type=float, nargs="+", default=[1e4, 1e5, 1e6, 1e7],
+                        help="Memory budgets for the sketch in bytes")
+    parser.add_argument("--top-k", type=int, default=10000, help="Number of bigrams to keep exactly")
+    parser.add_argument("--check-merge", type=int, metavar="SHARDS",
+                        help="Instead check that merging models of this many shards matches training on the whole "
+                             "file, with the first budget")
+    args = parser.parse_args()
+
+    if args.check_merge:
+        sys.exit(0 if check_merge(args.train_file, int(args.budgets[0]), args.top_k, args.check_merge) else 1)
+    accuracy_curve(args.train_file, [int(budget) for budget in args.budgets], args.top_k)
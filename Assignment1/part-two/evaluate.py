@@ -0,0 +1,309 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from itertools import islice
+
+import numpy as np
+
+from bigram import BigramModel, find_line_shards, read_sentences
+from profiling import profiler
+
+
+# This script evaluates a bigram model on a held-out corpus of any size. The corpus is streamed in shards of whole lines
+# that are scored by a pool of processes, each of which memory maps the same saved model, so the count arrays are shared
+# through the page cache rather than copied into every process. The log probabilities are summed rather than the
+# probabilities multiplied, so the corpus perplexity does not underflow however long the corpus is. The statistics of
+# each shard are written as a line of JSON as soon as it is scored, so a long evaluation can be followed while it runs
+# and resumed from the last shard written if it is stopped.
+
+# The default size in bytes of the shards, the number of sentences scored at once and the upper bounds of the sentence
+# length buckets, in words.
+SHARD_SIZE = 4 << 20
+BATCH_SIZE = 10000
+LENGTH_BUCKETS = (5, 10, 20, 40)
+
+# The totals kept of the sentences scored. The log probability and the scored bigrams are of the sentences with a
+# probability above 0, the zero probability sentences are counted instead, which only happens without smoothing.
+TOTALS = ("sentences", "words", "oov", "bigrams", "scored_bigrams", "log_probability", "zero_probability")
+
+# The model used by each process of the pool, loaded once when the process starts.
+MODEL = None
+
+
+def load_model(model_file):
+    """
+    This function loads the model in a process of the pool, memory mapping the count arrays.
+    :param model_file: The model saved by BigramModel.save
+    """
+    global MODEL
+    MODEL = BigramModel.load(model_file)
+
+
+def empty_stats(buckets):
+    """
+    This function returns the statistics of no sentences.
+    :param buckets: The upper bounds of the sentence length buckets
+    :return: Dictionary of the totals, with the same totals for each length bucket
+    """
+    def totals():
+        return {key: 0 for key in TOTALS} | {"log_probability": 0.0}
+
+    return {**totals(), "buckets": {name: totals() for name in bucket_names(buckets)}}
+
+
+def bucket_names(buckets):
+    """
+    This function names the sentence length buckets by the range of lengths in each, e.g. 1-5, 6-10 and 41+.
+    :param buckets: The upper bounds of the buckets
+    :return: List of the names
+    """
+    lower = [1] + [bound + 1 for bound in buckets]
+    return [f"{low}-{high}" for low, high in zip(lower, buckets)] + [f"{lower[-1]}+"]
+
+
+def score_shard(shard):
+    """
+    This function scores the sentences in a shard of the corpus with the model of the process, a batch at a time. It is
+    run by the processes of the pool.
+    :param shard: The path, the start and end byte offsets of the shard, the smoothing, k, backoff, the length buckets
+    and the batch size
+    :return: The start and end of the shard, the statistics of its sentences and the time taken to score them
+    """
+    path, start, end, smoothing, k, backoff, buckets, batch_size = shard
+    started = time.perf_counter()
+    stats = empty_stats(buckets)
+    names = bucket_names(buckets)
+    sentences = read_sentences(path, start, end)
+
+    while batch := list(islice(sentences, batch_size)):
+        words = []
+        lengths = []
+
+        # Split each sentence into words, sentences with no words are not counted.
+        for sentence in batch:
+            split = sentence.split()
+            if split:
+                words += split
+                lengths.append(len(split))
+
+        if not lengths:
+            continue
+
+        log_probability, ids = MODEL.score_words(words, lengths, smoothing, k, backoff)
+        lengths = np.array(lengths, dtype=np.int64)
+        sentence_of = np.repeat(np.arange(len(lengths)), lengths)
+        oov = np.bincount(sentence_of, weights=ids < 0, minlength=len(lengths)).astype(np.int64)
+
+        # A sentence with a probability of 0 has a log probability of -inf, which is counted rather than summed so the
+        # log probability of the other sentences is still known.
+        zero = np.isneginf(log_probability)
+        bucket_of = np.searchsorted(np.array(buckets), lengths)
+
+        for totals, keep in [(stats, np.ones(len(lengths), dtype=bool))] + \
+                [(stats["buckets"][name], bucket_of == i) for i, name in enumerate(names)]:
+            totals["sentences"] += int(keep.sum())
+            totals["words"] += int(lengths[keep].sum())
+            totals["oov"] += int(oov[keep].sum())
+            totals["bigrams"] += int((lengths[keep] - 1).sum())
+            totals["scored_bigrams"] += int((lengths[keep & ~zero] - 1).sum())
+            totals["log_probability"] += float(log_probability[keep & ~zero].sum())
+            totals["zero_probability"] += int((keep & zero).sum())
+
+    return start, end, stats, time.perf_counter() - started
+
+
+def add_stats(total, stats):
+    """
+    This function adds the statistics of a shard to the running totals.
+    :param total: The running totals, which are changed
+    :param stats: The statistics of the shard
+    """
+    for totals, shard_totals in [(total, stats)] + [(total["buckets"][name], stats["buckets"][name])
+                                                    for name in total["buckets"]]:
+        for key in TOTALS:
+            totals[key] += shard_totals[key]
+
+
+def summarise(totals):
+    """
+    This function computes the perplexity and OOV rate from the totals of some sentences. The perplexity is
+    exp(-log probability / bigrams), which is infinite if any sentence has a probability of 0. The perplexity of the
+    sentences with a probability above 0 is also given.
+    :param totals: The totals of the sentences
+    :return: Dictionary of the totals, the perplexity and the OOV rate
+    """
+    nonzero = math.exp(-totals["log_probability"] / totals["scored_bigrams"]) if totals["scored_bigrams"] else None
+    return {**{key: totals[key] for key in TOTALS},
+            "perplexity": math.inf if totals["zero_probability"] else nonzero,
+            "perplexity_of_nonzero": nonzero,
+            "oov_rate": totals["oov"] / totals["words"] if totals["words"] else None}
+
+
+def read_checkpoint(output, config):
+    """
+    This function reads the results of an earlier evaluation with the same config from its output file, so it can be
+    resumed. A line that was only partly written when the evaluation stopped is removed from the file.
+    :param output: The output file
+    :param config: The config of this evaluation, which must match the config the file was written with
+    :return: The byte offset of the corpus to resume from, the totals so far and whether the evaluation had finished
+    """
+    total = empty_stats(config["length_buckets"])
+    offset = 0
+    finished = False
+    good = 0
+
+    with open(output, "rb") as f:
+        for i, line in enumerate(f):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+
+            if i == 0 and record != {"config": config}:
+                raise ValueError(f"{output} was written by an evaluation with a different config, {record}")
+            if "shard" in record:
+                add_stats(total, record["shard"])
+                offset = record["end"]
+            finished = finished or "total" in record
+            good += len(line)
+
+    # Drop anything after the last complete line.
+    with open(output, "r+b") as f:
+        f.truncate(good)
+
+    return offset, total, finished
+
+
+def evaluate(test_file, model_file, output, jobs: int = 1, smoothing: str = "add-k", k: float = 1.0,
+             backoff: float = 0.4, buckets=LENGTH_BUCKETS, shard_size: int = SHARD_SIZE, batch_size: int = BATCH_SIZE,
+             resume: bool = False, model_name: str = None):
+    """
+    This function evaluates a saved model on a held-out corpus, writing the statistics of each shard to the output file
+    as a line of JSON as soon as it is scored, with the perplexity so far, and a line with the totals when it finishes.
+    The first line of the file holds the config of the evaluation. With resume, an evaluation with the same config that
+    was stopped carries on from the last shard in the output file, otherwise the file is written from the start.
+    :param test_file: The held-out corpus, one sentence per line
+    :param model_file: The model saved by BigramModel.save
+    :param output: The JSONL file to write the results to
+    :param jobs: The number of processes to score with
+    :param smoothing: The smoothing for unseen bigrams, one of None, "add-k" or "backoff", see BigramModel.score_batch
+    :param k: The count added for add-k smoothing
+    :param backoff: The backoff factor
+    :param buckets: The upper bounds of the sentence length buckets, in words
+    :param shard_size: The size in bytes of the shards of the corpus
+    :param batch_size: The number of sentences to score at once
+    :param resume: Whether to resume from the output file
+    :param model_name: The name of the model in the config, the path of the model file by default
+    :return: Dictionary of the totals, perplexity and OOV rate, of all the sentences and of each length bucket
+    """
+    buckets = sorted(buckets)
+    config = {"test_file": os.path.abspath(test_file), "test_size": os.path.getsize(test_file),
+              "model": model_name or os.path.abspath(model_file), "smoothing": smoothing, "k": k, "backoff": backoff,
+              "length_buckets": buckets}
+
+    if resume and os.path.exists(output) and os.path.getsize(output):
+        offset, total, finished = read_checkpoint(output, config)
+        mode = "a"
+    else:
+        offset, total, finished = 0, empty_stats(buckets), False
+        mode = "w"
+
+    size = config["test_size"]
+    shards = [(test_file, start, end, smoothing, k, backoff, buckets, batch_size)
+              for start, end in find_line_shards(test_file, shard_size, offset)] if offset < size and not finished \
+        else []
+
+    with open(output, mode) as o:
+        # The config is the first line of the file. A resumed file can be empty if the evaluation stopped while the
+        # config was being written, as read_checkpoint removes the part that was written.
+        if o.tell() == 0:
+            o.write(json.dumps({"config": config}) + "\n")
+
+        if shards:
+            # With one job the shards are scored in this process, otherwise each process of the pool loads the model.
+            if jobs > 1:
+                pool = multiprocessing.Pool(jobs, initializer=load_model, initargs=(model_file,))
+                results = pool.imap(score_shard, shards)
+            else:
+                pool = None
+                load_model(model_file)
+                results = map(score_shard, shards)
+
+            try:
+                # The shards are written in order, so the end of the last shard written is where to resume from.
+                for start, end, stats, seconds in profiler.iterate("evaluate.score", results, "shards"):
+                    add_stats(total, stats)
+                    progress = summarise(total)
+                    o.write(json.dumps({"start": start, "end": end, "seconds": seconds, "shard": stats,
+                                        "progress": end / size, "perplexity": progress["perplexity"],
+                                        "oov_rate": progress["oov_rate"]}) + "\n")
+                    o.flush()
+            finally:
+                if pool:
+                    pool.terminate()
+                    pool.join()
+
+        result = {**summarise(total), "buckets": {name: summarise(totals) for name, totals in total["buckets"].items()}}
+        if not finished:
+            o.write(json.dumps({"total": result}) + "\n")
+
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the perplexity and OOV rate of a bigram model on a held-out "
+                                                 "corpus, streaming it across a pool of processes.")
+    parser.add_argument("test_file", help="Held-out corpus, one sentence per line")
+    parser.add_argument("--model", help="Model saved with bigram.py --save")
+    parser.add_argument("--train", help="Training corpus to train a model on instead of loading one")
+    parser.add_argument("--output", default="evaluation.jsonl", help="JSONL file to write the results to")
+    parser.add_argument("--resume", action="store_true", help="Resume an evaluation that was stopped from --output")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of processes to score with")
+    parser.add_argument("--smoothing", default="add-k", choices=["add-k", "backoff", "none"],
+                        help="Smoothing for unseen bigrams")
+    parser.add_argument("--k", type=float, default=1.0, help="Count added for add-k smoothing")
+    parser.add_argument("--backoff", type=float, default=0.4, help="Backoff factor")
+    parser.add_argument("--buckets", type=int, nargs="+", default=list(LENGTH_BUCKETS),
+                        help="Upper bounds of the sentence length buckets, in words")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Size in bytes of the shards of the corpus")
+    parser.add_argument("--profile", help="Write the time, items and memory of each stage to this JSON file, or run "
+                                          "cProfile and write its statistics if it ends in .prof")
+    args = parser.parse_args()
+
+    if bool(args.model) == bool(args.train):
+        parser.error("Give either --model or --train")
+
+    with profiler.session(args.profile), tempfile.TemporaryDirectory() as directory:
+        model_file = args.model
+
+        # A model trained here is saved so the processes can memory map it. Training again gives the same model, so an
+        # evaluation with --train can be resumed with --train.
+        if args.train:
+            model = BigramModel()
+            model.train(read_sentences(args.train))
+            model_file = os.path.join(directory, "model.bin")
+            model.save(model_file)
+
+        summary = evaluate(args.test_file, model_file, args.output, args.jobs,
+                           None if args.smoothing == "none" else args.smoothing, args.k, args.backoff, args.buckets,
+                           args.shard_size, resume=args.resume,
+                           model_name=f"trained on {os.path.abspath(args.train)}" if args.train else None)
+
+    if summary["perplexity"] is None:
+        parser.exit(message="There are no bigrams in the test file\n")
+
+    print(f"{summary['sentences']} sentences, {summary['words']} words, perplexity {summary['perplexity']:.2f}, "
+          f"OOV rate {summary['oov_rate']:.2%}")
+    if summary["zero_probability"]:
+        print(f"{summary['zero_probability']} sentences have a probability of 0, the perplexity of the others is "
+              f"{summary['perplexity_of_nonzero']:.2f}")
+    for name, bucket in summary["buckets"].items():
+        if bucket["perplexity"] is not None:
+            print(f"  {name} words: {bucket['sentences']} sentences, perplexity {bucket['perplexity']:.2f}, OOV rate "
+                  f"{bucket['oov_rate']:.2%}")
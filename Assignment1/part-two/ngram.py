@@ -0,0 +1,401 @@
+import argparse
+import math
+import struct
+import time
+import tracemalloc
+
+import numpy as np
+
+from bigram import BigramModel, merge_counts, pack, read_sentences, unpack
+
+# The start of a saved model file, and the format of the header. The header holds the order of the model, the number of
+# words and the size of the vocabulary text in bytes.
+MAGIC = b"NGRAM001"
+HEADER = "<8sQQQ"
+
+
+class NGramModel(BigramModel):
+    """
+    The NGramModel class extends the BigramModel to n-grams of any order. The counts are stored as a trie with a level
+    for each order. The unigrams and bigrams are stored as in the BigramModel, and each n-gram of a higher order is
+    stored as a key that packs the index of its prefix in the level below with the id of its last word. The keys of each
+    level are sorted, so an n-gram is found by searching each level in turn and an n-gram shares the storage of its
+    prefix with every other n-gram that starts the same way.
+    """
+
+    def __init__(self, order: int = 3):
+        """
+        :param order: The order of the model, the largest n-grams that are counted
+        """
+        super().__init__()
+
+        if order < 2:
+            raise ValueError("The order of an NGramModel must be at least 2")
+        self.order = order
+
+        # The sorted keys and counts of the n-grams of each order from 3 up to the order of the model
+        self.levels = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)) for _ in range(order - 2)]
+
+    def count_ids(self, ids, sentence_of):
+        """
+        This function adds the counts of the n-grams of every order in a batch of sentences that have been converted to
+        ids. Adding new n-grams to a level moves the n-grams after them, so the prefix indexes of the level above are
+        updated to match.
+        :param ids: Array of the ids of the words of all the sentences
+        :param sentence_of: Array of the index of the sentence each word is in
+        """
+        previous = self.bigram_keys
+        super().count_ids(ids, sentence_of)
+        current = self.bigram_keys
+
+        # The index in the current level of the n-gram that starts at each word, -1 where the n-gram would run past the
+        # end of the sentence.
+        nodes = np.full(len(ids), -1, dtype=np.int64)
+        is_bigram = sentence_of[:-1] == sentence_of[1:]
+        nodes[:-1][is_bigram] = np.searchsorted(current, pack(ids[:-1], ids[1:])[is_bigram])
+
+        for level, n in enumerate(range(3, self.order + 1)):
+            keys, counts = self.levels[level]
+
+            # Move the prefixes of the existing n-grams to where they are now in the level below.
+            prefixes, words = unpack(keys)
+            keys = pack(np.searchsorted(current, previous[prefixes]), words)
+            previous = keys
+
+            # Each n-gram is the (n - 1)-gram starting at a word followed by the word n - 1 places on, if both are in
+            # the same sentence.
+            size = max(len(ids) - n + 1, 0)
+            is_ngram = sentence_of[:size] == sentence_of[n - 1:]
+            batch_keys = pack(nodes[:size][is_ngram], ids[n - 1:][is_ngram])
+
+            batch_keys_unique, batch_counts = np.unique(batch_keys, return_counts=True)
+            keys, counts = merge_counts(np.concatenate([keys, batch_keys_unique]),
+                                        np.concatenate([counts, batch_counts]))
+            self.levels[level] = (keys, counts)
+            current = keys
+
+            # Find the index of the n-gram starting at each word for the next level.
+            nodes = np.full(len(ids), -1, dtype=np.int64)
+            nodes[:size][is_ngram] = np.searchsorted(keys, batch_keys)
+
+    def ngram_counts(self, ngrams):
+        """
+        This function looks up the counts of n-grams of the same length, n-grams not in the training corpus have a
+        count of 0. The n-grams are found by searching each level of the trie in turn.
+        :param ngrams: 2D array of word ids, one n-gram per row, words not in the vocabulary have the id -1
+        :return: Array of counts
+        """
+        ngrams = np.asarray(ngrams, dtype=np.int64)
+        length = ngrams.shape[1]
+
+        if length > self.order:
+            raise ValueError(f"Cannot count {length}-grams with a model of order {self.order}")
+
+        # The n-grams are looked up in sorted order as searching for sorted keys is much faster.
+        order = np.lexsort(ngrams.T[::-1])
+        ngrams = ngrams[order]
+
+        # Start from the unigrams, the index of a unigram is the word id.
+        nodes = ngrams[:, 0].copy()
+        found = (nodes >= 0) & (nodes < len(self.unigram_counts))
+        counts = self.unigram_counts
+
+        levels = [(self.bigram_keys, self.bigram_counts)] + self.levels
+        for i in range(1, length):
+            keys, counts = levels[i - 1]
+
+            # Search for the key of the prefix and the next word in this level.
+            search = pack(nodes, np.maximum(ngrams[:, i], 0))
+            nodes = np.searchsorted(keys, search)
+            found &= (ngrams[:, i] >= 0) & (nodes < len(keys))
+            found[found] = keys[nodes[found]] == search[found]
+
+        result = np.zeros(len(ngrams), dtype=np.int64)
+        result[order[found]] = counts[nodes[found]]
+        return result
+
+    def count(self, context, word=None):
+        """
+        This function looks up the count of a context, or of a word following a context.
+        :param context: List of words
+        :param word: The word following the context
+        :return: The count
+        """
+        words = list(context) + ([word] if word is not None else [])
+        if not words:
+            return int(self.unigram_counts.sum())
+        return int(self.ngram_counts([self.lookup(words)])[0])
+
+    def predict_sentence(self, sentence):
+        """
+        This function takes a new sentence and computes the probability of this sentence using the counts from the
+        train corpus. Each word after the first is predicted from up to order - 1 words before it.
+        :param sentence: The sentence for which a probability should be computed.
+        """
+        probabilities = []
+        words = sentence.split()
+
+        for i in range(1, len(words)):
+            context = words[max(i - self.order + 1, 0):i]
+            count_of_ngram = self.count(context, words[i])
+
+            # Only n-grams that appear in the training data can be given a probability as there is no smoothing.
+            if not count_of_ngram:
+                raise KeyError(" ".join(context + [words[i]]))
+
+            probabilities.append(count_of_ngram / self.count(context))
+
+        return math.prod(probabilities)
+
+    def score_batch(self, sentences, smoothing="add-k", k=1.0, backoff=0.4):
+        """
+        This function computes the log probability and perplexity of a batch of sentences at once. Each word after the
+        first is predicted from up to order - 1 words before it, and the counts for each order are looked up for all
+        the words together.
+        The n-grams that are not in the training corpus are handled by the smoothing:
+            None: The n-gram has a probability of 0, giving a log probability of -inf.
+            "add-k": k is added to every n-gram count, P(w|context) = (C(context, w) + k) / (C(context) + kV).
+            "backoff": Unseen n-grams back off to the next lower order, multiplying by the backoff factor each time, down
+            to the add-k unigram probability of the word.
+        :param sentences: List of sentences to score
+        :param smoothing: The smoothing for unseen n-grams, one of None, "add-k" or "backoff"
+        :param k: The count added to each n-gram for add-k, or to each word for the backoff unigram probability
+        :param backoff: The factor the probability is multiplied by each time it backs off to a lower order
+        :return: Arrays of the log probability and the perplexity of each sentence
+        """
+        if smoothing not in (None, "add-k", "backoff"):
+            raise ValueError(f"Unknown smoothing {smoothing}, expected None, 'add-k' or 'backoff'")
+
+        words = []
+        lengths = []
+
+        for sentence in sentences:
+            split = sentence.split()
+            words += split
+            lengths.append(len(split))
+
+        ids = np.array(self.lookup(words), dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.int64)
+
+        # The sentence of each word and its position in the sentence, each word after the first is predicted.
+        sentence_of = np.repeat(np.arange(len(lengths)), lengths)
+        position = np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        predicted = np.flatnonzero(position > 0)
+
+        # The highest order each word can be predicted with, limited by the number of words before it.
+        highest = np.minimum(position[predicted] + 1, self.order)
+        vocab_size = len(self.words) + 1
+        log_probabilities = np.full(len(predicted), -np.inf)
+        backed_off = np.zeros(len(predicted), dtype=bool)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for n in range(self.order, 1, -1):
+                rows = highest >= n
+                ends = predicted[rows]
+
+                # Look up the counts of the n-grams ending at each word and of their contexts.
+                ngrams = np.stack([ids[ends - n + 1 + j] for j in range(n)], axis=1)
+                count_of_ngram = self.ngram_counts(ngrams)
+                count_of_context = self.ngram_counts(ngrams[:, :-1])
+
+                if smoothing == "add-k":
+                    at_highest = highest[rows] == n
+                    log_probabilities[np.flatnonzero(rows)[at_highest]] = np.log(
+                        (count_of_ngram[at_highest] + k) / (count_of_context[at_highest] + k * vocab_size))
+                    continue
+
+                # The highest order that has been seen is used, each lower order is one more backoff.
+                use = ~backed_off[rows] & (count_of_ngram > 0)
+                if smoothing is None:
+                    use &= highest[rows] == n
+                index = np.flatnonzero(rows)[use]
+                log_probabilities[index] = (np.log(count_of_ngram[use] / count_of_context[use]) +
+                                            (highest[rows][use] - n) * math.log(backoff))
+                backed_off[index] = True
+
+            # Words that have not been seen after any context back off to the add-k unigram probability.
+            if smoothing == "backoff":
+                unseen = ~backed_off
+                count_of_word = np.zeros(len(predicted), dtype=np.int64)
+                known = ids[predicted] >= 0
+                count_of_word[known] = self.unigram_counts[ids[predicted][known]]
+                log_probabilities[unseen] = (np.log((count_of_word[unseen] + k) /
+                                                    (self.unigram_counts.sum() + k * vocab_size)) +
+                                             (highest[unseen] - 1) * math.log(backoff))
+
+        log_probability = np.bincount(sentence_of[predicted], weights=log_probabilities, minlength=len(lengths))
+        with np.errstate(over="ignore"):
+            perplexity = np.exp(-log_probability / np.maximum(lengths - 1, 1))
+
+        return log_probability, perplexity
+
+    def merge(self, other):
+        """
+        This function adds the counts of another model of the same order to this model, as BigramModel.merge does. The
+        n-grams of the other model are converted to the word ids of this model, and the prefix indexes of both models
+        are moved to where their prefixes are in the merged level below, as count_ids does for a new batch.
+        :param other: The NGramModel to add the counts of
+        :return: This model
+        """
+        other_order = getattr(other, "order", 2)
+        if other_order != self.order:
+            raise ValueError(f"Cannot merge a model of order {other_order} into one of order {self.order}")
+
+        previous = self.bigram_keys
+        super().merge(other)
+        current = self.bigram_keys
+
+        # The words of the other model are now all in the vocabulary, so this finds their ids without adding any. The
+        # bigram keys of the other model are converted to these ids, in the order of the other model.
+        ids = self.encode(other.words)
+        first, second = unpack(other.bigram_keys)
+        other_previous = pack(ids[first], ids[second])
+
+        for level, (other_keys, other_counts) in enumerate(other.levels):
+            keys, counts = self.levels[level]
+
+            # Move the prefixes of the n-grams of both models to where they are now in the level below.
+            prefixes, words = unpack(keys)
+            keys = pack(np.searchsorted(current, previous[prefixes]), words)
+            prefixes, words = unpack(other_keys)
+            other_keys = pack(np.searchsorted(current, other_previous[prefixes]), ids[words])
+            previous, other_previous = keys, other_keys
+
+            self.levels[level] = merge_counts(np.concatenate([keys, other_keys]),
+                                              np.concatenate([counts, other_counts]))
+            current = self.levels[level][0]
+
+        return self
+
+    def save(self, path):
+        """
+        This function saves the model to a binary file that can be loaded with NGramModel.load, in the same way as
+        BigramModel.save. The file has a header with the order and the size of the vocabulary, then the number of keys
+        in each level from the bigrams up, the unigram counts, the keys and counts of each level as 64-bit integers and
+        lastly the vocabulary as UTF-8 text with a word on each line, in the order of the word ids.
+        :param path: The file to save the model to
+        """
+        vocabulary = "\n".join(self.words).encode("utf-8")
+        levels = [(self.bigram_keys, self.bigram_counts)] + self.levels
+
+        with open(path, "wb") as f:
+            f.write(struct.pack(HEADER, MAGIC, self.order, len(self.words), len(vocabulary)))
+            f.write(np.array([len(keys) for keys, _ in levels], dtype="<i8").tobytes())
+            f.write(self.unigram_counts.astype("<i8").tobytes())
+            for keys, counts in levels:
+                f.write(keys.astype("<i8").tobytes())
+                f.write(counts.astype("<i8").tobytes())
+            f.write(vocabulary)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        This function loads a model saved by NGramModel.save. As with BigramModel.load the count arrays can be memory
+        mapped rather than read into memory.
+        :param path: The file to load the model from
+        :param mmap: Whether to memory map the count arrays or read them into memory
+        :return: The loaded NGramModel
+        """
+        data = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+
+        # Read the header, checking that this is a model file.
+        magic, order, vocab_size, vocabulary_size = struct.unpack_from(HEADER, data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a saved NGramModel")
+
+        # The number of keys in each level follows the header, then the arrays one after another, we take a view of
+        # each part of the file.
+        offset = struct.calcsize(HEADER)
+        sizes = data[offset:offset + 8 * (order - 1)].view("<i8").tolist()
+        offset += 8 * (order - 1)
+
+        arrays = []
+        for size in [vocab_size] + [size for size in sizes for _ in range(2)]:
+            arrays.append(data[offset:offset + 8 * size].view("<i8"))
+            offset += 8 * size
+
+        model = cls(order)
+        model.unigram_counts, model.bigram_keys, model.bigram_counts = arrays[:3]
+        model.levels = list(zip(arrays[3::2], arrays[4::2]))
+
+        # The vocabulary is rebuilt from the list of words, the id of each word is its position in the list.
+        if vocab_size:
+            model.words = bytes(data[offset:offset + vocabulary_size]).decode("utf-8").split("\n")
+            model.vocab = dict(zip(model.words, range(vocab_size)))
+
+        return model
+
+    def ngram_total(self):
+        """
+        This function counts the distinct n-grams stored for every order.
+        :return: The number of n-grams
+        """
+        return len(self.unigram_counts) + len(self.bigram_keys) + sum(len(keys) for keys, _ in self.levels)
+
+    def nbytes(self):
+        """
+        This function computes the memory used by the count arrays, not including the vocabulary.
+        :return: The size in bytes
+        """
+        arrays = [self.unigram_counts, self.bigram_keys, self.bigram_counts]
+        arrays += [array for level in self.levels for array in level]
+        return sum(array.nbytes for array in arrays)
+
+
+def benchmark(path, order, lookups=100000):
+    """
+    This function trains an NGramModel on a file and reports the memory used per stored n-gram, compared with storing
+    the counts in a dictionary keyed by the n-gram strings, and the time taken to look up n-grams of each order.
+    :param path: The training corpus, one sentence per line
+    :param order: The order of the model
+    :param lookups: The number of n-grams of each order to look up
+    """
+    start = time.perf_counter()
+    model = NGramModel(order)
+    model.train(read_sentences(path))
+    print(f"Trained an order {order} model in {time.perf_counter() - start:.2f}s")
+
+    ngrams = model.ngram_total()
+    print(f"{ngrams} n-grams in {model.nbytes() / 1e6:.1f}MB, {model.nbytes() / ngrams:.1f} bytes per n-gram")
+
+    # Count the same n-grams in a dictionary keyed by the n-gram strings to compare the memory.
+    tracemalloc.start()
+    counts = {}
+    for sentence in read_sentences(path):
+        words = sentence.split()
+        for n in range(1, order + 1):
+            for i in range(len(words) - n + 1):
+                key = " ".join(words[i:i + n])
+                counts[key] = counts.get(key, 0) + 1
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"Dictionary of strings: {size / 1e6:.1f}MB, {size / len(counts):.1f} bytes per n-gram")
+
+    # Look up a random sample of the n-grams of each order, first all at once and then one at a time.
+    rng = np.random.default_rng(0)
+    keys = list(counts)
+    for n in range(1, order + 1):
+        sample = [key.split() for key in rng.choice(keys, min(lookups, len(keys))) if key.count(" ") == n - 1]
+        if not sample:
+            continue
+        rows = np.array([model.lookup(words) for words in sample], dtype=np.int64)
+
+        start = time.perf_counter()
+        model.ngram_counts(rows)
+        batched = (time.perf_counter() - start) / len(rows)
+
+        start = time.perf_counter()
+        for words in sample[:1000]:
+            model.count(words)
+        single = (time.perf_counter() - start) / len(sample[:1000])
+
+        print(f"{n}-gram lookups: {batched * 1e9:.0f}ns each in a batch, {single * 1e6:.1f}us each one at a time")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the memory and lookup time of an NGramModel.")
+    parser.add_argument("train_file", nargs="?", default="training.txt", help="Training corpus, one sentence per line")
+    parser.add_argument("--order", type=int, default=3, help="The order of the model")
+    args = parser.parse_args()
+
+    benchmark(args.train_file, args.order)
@@ -0,0 +1,204 @@
+import argparse
+import multiprocessing
+import sys
+import time
+import traceback
+from functools import partial
+from itertools import islice
+from pathlib import Path
+
+from bigram import BigramModel
+from ngram import NGramModel
+
+# The sentence splitter is in part one, in the folder next to this one.
+sys.path.append(str(Path(__file__).resolve().parent.parent / "part-one"))
+from sentence_split import CHUNK_SIZE, find_files, stream_sentences
+from profiling import profiler
+
+
+# This script trains a bigram model straight from raw text, without writing the split sentences to a file and reading
+# them back. The text is read a chunk at a time, split into sentences, split into words and counted, one batch of
+# sentences at a time, so only the batches in flight and the counts are held in memory however large the corpus is.
+# Each stage is a generator that takes the batches of the stage before it, and the stages can be run in their own
+# processes connected by bounded queues, so the splitting of one batch overlaps with the counting of the last.
+
+# The number of sentences in a batch, and the most batches waiting between two stages run in their own processes.
+BATCH_SIZE = 10000
+QUEUE_SIZE = 4
+
+
+def split_batches(paths, batch_size: int = BATCH_SIZE, chunk_size: int = CHUNK_SIZE):
+    """
+    This generator reads raw text files a chunk at a time and splits them into sentences with stream_sentences, the
+    same as sentence_split.py. Directories are searched for .txt files as in sentence_split.py.
+    :param paths: List of files and directories
+    :param batch_size: The number of sentences in a batch
+    :param chunk_size: The number of characters to read from a file at a time
+    :return: generator of lists of sentences
+    """
+    def sentences():
+        for path in find_files(paths):
+            with open(path, encoding="utf-8") as f:
+                yield from stream_sentences(iter(lambda: f.read(chunk_size), ""))
+
+    sentences = sentences()
+    while batch := list(islice(sentences, batch_size)):
+        yield batch
+
+
+def tokenize_batches(batches, markers: bool = True, lowercase: bool = False):
+    """
+    This generator splits each batch of sentences into words on whitespace, the same as BigramModel.train. Sentences
+    with no words are dropped.
+    :param batches: Iterable of lists of sentences
+    :param markers: Whether to add <s> and </s> around each sentence, as in training.txt
+    :param lowercase: Whether to lowercase the words
+    :return: generator of the words of all the sentences of a batch and the number of words in each sentence
+    """
+    for batch in batches:
+        words = []
+        lengths = []
+
+        for sentence in batch:
+            split = (sentence.lower() if lowercase else sentence).split()
+            if not split:
+                continue
+            if markers:
+                split = ["<s>", *split, "</s>"]
+            words += split
+            lengths.append(len(split))
+
+        yield words, lengths
+
+
+class StageError(Exception):
+    """
+    The StageError class is raised when a stage run in its own process fails, with the traceback from that process.
+    """
+
+
+def run_stage(stage, input_queue, output_queue):
+    """
+    This function runs a stage in its own process. The items of the stage are put on the output queue, followed by
+    None when it is finished or a StageError if it failed.
+    :param stage: The stage, a function taking the iterable of items of the stage before it or, for the first stage, no
+    arguments
+    :param input_queue: The queue of the items of the stage before it, or None for the first stage
+    :param output_queue: The queue to put the items on
+    """
+    try:
+        items = stage() if input_queue is None else stage(queue_items(input_queue))
+        for item in items:
+            output_queue.put(item)
+        output_queue.put(None)
+    except BaseException:
+        output_queue.put(StageError(traceback.format_exc()))
+
+
+def queue_items(queue):
+    """
+    This generator takes the items from a queue filled by run_stage until the stage is finished.
+    :param queue: The queue
+    :return: generator of the items
+    """
+    while (item := queue.get()) is not None:
+        if isinstance(item, StageError):
+            raise item
+        yield item
+
+
+def run_pipeline(stages, workers: bool = False, queue_size: int = QUEUE_SIZE):
+    """
+    This generator chains stages, each a generator function taking the items of the stage before it. Without workers
+    the stages run in this process and each item is pulled through every stage in turn. With workers each stage runs
+    in its own process and passes its items to the next through a queue holding at most queue_size items, so the
+    stages run at the same time and a fast stage waits rather than filling the memory. The stages must then be
+    picklable, such as functions or partials of functions defined at the top level of a module.
+    :param stages: List of the stages, the first takes no arguments
+    :param workers: Whether to run each stage in its own process
+    :param queue_size: The most items waiting between two stages
+    :return: generator of the items of the last stage
+    """
+    if not workers:
+        items = stages[0]()
+        for stage in stages[1:]:
+            items = stage(items)
+        yield from items
+        return
+
+    processes = []
+    queue = None
+
+    try:
+        for stage in stages:
+            output_queue = multiprocessing.Queue(queue_size)
+            process = multiprocessing.Process(target=run_stage, args=(stage, queue, output_queue), daemon=True)
+            process.start()
+            processes.append(process)
+            queue = output_queue
+
+        yield from queue_items(queue)
+
+    finally:
+        # If the pipeline was stopped early the stages may be waiting to put items on a full queue.
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+def train_stream(paths, model: BigramModel = None, batch_size: int = BATCH_SIZE, markers: bool = True,
+                 lowercase: bool = False, workers: bool = False, queue_size: int = QUEUE_SIZE):
+    """
+    This function trains a model on raw text files through the pipeline read -> split into sentences -> split into
+    words -> count. The model is the same as splitting the files with sentence_split.py and training on the output, but
+    the sentences are never written to disk. With workers, splitting into sentences and into words each run in their
+    own process and the counting runs in this one.
+    :param paths: List of raw text files and directories of .txt files
+    :param model: The model to add the counts to, a new BigramModel by default
+    :param batch_size: The number of sentences in a batch
+    :param markers: Whether to add <s> and </s> around each sentence
+    :param lowercase: Whether to lowercase the words
+    :param workers: Whether to run the stages in their own processes
+    :param queue_size: The most batches waiting between two stages
+    :return: The trained model
+    """
+    model = model if model is not None else BigramModel()
+    stages = [partial(split_batches, paths, batch_size),
+              partial(tokenize_batches, markers=markers, lowercase=lowercase)]
+
+    batches = run_pipeline(stages, workers, queue_size)
+    for words, lengths in profiler.iterate("pipeline.read", batches, "batches"):
+        model.update_words(words, lengths)
+
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a bigram model on raw text, splitting it into sentences and "
+                                                 "counting them in one streaming pass.")
+    parser.add_argument("paths", nargs="+", help="Raw text files or directories of .txt files")
+    parser.add_argument("--order", type=int, default=2, help="Order of the model, more than 2 trains an NGramModel")
+    parser.add_argument("--save", help="Save the trained model to this file, which is loaded with BigramModel.load, "
+                                        "or NGramModel.load for --order 3 or more")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Number of sentences in a batch")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Most batches waiting between stages")
+    parser.add_argument("--workers", action="store_true", help="Run the splitting stages in their own processes")
+    parser.add_argument("--no-markers", action="store_true", help="Do not add <s> and </s> around each sentence")
+    parser.add_argument("--lowercase", action="store_true", help="Lowercase the words")
+    parser.add_argument("--profile", help="Write the time, items and memory of each stage to this JSON file, or run "
+                                          "cProfile and write its statistics if it ends in .prof")
+    args = parser.parse_args()
+
+    with profiler.session(args.profile):
+        start = time.perf_counter()
+        trained = train_stream(args.paths, NGramModel(args.order) if args.order > 2 else BigramModel(),
+                               args.batch_size, not args.no_markers, args.lowercase, args.workers, args.queue_size)
+        elapsed = time.perf_counter() - start
+
+        if args.save:
+            trained.save(args.save)
+
+    tokens = int(trained.unigram_counts.sum())
+    print(f"Counted {tokens} words, {len(trained.words)} unique, in {elapsed:.2f}s, {tokens / elapsed:.0f} words per "
+          f"second")
@@ -0,0 +1,212 @@
+import cProfile
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # The peak memory is not available on Windows.
+    resource = None
+
+
+# This module is shared by the scripts of the three parts of the assignment, which add this folder to sys.path to
+# import it. It records how long each stage of a script takes, how many items the stage went through and the peak memory
+# of the process so far when it finished, so a slow run can be traced to the stage that was slow. It is off unless a script is
+# run with --profile, and when off a stage costs only a function call.
+
+
+class Stage:
+    """
+    The Stage class holds the measurements of a stage, accumulated over every time the stage is run. The seconds include
+    the time of the stages run inside it, while the self seconds leave them out.
+    """
+
+    def __init__(self, running: list):
+        """
+        :param running: The list of the stages that are running, shared by all the stages of the profiler
+        """
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.counts = {}
+        self.process_peak_rss_mb = 0.0
+        self.started = 0.0
+
+        # Each running stage is kept with the time spent so far in the stages run inside it.
+        self.running = running
+
+    def add(self, **counts):
+        """
+        This function adds to the counts of the items the stage went through, such as documents or tokens.
+        :param counts: The number of each kind of item
+        """
+        for name, count in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + int(count)
+
+    def __enter__(self):
+        self.running.append([self, 0.0])
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.started
+        _, inner_seconds = self.running.pop()
+        if self.running:
+            self.running[-1][1] += seconds
+
+        self.seconds += seconds
+        self.self_seconds += seconds - inner_seconds
+        self.calls += 1
+
+        # This is the peak of the whole process up to the end of the stage, which can have been reached in an earlier
+        # stage, not the memory used by this stage.
+        self.process_peak_rss_mb = peak_rss_mb()
+
+    def report(self):
+        """
+        This function returns the measurements of the stage with the rate of each kind of item.
+        :return: Dictionary of the measurements
+        """
+        report = {"calls": self.calls, "seconds": self.seconds, "self_seconds": self.self_seconds, **self.counts}
+        for name, count in self.counts.items():
+            report[f"{name}_per_second"] = count / self.seconds if self.seconds else None
+        report["process_peak_rss_mb"] = self.process_peak_rss_mb
+        return report
+
+
+class NullStage:
+    """
+    The NullStage class is used in place of a Stage when profiling is off, it does nothing.
+    """
+
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Profiler:
+    """
+    The Profiler class keeps the stages of a run. Code is measured by running it in a stage,
+
+        with profiler.stage("train") as stage:
+            ...
+            stage.add(documents=n)
+
+    and the report of every stage is written when the run finishes. Stages can be nested, the seconds of a stage include
+    the time of the stages inside it, such as a count stage that reads its files in a read stage, and the self seconds
+    are the time spent in the stage itself.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.running = []
+        self.started = 0.0
+        self.profile = None
+
+    def stage(self, name):
+        """
+        This function returns the stage with a name, to be used in a with statement.
+        :param name: The name of the stage
+        :return: The Stage, or a NullStage when profiling is off
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        if name not in self.stages:
+            self.stages[name] = Stage(self.running)
+        return self.stages[name]
+
+    def iterate(self, name, iterable, item="items"):
+        """
+        This generator measures the time spent waiting for the items of an iterable, such as files being read, as a
+        stage of its own.
+        :param name: The name of the stage
+        :param iterable: The iterable
+        :param item: The name to count the items as
+        :return: The iterable, unchanged when profiling is off
+        """
+        if not self.enabled:
+            return iterable
+        return self.measure_iterable(self.stage(name), iter(iterable), item)
+
+    @staticmethod
+    def measure_iterable(stage, iterator, item):
+        while True:
+            with stage:
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+                stage.add(**{item: 1})
+            yield value
+
+    @contextmanager
+    def session(self, path=None):
+        """
+        This function profiles the code run inside it, if a path is given. A path ending in .prof also runs cProfile and
+        writes its statistics to the path, which can be read with pstats or snakeviz, and the report of the stages is
+        written to stderr. Any other path has the report of the stages written to it as JSON.
+        :param path: The file to write the report to, or None to not profile
+        """
+        if not path:
+            yield
+            return
+
+        self.enabled = True
+        self.started = time.perf_counter()
+        if path.endswith(".prof"):
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+        try:
+            yield
+        finally:
+            report = json.dumps(self.report(), indent=2)
+
+            if self.profile:
+                self.profile.disable()
+                self.profile.dump_stats(path)
+                print(report, file=sys.stderr)
+            else:
+                with open(path, "w") as f:
+                    f.write(report + "\n")
+
+            self.enabled = False
+
+    def report(self):
+        """
+        This function returns the report of the run and each of its stages.
+        :return: Dictionary of the total time, the peak memory and the measurements of each stage
+        """
+        return {
+            "seconds": time.perf_counter() - self.started,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {name: stage.report() for name, stage in self.stages.items()},
+        }
+
+
+def peak_rss_mb():
+    """
+    This function returns the peak resident memory of the process so far.
+    :return: The peak memory in megabytes, or None if it is not available
+    """
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+# The profiler used by all the scripts.
+profiler = Profiler()